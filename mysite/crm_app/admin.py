@@ -4,8 +4,13 @@ from .models import *
 admin.site.register(UserProfile)
 admin.site.register(Department)
 admin.site.register(Doctor)
+admin.site.register(DoctorWorkingHours)
 admin.site.register(Service)
 admin.site.register(Patient)
 admin.site.register(Appointment)
 admin.site.register(Payment)
-admin.site.register(Notification)
\ No newline at end of file
+admin.site.register(Notification)
+admin.site.register(NotificationOutbox)
+admin.site.register(UnreadNotificationCount)
+admin.site.register(NotificationArchive)
+admin.site.register(OutgoingMail)
\ No newline at end of file
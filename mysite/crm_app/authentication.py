@@ -0,0 +1,100 @@
+import hashlib
+
+from django.core.cache import caches
+from django.db import router
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+
+
+# в кэше — все поля пользователя, кроме секретов: профиль и
+# сериализаторы читают email, phone, username, и каждое отложенное поле
+# стоило бы отдельного запроса. Пароль проверяется только при входе.
+UNCACHED_FIELDS = ("password",)
+
+
+def _cached_field_names(model):
+    return [
+        field.attname
+        for field in model._meta.concrete_fields
+        if field.attname not in UNCACHED_FIELDS
+    ]
+
+
+def _cache():
+    return caches["auth"]
+
+
+def _generation_key(user_id):
+    return f"auth:gen:{user_id}"
+
+
+def invalidate_user(user_id):
+    """Сбросить кэш всех токенов пользователя (смена роли, деактивация)."""
+    key = _generation_key(user_id)
+    try:
+        _cache().incr(key)
+    except ValueError:
+        _cache().set(key, 1, timeout=None)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication без запроса UserProfile на каждый запрос.
+
+    Все поля пользователя, кроме пароля, кэшируются в кэше auth (срок —
+    AUTH_USER_CACHE_TIMEOUT) под ключом (пользователь, токен). Запись
+    хранит поколение пользователя; сохранение UserProfile увеличивает
+    поколение (invalidate_user), и старые записи перестают совпадать.
+    Оба ключа читаются одним get_many.
+
+    Пользователь собирается через from_db: отложен только пароль,
+    save() пишет только загруженные поля и хэш пароля не трогает.
+    """
+
+    def get_user(self, validated_token):
+        if api_settings.CHECK_REVOKE_TOKEN:
+            # нужна проверка хэша пароля — только из БД
+            return super().get_user(validated_token)
+
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            return super().get_user(validated_token)
+
+        token_key = validated_token.get(api_settings.JTI_CLAIM) or hashlib.sha256(
+            str(validated_token).encode()
+        ).hexdigest()
+        entry_key = f"auth:user:{user_id}:{token_key}"
+        generation_key = _generation_key(user_id)
+
+        found = _cache().get_many([entry_key, generation_key])
+        generation = found.get(generation_key, 0)
+        entry = found.get(entry_key)
+
+        # from_db ждёт значения в порядке полей модели
+        field_names = _cached_field_names(self.user_model)
+
+        if (
+            entry is None
+            or entry["generation"] != generation
+            # запись от прежнего набора полей (после миграции)
+            or entry.get("fields") != field_names
+        ):
+            user = super().get_user(validated_token)
+            _cache().set(
+                entry_key,
+                {
+                    "generation": generation,
+                    "fields": field_names,
+                    "values": [getattr(user, name) for name in field_names],
+                },
+            )
+            return user
+
+        user = self.user_model.from_db(
+            router.db_for_read(self.user_model), field_names, entry["values"]
+        )
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
@@ -0,0 +1,72 @@
+import math
+import random
+import time
+from collections import namedtuple
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+
+Cached = namedtuple("Cached", "value created hit")
+
+
+def get_or_compute(cache, key, compute, timeout=DEFAULT_TIMEOUT,
+                   lock_timeout=30, wait=10, beta=1.0):
+    """
+    Значение key из cache, иначе compute() — с защитой от лавины запросов.
+
+    * Раннее обновление (XFetch): незадолго до истечения срока один из
+      читателей с вероятностью, растущей к концу срока и длительности
+      compute(), пересчитывает значение заранее.
+    * Блокировка: пересчитывает тот, кто взял lock (cache.add). Остальные
+      отдают текущее значение, если оно есть, или ждут до wait секунд,
+      пока оно появится; потом считают сами. Нужен атомарный add — у
+      file-бэкенда его нет (см. mysite/cache_config.py).
+
+    Возвращает Cached(value, created, hit).
+    """
+    if timeout is DEFAULT_TIMEOUT:
+        timeout = cache.default_timeout
+
+    entry = cache.get(key)
+    if entry is not None and not _recompute_early(entry, beta):
+        return Cached(entry["value"], entry["created"], True)
+
+    lock_key = f"{key}:lock"
+    locked = cache.add(lock_key, 1, lock_timeout)
+    if not locked:
+        if entry is not None:
+            # пересчитывает другой процесс — отдаём текущее значение
+            return Cached(entry["value"], entry["created"], True)
+
+        deadline = time.monotonic() + wait
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            entry = cache.get(key)
+            if entry is not None:
+                return Cached(entry["value"], entry["created"], True)
+            locked = cache.add(lock_key, 1, lock_timeout)
+            if locked:
+                break
+
+    try:
+        started = time.time()
+        value = compute()
+        created = time.time()
+        cache.set(key, {
+            "value": value,
+            "created": created,
+            "delta": created - started,
+            "expires": created + timeout if timeout else None,
+        }, timeout)
+        return Cached(value, created, False)
+    finally:
+        if locked:
+            cache.delete(lock_key)
+
+
+def _recompute_early(entry, beta):
+    if entry["expires"] is None:
+        return False
+    # 1 - random() ∈ (0, 1]: логарифм определён
+    jitter = -entry["delta"] * beta * math.log(1 - random.random())
+    return time.time() + jitter >= entry["expires"]
@@ -0,0 +1,152 @@
+from datetime import timedelta
+
+from django.db.models import Q
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from .models import Appointment, AppointmentChange, AppointmentChangeWatermark
+
+
+# строк журнала за один ответ; остальное — следующим запросом (has_more)
+SYNC_BATCH = 500
+
+# транзакция с меньшим id может закоммититься позже большего: пропуски
+# в последних GAP_WINDOW id уходят в токен и перечитываются при каждом
+# опросе; пропуск старше окна считается откатом
+GAP_WINDOW = 1000
+
+# журнал старше удаляется (prune_appointment_changes); токен из
+# удалённой части — полная перезагрузка календаря
+RETENTION = timedelta(days=30)
+
+
+class SyncTokenExpired(APIException):
+    status_code = status.HTTP_410_GONE
+    default_detail = "Токен синхронизации устарел — загрузите календарь заново"
+    default_code = "sync_token_expired"
+
+
+def record(appointments, previous_doctor_id=None):
+    """
+    Изменение записей — строка журнала на каждую. Если запись ушла к
+    другому врачу, в ленту прежнего врача — tombstone.
+    """
+    rows = []
+    for appointment in appointments:
+        if previous_doctor_id and previous_doctor_id != appointment.doctor_id:
+            rows.append(AppointmentChange(
+                appointment_id=appointment.pk, doctor_id=previous_doctor_id, deleted=True,
+            ))
+        rows.append(AppointmentChange(
+            appointment_id=appointment.pk, doctor_id=appointment.doctor_id,
+        ))
+    AppointmentChange.objects.bulk_create(rows)
+
+
+def record_deleted(appointment):
+    AppointmentChange.objects.create(
+        appointment_id=appointment.pk, doctor_id=appointment.doctor_id, deleted=True,
+    )
+
+
+def parse_token(value):
+    """Токен: "<последний id>" или "<последний id>:<пропуск>,<пропуск>"."""
+    try:
+        high, _, gaps = str(value).partition(":")
+        high = int(high)
+        gaps = [int(gap) for gap in gaps.split(",")] if gaps else []
+    except (TypeError, ValueError):
+        raise ValidationError({"token": ["Неверный токен синхронизации"]})
+    if high < 0 or any(gap < 0 or gap >= high for gap in gaps):
+        raise ValidationError({"token": ["Неверный токен синхронизации"]})
+    return high, gaps
+
+
+def make_token(high, gaps):
+    if not gaps:
+        return str(high)
+    return f"{high}:{','.join(map(str, sorted(gaps)))}"
+
+
+def sync(token, serializer_class, doctor_id=None):
+    """
+    Записи, изменённые и удалённые после token.
+
+    Без token — только текущий токен: клиент загружает календарь
+    обычным запросом и дальше синхронизируется от него. По каждой записи
+    берётся последнее состояние из журнала: изменённые отдаются целиком
+    (serializer_class), удалённые — id в deleted.
+    """
+    watermark = AppointmentChangeWatermark.objects.values_list(
+        "pruned_through", flat=True
+    ).first() or 0
+    # какие id окна уже видны — до выборки строк, иначе строка,
+    # закоммиченная между запросами, не попала бы ни в ответ, ни в пропуски
+    present = set(
+        AppointmentChange.objects.order_by("-id").values_list("id", flat=True)[:GAP_WINDOW]
+    )
+    latest = max(present, default=watermark)
+    floor = max(latest - GAP_WINDOW, watermark)
+
+    if token is None:
+        return {
+            "sync_token": make_token(latest, set(range(floor + 1, latest + 1)) - present),
+            "changed": [],
+            "deleted": [],
+            "has_more": False,
+        }
+
+    high, gaps = parse_token(token)
+    if high < watermark:
+        raise SyncTokenExpired()
+
+    log = AppointmentChange.objects.filter(Q(id__gt=high) | Q(id__in=gaps), id__lte=latest)
+    if doctor_id is not None:
+        log = log.filter(doctor_id=doctor_id)
+    rows = list(
+        log.order_by("id").values_list("id", "appointment_id", "deleted")[:SYNC_BATCH + 1]
+    )
+    has_more = len(rows) > SYNC_BATCH
+    rows = rows[:SYNC_BATCH]
+
+    state = {}
+    for _, appointment_id, deleted in rows:
+        state[appointment_id] = deleted
+
+    changed = [pk for pk, deleted in state.items() if not deleted]
+    appointments = Appointment.objects.filter(pk__in=changed).select_related(
+        "patient", "doctor__user", "service", "department"
+    ).order_by("start_time", "id")
+    if doctor_id is not None:
+        appointments = appointments.filter(doctor_id=doctor_id)
+
+    # всё до cut просмотрено; пропуски дальше cut ещё не дошли до выборки
+    cut = rows[-1][0] if has_more else latest
+    seen = present.union(row[0] for row in rows)
+    missing = {
+        gap for gap in set(gaps).union(range(max(high, floor) + 1, max(cut, high) + 1))
+        if gap > floor and (gap > cut or gap not in seen)
+    }
+
+    return {
+        "sync_token": make_token(max(cut, high), missing),
+        "changed": serializer_class(appointments, many=True).data,
+        "deleted": [pk for pk, deleted in state.items() if deleted],
+        "has_more": has_more,
+    }
+
+
+def prune(before, batch_size=10000):
+    """Удаляет журнал старше before пачками; возвращает число строк."""
+    removed = 0
+    while True:
+        ids = list(
+            AppointmentChange.objects.filter(changed_at__lt=before)
+            .order_by("id").values_list("id", flat=True)[:batch_size]
+        )
+        if not ids:
+            return removed
+        removed += AppointmentChange.objects.filter(id__in=ids).delete()[0]
+        AppointmentChangeWatermark.objects.update_or_create(
+            pk=1, defaults={"pruned_through": ids[-1]},
+        )
@@ -0,0 +1,161 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Min, Q, Value
+from django.db.models.functions import Coalesce, Greatest, Least
+
+from .models import Appointment, PatientVisitStats
+
+
+STATUSES = tuple(status for status, _ in Appointment.STATUS_CHOICES)
+
+COUNT_FIELDS = ("total_count",) + tuple(f"{status}_count" for status in STATUSES)
+FIELDS = COUNT_FIELDS + ("first_appointment_at", "last_appointment_at")
+
+
+def patient_stats(patient_id):
+    """Блок stats истории пациента — одним чтением строки счётчиков."""
+    row = (
+        PatientVisitStats.objects
+        .filter(patient_id=patient_id)
+        .values(*COUNT_FIELDS)
+        .first()
+    ) or dict.fromkeys(COUNT_FIELDS, 0)
+    return {
+        "total": row["total_count"],
+        "queue": row["queue_count"],
+        "completed": row["completed_count"],
+        "cancelled": row["cancelled_count"],
+    }
+
+
+def appointment_added(appointment):
+    """Новая запись пациента (или запись, перенесённая на него)."""
+    appointments_added([appointment])
+
+
+def appointments_added(appointments):
+    """
+    Записи одного пациента с одним статусом — одним upsert. Для
+    bulk_create, который идёт мимо сигналов.
+    """
+    count = len(appointments)
+    patient_id = appointments[0].patient_id
+    status = appointments[0].status
+    first = min(appointment.created_at for appointment in appointments)
+    last = max(appointment.created_at for appointment in appointments)
+
+    changes = {
+        "total_count": F("total_count") + count,
+        f"{status}_count": F(f"{status}_count") + count,
+        "first_appointment_at": Least(
+            Coalesce("first_appointment_at", Value(first)), Value(first)
+        ),
+        "last_appointment_at": Greatest(
+            Coalesce("last_appointment_at", Value(last)), Value(last)
+        ),
+    }
+    rows = PatientVisitStats.objects.filter(patient_id=patient_id)
+    if rows.update(**changes):
+        return
+
+    try:
+        with transaction.atomic():
+            PatientVisitStats.objects.create(
+                patient_id=patient_id,
+                total_count=count,
+                first_appointment_at=first,
+                last_appointment_at=last,
+                **{f"{status}_count": count},
+            )
+    except IntegrityError:
+        # строку только что создал параллельный запрос
+        rows.update(**changes)
+
+
+def status_changed(patient_id, old_status, new_status):
+    PatientVisitStats.objects.filter(patient_id=patient_id).update(**{
+        f"{old_status}_count": F(f"{old_status}_count") - 1,
+        f"{new_status}_count": F(f"{new_status}_count") + 1,
+    })
+
+
+def _actual(patient_ids=None):
+    """Счётчики, посчитанные по Appointment (источник истины)."""
+    qs = Appointment.objects.all()
+    if patient_ids is not None:
+        qs = qs.filter(patient_id__in=patient_ids)
+    return (
+        qs.values("patient_id")
+        .annotate(
+            total_count=Count("id"),
+            **{
+                f"{status}_count": Count("id", filter=Q(status=status))
+                for status in STATUSES
+            },
+            first_appointment_at=Min("created_at"),
+            last_appointment_at=Max("created_at"),
+        )
+        .order_by("patient_id")
+    )
+
+
+def recount(*patient_ids):
+    """
+    Пересчитать строки пациентов по Appointment. Только UPDATE: при
+    каскадном удалении пациента новая строка не создаётся.
+    """
+    actual = {row.pop("patient_id"): row for row in _actual(patient_ids)}
+    empty = dict.fromkeys(COUNT_FIELDS, 0)
+    empty.update(first_appointment_at=None, last_appointment_at=None)
+
+    for patient_id in patient_ids:
+        PatientVisitStats.objects.filter(patient_id=patient_id).update(
+            **actual.get(patient_id, empty)
+        )
+
+
+def reconcile(batch_size=1000):
+    """
+    Сверить все счётчики с Appointment и исправить расхождения.
+    Возвращает число исправленных строк.
+    """
+    fixed = 0
+    with transaction.atomic():
+        batch = []
+        for row in _actual().iterator(chunk_size=batch_size):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                fixed += _reconcile_batch(batch)
+                batch = []
+        fixed += _reconcile_batch(batch)
+
+        # строки пациентов, у которых записей больше нет
+        stale = (
+            PatientVisitStats.objects
+            .filter(total_count__gt=0)
+            .exclude(patient_id__in=Appointment.objects.values("patient_id"))
+        )
+        fixed += stale.update(
+            **dict.fromkeys(COUNT_FIELDS, 0),
+            first_appointment_at=None,
+            last_appointment_at=None,
+        )
+    return fixed
+
+
+def _reconcile_batch(rows):
+    existing = PatientVisitStats.objects.in_bulk(
+        [row["patient_id"] for row in rows]
+    )
+    to_create, to_update = [], []
+    for row in rows:
+        stats = existing.get(row["patient_id"])
+        if stats is None:
+            to_create.append(PatientVisitStats(**row))
+        elif any(getattr(stats, field) != row[field] for field in FIELDS):
+            for field in FIELDS:
+                setattr(stats, field, row[field])
+            to_update.append(stats)
+
+    PatientVisitStats.objects.bulk_create(to_create)
+    PatientVisitStats.objects.bulk_update(to_update, FIELDS)
+    return len(to_create) + len(to_update)
@@ -0,0 +1,151 @@
+import hashlib
+import json
+import secrets
+from datetime import timedelta
+
+from django.core.files import File
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ReportExport
+from . import reports
+
+
+# задача running без heartbeat дольше этого — воркер упал
+STALE_AFTER = timedelta(minutes=30)
+
+# готовые и упавшие выгрузки (и их файлы) хранятся столько
+KEEP_FOR = timedelta(days=1)
+
+
+def _detailed(params, progress):
+    qs = reports.detailed_report_queryset(params)
+    total = qs.count()
+    return reports.detailed_report_xlsx(
+        qs,
+        progress=lambda done: progress(done * 100 // max(1, total)),
+    )
+
+
+def _doctor_close(params, progress):
+    return reports.doctor_close_xlsx(params.get("doctor"))
+
+
+def _summary(params, progress):
+    return reports.summary_xlsx(params.get("date_from"), params.get("date_to"))
+
+
+# kind -> (фильтры, построение файла)
+EXPORTS = {
+    "detailed": (
+        ("doctor", "department", "search", "period", "date_from", "date_to"),
+        _detailed,
+    ),
+    "doctor_close": (("doctor",), _doctor_close),
+    "summary": (("date_from", "date_to"), _summary),
+}
+
+
+def normalize_params(kind, params):
+    """Только известные фильтры, без пустых значений, всё строками."""
+    allowed, _ = EXPORTS[kind]
+    return {
+        key: str(params[key]).strip()
+        for key in sorted(allowed)
+        if params.get(key) not in (None, "")
+    }
+
+
+def params_hash(kind, params):
+    payload = json.dumps([kind, params], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def enqueue(kind, params, user=None):
+    """
+    Поставить выгрузку в очередь. Если такая же уже ждёт или строится —
+    вернуть её: (job, created).
+    """
+    params = normalize_params(kind, params)
+    key = params_hash(kind, params)
+    active = ReportExport.objects.filter(
+        params_hash=key, status__in=["queued", "running"]
+    )
+
+    job = active.first()
+    if job:
+        return job, False
+    try:
+        with transaction.atomic():
+            return ReportExport.objects.create(
+                kind=kind, params=params, params_hash=key, created_by=user,
+            ), True
+    except IntegrityError:
+        # параллельный запрос создал такую же задачу первым
+        return active.get(), False
+
+
+def claim_next():
+    """
+    Забрать следующую задачу из очереди. Условный UPDATE по статусу —
+    задачу получит только один воркер даже без SELECT ... FOR UPDATE.
+    """
+    queued = ReportExport.objects.filter(status="queued").order_by("created_at", "id")
+    for job_id in queued.values_list("id", flat=True)[:10]:
+        now = timezone.now()
+        claimed = ReportExport.objects.filter(pk=job_id, status="queued").update(
+            status="running", started_at=now, heartbeat_at=now, progress=0,
+        )
+        if claimed:
+            return ReportExport.objects.get(pk=job_id)
+    return None
+
+
+def run(job):
+    _, build = EXPORTS[job.kind]
+
+    def progress(percent):
+        ReportExport.objects.filter(pk=job.pk).update(
+            progress=min(percent, 99), heartbeat_at=timezone.now(),
+        )
+
+    try:
+        with build(job.params, progress) as output:
+            # файл отдаёт только выгрузка с авторизацией; имя всё равно не угадать
+            name = f"{job.kind}_{job.pk}_{secrets.token_hex(8)}.xlsx"
+            job.file.save(name, File(output), save=False)
+    except Exception as exc:
+        job.status = "failed"
+        job.error = str(exc)
+    else:
+        job.status = "done"
+        job.progress = 100
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "progress", "file", "error", "finished_at"])
+    return job
+
+
+def requeue_stale(stale_after=STALE_AFTER, now=None):
+    """
+    Вернуть в очередь задачи упавших воркеров: по возрасту heartbeat,
+    а не started_at — долгая выгрузка, которая пишет progress, жива.
+    """
+    cutoff = (now or timezone.now()) - stale_after
+    return ReportExport.objects.filter(
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff),
+        status="running",
+    ).update(status="queued", started_at=None, heartbeat_at=None)
+
+
+def expire(keep_for=KEEP_FOR, now=None):
+    """Удалить завершённые задачи старше keep_for вместе с файлами."""
+    cutoff = (now or timezone.now()) - keep_for
+    expired = list(
+        ReportExport.objects.filter(status__in=["done", "failed"], created_at__lt=cutoff)
+    )
+    for job in expired:
+        if job.file:
+            job.file.delete(save=False)
+    ReportExport.objects.filter(pk__in=[job.pk for job in expired]).delete()
+    return len(expired)
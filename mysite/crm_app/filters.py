@@ -1,11 +1,21 @@
+from datetime import timedelta
+
 import django_filters
 from .models import Appointment
+from .reports import day_start
 
 
 class AppointmentFilter(django_filters.FilterSet):
-    date_from = django_filters.DateFilter(field_name="start_time", lookup_expr="date__gte")
-    date_to = django_filters.DateFilter(field_name="start_time", lookup_expr="date__lte")
+    # границы дня в часовом поясе клиники — фильтр по индексу start_time
+    date_from = django_filters.DateFilter(method="filter_date_from")
+    date_to = django_filters.DateFilter(method="filter_date_to")
 
     class Meta:
         model = Appointment
         fields = ["doctor", "department", "status"]
+
+    def filter_date_from(self, qs, name, value):
+        return qs.filter(start_time__gte=day_start(value))
+
+    def filter_date_to(self, qs, name, value):
+        return qs.filter(start_time__lt=day_start(value) + timedelta(days=1))
@@ -0,0 +1,127 @@
+"""
+Очередь исходящих писем (OutgoingMail).
+
+Запрос только пишет строку — время ответа от SMTP не зависит. Воркер
+run_mail_outbox забирает готовые письма пачкой, отправляет их через одно
+соединение бэкенда (EMAIL_BACKEND) и при ошибке откладывает письмо с
+растущей задержкой; после MAX_ATTEMPTS письмо остаётся в статусе failed.
+"""
+import smtplib
+from datetime import timedelta
+
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutgoingMail
+
+
+# писем за одно соединение
+MAIL_BATCH = 50
+
+MAX_ATTEMPTS = 6
+
+# задержка повтора: 30 с, 1 мин, 2 мин, ... но не больше часа
+BACKOFF_BASE = timedelta(seconds=30)
+BACKOFF_MAX = timedelta(hours=1)
+
+# письмо «в отправке» дольше этого — воркер упал, вернуть в очередь
+STALE_AFTER = timedelta(minutes=10)
+
+
+def enqueue(subject, body, recipients, from_email):
+    return OutgoingMail.objects.create(
+        subject=subject, body=body, from_email=from_email, recipients=list(recipients),
+    )
+
+
+def backoff(attempts):
+    return min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+
+
+def claim(batch_size=MAIL_BATCH, now=None):
+    """
+    Забрать готовые письма: статус sending одним UPDATE. Параллельные
+    воркеры на Postgres берут разные строки (SKIP LOCKED).
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        ids = list(
+            OutgoingMail.objects
+            .select_for_update(skip_locked=True)
+            .filter(status="queued", next_attempt_at__lte=now)
+            .order_by("next_attempt_at", "id")
+            .values_list("id", flat=True)[:batch_size]
+        )
+        if not ids:
+            return []
+        OutgoingMail.objects.filter(pk__in=ids).update(status="sending", claimed_at=now)
+    return list(OutgoingMail.objects.filter(pk__in=ids).order_by("id"))
+
+
+def send_batch(mails, now=None):
+    """
+    Пачка через одно соединение. Отправленные удаляются (в письме код
+    сброса — хранить незачем), остальные — на повтор. Возвращает число
+    отправленных.
+    """
+    now = now or timezone.now()
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as exc:
+        # сервер недоступен — вся пачка на повтор
+        for mail in mails:
+            _failed(mail, exc, now)
+        return 0
+
+    sent = []
+    try:
+        for mail in mails:
+            message = EmailMessage(
+                mail.subject, mail.body, mail.from_email, mail.recipients,
+                connection=connection,
+            )
+            try:
+                try:
+                    message.send()
+                except smtplib.SMTPServerDisconnected:
+                    # сервер закрыл соединение посреди пачки — новое и повтор
+                    connection.close()
+                    connection.open()
+                    message.send()
+            except Exception as exc:
+                _failed(mail, exc, now)
+            else:
+                sent.append(mail.pk)
+    finally:
+        connection.close()
+
+    OutgoingMail.objects.filter(pk__in=sent).delete()
+    return len(sent)
+
+
+def _failed(mail, error, now):
+    attempts = mail.attempts + 1
+    OutgoingMail.objects.filter(pk=mail.pk).update(
+        attempts=attempts,
+        status="failed" if attempts >= MAX_ATTEMPTS else "queued",
+        next_attempt_at=now + backoff(attempts),
+        claimed_at=None,
+        last_error=f"{type(error).__name__}: {error}",
+    )
+
+
+def process_pending(batch_size=MAIL_BATCH, now=None):
+    """Одна пачка; возвращает число забранных писем."""
+    mails = claim(batch_size, now)
+    if mails:
+        send_batch(mails, now)
+    return len(mails)
+
+
+def requeue_stale(now=None):
+    now = now or timezone.now()
+    return OutgoingMail.objects.filter(
+        status="sending", claimed_at__lt=now - STALE_AFTER
+    ).update(status="queued", claimed_at=None)
@@ -0,0 +1,313 @@
+import statistics
+import time
+from datetime import time as clock, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from crm_app import counters
+from crm_app.models import *
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from crm_app.authentication import CachedJWTAuthentication
+from crm_app.views import (
+    AdminAnalyticsAPIView,
+    AdminCalendarListAPIView,
+    DoctorCalendarAPIView,
+    AdminAppointmentListAPIView,
+    AdminFreeSlotsAPIView,
+    DoctorProfileAPIView,
+    ReceptionistProfileAPIView,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Замер времени ответа эндпоинтов на растущем объёме данных. "
+        "Данные создаются в транзакции и по умолчанию откатываются."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("scenario", choices=["analytics", "auth", "calendar", "free_slots"])
+        parser.add_argument(
+            "--sizes", default="10000,100000,1000000",
+            help="объёмы данных через запятую",
+        )
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument(
+            "--keep", action="store_true",
+            help="не откатывать созданные данные",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted(int(size) for size in options["sizes"].split(","))
+        except ValueError:
+            raise CommandError("--sizes: ожидаются числа через запятую")
+
+        self.repeat = options["repeat"]
+        self.factory = APIRequestFactory()
+
+        with transaction.atomic():
+            self.clinic = self._clinic()
+            getattr(self, f"bench_{options['scenario']}")(sizes)
+            if not options["keep"]:
+                transaction.set_rollback(True)
+
+    # ===== СЦЕНАРИИ =====
+    def bench_analytics(self, sizes):
+        """
+        Пациенты с записями в прошлом растут до sizes[-1], окно аналитики
+        (неделя) остаётся одинаковым — время ответа должно быть ровным.
+        """
+        for i in range(20):
+            self._appointment(self._patient(f"Текущий {i}"), timezone.now())
+
+        view = AdminAnalyticsAPIView.as_view()
+        self._header("пациентов")
+        seeded = 0
+        for size in sizes:
+            seeded += self._seed_history(size - seeded)
+            ms, queries = self._measure(view, "/admin_role/analytics/?period=month")
+            self._row(size, ms, queries)
+
+    def bench_auth(self, sizes):
+        """
+        Горячие списки с настоящим JWT-заголовком: JWTAuthentication
+        (UserProfile из БД на каждый запрос) против CachedJWTAuthentication.
+        sizes — число записей в календаре.
+        """
+        receptionist = UserProfile.objects.create(
+            username="bench-receptionist", email="reg@bench.kg",
+            phone="+996700000000", role="receptionist",
+        )
+        tokens = {
+            "admin": str(AccessToken.for_user(self.clinic["admin"])),
+            "receptionist": str(AccessToken.for_user(receptionist)),
+            "doctor": str(AccessToken.for_user(self.clinic["doctor"].user)),
+        }
+        now = timezone.now()
+        endpoints = (
+            ("calendar", "admin", AdminCalendarListAPIView, "/admin_role/calendar/"),
+            ("appointments", "admin", AdminAppointmentListAPIView, "/admin_role/appointments/"),
+            # сериализуют самого пользователя (email, phone)
+            ("reg profile", "receptionist", ReceptionistProfileAPIView,
+             "/receptionist_role/profile/"),
+            ("doc profile", "doctor", DoctorProfileAPIView, "/doctor_role/profile/"),
+        )
+
+        self.stdout.write(
+            f"{'записей':>10} | {'эндпоинт':>12} | {'JWT мс':>8} | {'кэш мс':>8} | запросов"
+        )
+        seeded = 0
+        for size in sizes:
+            patient = self._patient(f"Календарь {size}")
+            Appointment.objects.bulk_create([
+                self._appointment(patient, now + timedelta(minutes=30 * i))
+                for i in range(seeded, size)
+            ])
+            seeded = size
+
+            for name, role, view_class, path in endpoints:
+                plain_ms, plain_queries = self._measure(
+                    view_class.as_view(authentication_classes=[JWTAuthentication]),
+                    path, token=tokens[role],
+                )
+                cached_ms, cached_queries = self._measure(
+                    view_class.as_view(authentication_classes=[CachedJWTAuthentication]),
+                    path, token=tokens[role],
+                )
+                self.stdout.write(
+                    f"{size:>10} | {name:>12} | {plain_ms:>8.2f} | {cached_ms:>8.2f} | "
+                    f"{plain_queries} -> {cached_queries}"
+                )
+
+    def bench_calendar(self, sizes):
+        """
+        Неделя календаря на истории в несколько лет: записи по получасу
+        назад от сегодняшнего дня растут до sizes[-1]. Для сравнения —
+        та же неделя прежним фильтром start_time__date (пояс в SQL,
+        индекс не работает).
+        """
+        patient = self._patient("Календарь")
+        today = timezone.localdate()
+        week = f"?start={today}&end={today + timedelta(days=6)}"
+        doctor_user = self.clinic["doctor"].user
+
+        Appointment.objects.bulk_create([
+            self._appointment(patient, timezone.now() + timedelta(hours=i))
+            for i in range(40)
+        ])
+
+        self.stdout.write(
+            f"{'записей':>10} | {'admin мс':>9} | {'doctor мс':>9} | "
+            f"{'__date мс':>9} | запросов"
+        )
+        seeded = 0
+        for size in sizes:
+            now = timezone.now()
+            Appointment.objects.bulk_create([
+                self._appointment(
+                    patient, now - timedelta(days=1, minutes=30 * i), status="completed"
+                )
+                for i in range(seeded, size)
+            ], batch_size=10000)
+            seeded = size
+
+            admin_ms, queries = self._measure(
+                AdminCalendarListAPIView.as_view(), "/admin_role/calendar/" + week
+            )
+            doctor_ms, _ = self._measure(
+                DoctorCalendarAPIView.as_view(), "/doctor_role/calendar/" + week,
+                user=doctor_user,
+            )
+            legacy_ms = self._time(lambda: list(
+                Appointment.objects.filter(
+                    start_time__date__gte=today,
+                    start_time__date__lte=today + timedelta(days=6),
+                ).order_by("start_time", "id")[:51]
+            ))
+            self.stdout.write(
+                f"{size:>10} | {admin_ms:>9.2f} | {doctor_ms:>9.2f} | "
+                f"{legacy_ms:>9.2f} | {queries}"
+            )
+
+    def bench_free_slots(self, sizes):
+        """
+        Свободные слоты отделения из 20 врачей на две недели. История
+        записей (прошлое) растёт до sizes[-1], ближайшие две недели
+        заполнены наполовину — время ответа от истории зависеть не должно.
+        """
+        department = self.clinic["department"]
+        doctors = [self.clinic["doctor"]] + [
+            Doctor.objects.create(
+                user=UserProfile.objects.create(username=f"bench-slots-{i}", role="doctor"),
+                department=department, specialization="-", cabinet=f"s{i}",
+            )
+            for i in range(19)
+        ]
+        patient = self._patient("Слоты")
+
+        # через слот — каждый второй получас рабочего дня занят
+        today = timezone.localdate()
+        upcoming = []
+        for doctor in doctors:
+            for day in range(14):
+                opening = timezone.make_aware(
+                    timezone.datetime.combine(today + timedelta(days=day), clock(9))
+                )
+                upcoming.extend(
+                    self._appointment(patient, opening + timedelta(hours=hour), doctor=doctor)
+                    for hour in range(9)
+                )
+        Appointment.objects.bulk_create(upcoming)
+
+        view = AdminFreeSlotsAPIView.as_view()
+        path = f"/admin_role/free-slots/?department={department.pk}"
+        self._header("записей")
+        seeded = 0
+        for size in sizes:
+            # назад от вчерашнего дня, по врачам вперемешку
+            past = timezone.now() - timedelta(days=1)
+            Appointment.objects.bulk_create([
+                self._appointment(
+                    patient, past - timedelta(minutes=30 * (i // 20)),
+                    doctor=doctors[i % 20], status="completed",
+                )
+                for i in range(seeded, size)
+            ], batch_size=10000)
+            seeded = size
+            ms, queries = self._measure(view, path)
+            self._row(size, ms, queries)
+
+    # ===== ДАННЫЕ =====
+    def _clinic(self):
+        admin = UserProfile.objects.create(username="bench-admin", role="admin")
+        doctor_user = UserProfile.objects.create(username="bench-doctor", role="doctor")
+        department = Department.objects.create(name="Бенчмарк")
+        return {
+            "admin": admin,
+            "department": department,
+            "doctor": Doctor.objects.create(
+                user=doctor_user, department=department,
+                specialization="-", cabinet="0",
+            ),
+            "service": Service.objects.create(
+                department=department, name="Бенчмарк", price=1000,
+            ),
+        }
+
+    def _patient(self, name):
+        return Patient.objects.create(full_name=name, gender="male")
+
+    def _appointment(self, patient, start, doctor=None, **kwargs):
+        return Appointment(
+            patient=patient,
+            doctor=doctor or self.clinic["doctor"],
+            department=self.clinic["department"],
+            service=self.clinic["service"],
+            start_time=start,
+            end_time=start + timedelta(minutes=30),
+            **kwargs,
+        )
+
+    def _seed_history(self, count, batch=10000):
+        """count пациентов, у каждого одна запись год назад."""
+        past = timezone.now() - timedelta(days=365)
+        done = 0
+        while done < count:
+            size = min(batch, count - done)
+            patients = Patient.objects.bulk_create([
+                Patient(full_name=f"Архив {done + i}", gender="female")
+                for i in range(size)
+            ])
+            appointments = Appointment.objects.bulk_create([
+                self._appointment(patient, past, status="completed")
+                for patient in patients
+            ])
+            Appointment.objects.filter(
+                pk__in=[appointment.pk for appointment in appointments]
+            ).update(created_at=past)
+            done += size
+        # bulk_create идёт мимо сигналов — счётчики пациентов сверяем разом
+        counters.reconcile()
+        return done
+
+    # ===== ЗАМЕР =====
+    def _measure(self, view, path, user=None, token=None):
+        timings = []
+        for _ in range(self.repeat):
+            if token:
+                request = self.factory.get(path, HTTP_AUTHORIZATION=f"Bearer {token}")
+            else:
+                request = self.factory.get(path)
+                force_authenticate(request, user=user or self.clinic["admin"])
+            # после больших bulk_create журнал запросов переполнен —
+            # CaptureQueriesContext считал бы по нему неверно
+            connection.queries_log.clear()
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = view(request)
+                response.render()
+                timings.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                raise CommandError(f"{path}: {response.status_code} {response.content[:200]}")
+        return statistics.median(timings), len(queries)
+
+    def _time(self, run):
+        timings = []
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
+
+    def _header(self, label):
+        self.stdout.write(f"{label:>12} | {'мс (медиана)':>14} | запросов")
+
+    def _row(self, size, ms, queries):
+        self.stdout.write(f"{size:>12} | {ms:>14.2f} | {queries:>8}")
@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from crm_app import calendar_sync
+
+
+class Command(BaseCommand):
+    help = (
+        "Удалить журнал изменений записей (AppointmentChange) старше "
+        "срока хранения. Клиенты с более старым токеном получат 410 и "
+        "загрузят календарь заново."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--keep-days", type=int, default=calendar_sync.RETENTION.days,
+        )
+        parser.add_argument("--batch-size", type=int, default=10000)
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options["keep_days"])
+        removed = calendar_sync.prune(before, batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Удалено строк журнала: {removed}"))
@@ -0,0 +1,36 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from crm_app import notifications
+
+
+class Command(BaseCommand):
+    help = (
+        "Удалить прочитанные уведомления старше срока хранения "
+        "(--archive — перенести в NotificationArchive). Непрочитанные "
+        "не трогаются."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--keep-days", type=int, default=notifications.RETENTION.days,
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--archive", action="store_true")
+        parser.add_argument(
+            "--pause", type=float, default=0,
+            help="пауза между пачками, секунд",
+        )
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options["keep_days"])
+        removed = notifications.prune(
+            before,
+            batch_size=max(1, options["batch_size"]),
+            archive=options["archive"],
+            pause=options["pause"],
+        )
+        action = "Перенесено в архив" if options["archive"] else "Удалено"
+        self.stdout.write(self.style.SUCCESS(f"{action} уведомлений: {removed}"))
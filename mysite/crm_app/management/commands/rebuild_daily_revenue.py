@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from crm_app import rollup
+from crm_app.report_cache import bump_data_version
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересобрать дневные итоги DailyRevenue по всем оплатам "
+        "закрытых приёмов (после ручных правок в БД или сбоя)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        created = rollup.rebuild(batch_size=options["batch_size"])
+        # сводный отчёт читает итоги — закэшированные ответы устарели
+        bump_data_version("payment")
+        self.stdout.write(self.style.SUCCESS(f"Строк итогов: {created}"))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from crm_app import counters
+
+
+class Command(BaseCommand):
+    help = (
+        "Сверить счётчики записей пациентов (PatientVisitStats) с "
+        "Appointment и исправить расхождения."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        fixed = counters.reconcile(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Исправлено строк: {fixed}"))
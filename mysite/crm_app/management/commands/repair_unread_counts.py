@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from crm_app import notifications
+
+
+class Command(BaseCommand):
+    help = (
+        "Сверить счётчики непрочитанных уведомлений "
+        "(UnreadNotificationCount) с Notification и исправить расхождения."
+    )
+
+    def handle(self, *args, **options):
+        fixed = notifications.reconcile_unread()
+        self.stdout.write(self.style.SUCCESS(f"Исправлено строк: {fixed}"))
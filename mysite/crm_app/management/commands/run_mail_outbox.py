@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from crm_app import mail_outbox
+
+
+class Command(BaseCommand):
+    help = "Воркер исходящих писем: отправляет OutgoingMail пачками с повторами."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=mail_outbox.MAIL_BATCH,
+        )
+        parser.add_argument(
+            "--once", action="store_true",
+            help="разобрать готовые письма и выйти",
+        )
+        parser.add_argument("--poll-interval", type=float, default=2.0)
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options["batch_size"])
+        while True:
+            # каждый цикл: письма упавшего воркера не ждут перезапуска этого
+            mail_outbox.requeue_stale()
+            done = mail_outbox.process_pending(batch_size)
+            if done:
+                self.stdout.write(f"Обработано писем: {done}")
+            if done < batch_size:
+                if options["once"]:
+                    return
+                time.sleep(options["poll_interval"])
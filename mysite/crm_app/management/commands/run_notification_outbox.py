@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from crm_app import notifications
+
+
+class Command(BaseCommand):
+    help = "Воркер уведомлений: разбирает NotificationOutbox пачками."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=notifications.OUTBOX_BATCH,
+        )
+        parser.add_argument(
+            "--once", action="store_true",
+            help="разобрать outbox и выйти",
+        )
+        parser.add_argument("--poll-interval", type=float, default=1.0)
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options["batch_size"])
+        while True:
+            done = notifications.process_pending(batch_size)
+            if done:
+                self.stdout.write(f"Разобрано событий: {done}")
+            # неполная пачка — outbox пуст
+            if done < batch_size:
+                if options["once"]:
+                    return
+                time.sleep(options["poll_interval"])
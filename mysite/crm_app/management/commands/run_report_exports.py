@@ -0,0 +1,71 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from crm_app import exports
+
+
+class Command(BaseCommand):
+    help = "Воркер фоновых выгрузок отчётов (ReportExport)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency", type=int, default=2,
+            help="сколько выгрузок строить параллельно",
+        )
+        parser.add_argument(
+            "--once", action="store_true",
+            help="разобрать очередь и выйти",
+        )
+        parser.add_argument("--poll-interval", type=float, default=2.0)
+        parser.add_argument(
+            "--stale-after", type=int, default=30,
+            help="через сколько минут без heartbeat вернуть задачу в очередь",
+        )
+        parser.add_argument(
+            "--keep-hours", type=int, default=24,
+            help="сколько часов хранить готовые выгрузки и их файлы",
+        )
+
+    def handle(self, *args, **options):
+        concurrency = max(1, options["concurrency"])
+
+        # при concurrency=1 работаем в текущем потоке и его соединении
+        pool = ThreadPoolExecutor(concurrency) if concurrency > 1 else None
+        try:
+            while True:
+                # каждый цикл: задачи упавшего воркера не ждут перезапуска этого
+                exports.requeue_stale(timedelta(minutes=options["stale_after"]))
+                exports.expire(timedelta(hours=options["keep_hours"]))
+                if pool:
+                    done = sum(pool.map(self._work_in_thread, range(concurrency)))
+                else:
+                    done = self._work()
+                if not done:
+                    if options["once"]:
+                        return
+                    time.sleep(options["poll_interval"])
+        finally:
+            if pool:
+                pool.shutdown()
+
+    def _work(self):
+        """Разбирать очередь, пока она не пуста. Возвращает число задач."""
+        done = 0
+        while True:
+            job = exports.claim_next()
+            if job is None:
+                return done
+            job = exports.run(job)
+            done += 1
+            self.stdout.write(f"{job}: {job.error or job.file.name}")
+
+    def _work_in_thread(self, _):
+        try:
+            return self._work()
+        finally:
+            # у каждого потока своё соединение
+            connections.close_all()
@@ -0,0 +1,76 @@
+# Generated by Django 5.2.7 on 2026-10-17 02:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncDate
+
+
+def fill_daily_revenue(apps, schema_editor):
+    Payment = apps.get_model('crm_app', 'Payment')
+    DailyRevenue = apps.get_model('crm_app', 'DailyRevenue')
+
+    bonus = ExpressionWrapper(
+        F('amount') * F('appointment__doctor__bonus_percent') / 100,
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+    rows = (
+        Payment.objects
+        .filter(appointment__status='completed')
+        .annotate(day=TruncDate('created_at'))
+        .values(
+            'day',
+            'appointment__doctor_id',
+            'appointment__department_id',
+            'appointment__service_id',
+            'method',
+        )
+        .annotate(
+            payments_count=Count('id'),
+            amount_sum=Sum('amount'),
+            doctor_bonus_sum=Sum(bonus),
+        )
+        .order_by()
+    )
+    DailyRevenue.objects.bulk_create([
+        DailyRevenue(
+            date=row['day'],
+            doctor_id=row['appointment__doctor_id'],
+            department_id=row['appointment__department_id'],
+            service_id=row['appointment__service_id'],
+            method=row['method'],
+            payments_count=row['payments_count'],
+            amount_sum=row['amount_sum'],
+            doctor_bonus_sum=row['doctor_bonus_sum'],
+        )
+        for row in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm_app', '0003_appointment_created_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRevenue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('method', models.CharField(choices=[('cash', 'Наличные'), ('card', 'Карта')], max_length=10)),
+                ('payments_count', models.IntegerField(default=0)),
+                ('amount_sum', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('doctor_bonus_sum', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('department', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='crm_app.department')),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_revenue', to='crm_app.doctor')),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='crm_app.service')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['doctor', 'date'], name='daily_revenue_doctor_idx')],
+                'constraints': [models.UniqueConstraint(fields=('date', 'doctor', 'department', 'service', 'method'), name='daily_revenue_key')],
+            },
+        ),
+        migrations.RunPython(fill_daily_revenue, migrations.RunPython.noop),
+    ]
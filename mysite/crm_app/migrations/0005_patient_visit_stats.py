@@ -0,0 +1,53 @@
+# Generated by Django 5.2.7 on 2026-10-17 02:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Q
+
+
+def fill_patient_visit_stats(apps, schema_editor):
+    Appointment = apps.get_model('crm_app', 'Appointment')
+    PatientVisitStats = apps.get_model('crm_app', 'PatientVisitStats')
+
+    rows = (
+        Appointment.objects
+        .values('patient_id')
+        .annotate(
+            total_count=Count('id'),
+            queue_count=Count('id', filter=Q(status='queue')),
+            confirmed_count=Count('id', filter=Q(status='confirmed')),
+            cancelled_count=Count('id', filter=Q(status='cancelled')),
+            completed_count=Count('id', filter=Q(status='completed')),
+            first_appointment_at=Min('created_at'),
+            last_appointment_at=Max('created_at'),
+        )
+        .order_by()
+    )
+    PatientVisitStats.objects.bulk_create(
+        [PatientVisitStats(**row) for row in rows],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm_app', '0004_daily_revenue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientVisitStats',
+            fields=[
+                ('patient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='visit_stats', serialize=False, to='crm_app.patient')),
+                ('total_count', models.IntegerField(default=0)),
+                ('queue_count', models.IntegerField(default=0)),
+                ('confirmed_count', models.IntegerField(default=0)),
+                ('cancelled_count', models.IntegerField(default=0)),
+                ('completed_count', models.IntegerField(default=0)),
+                ('first_appointment_at', models.DateTimeField(blank=True, null=True)),
+                ('last_appointment_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.RunPython(fill_patient_visit_stats, migrations.RunPython.noop),
+    ]
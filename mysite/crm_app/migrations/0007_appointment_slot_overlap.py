@@ -0,0 +1,73 @@
+# Generated by Django 5.2.7 on 2026-10-17 03:09
+
+from django.db import migrations, models
+
+
+# на Postgres: активные записи одного врача не пересекаются
+# (полуоткрытые интервалы [start_time, end_time), отменённые не в счёт)
+ADD_CONSTRAINT = """
+    CREATE EXTENSION IF NOT EXISTS btree_gist;
+    ALTER TABLE crm_app_appointment
+        ADD CONSTRAINT appt_doctor_no_overlap
+        EXCLUDE USING gist (
+            doctor_id WITH =,
+            tstzrange(start_time, end_time, '[)') WITH &&
+        )
+        WHERE (status <> 'cancelled');
+"""
+
+DROP_CONSTRAINT = """
+    ALTER TABLE crm_app_appointment DROP CONSTRAINT IF EXISTS appt_doctor_no_overlap;
+"""
+
+FIND_OVERLAPS = """
+    SELECT a.id, b.id
+    FROM crm_app_appointment a
+    JOIN crm_app_appointment b
+        ON a.doctor_id = b.doctor_id
+        AND a.id < b.id
+        AND a.start_time < b.end_time
+        AND b.start_time < a.end_time
+    WHERE a.status <> 'cancelled' AND b.status <> 'cancelled'
+    LIMIT 20
+"""
+
+
+def add_no_overlap_constraint(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(FIND_OVERLAPS)
+        overlaps = cursor.fetchall()
+    if overlaps:
+        # constraint не создать, пока такие записи есть — их разбирают руками
+        raise RuntimeError(
+            'Пересекающиеся записи врачей (id пар): {}. Отмените или перенесите '
+            'их и повторите миграцию.'.format(overlaps)
+        )
+    schema_editor.execute(ADD_CONSTRAINT)
+
+
+def drop_no_overlap_constraint(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_CONSTRAINT)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm_app', '0006_report_export'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['doctor', 'start_time', 'end_time'], name='appt_doctor_slot_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='appointment',
+            name='appt_doctor_start_idx',
+        ),
+        migrations.RunPython(add_no_overlap_constraint, drop_no_overlap_constraint),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.7 on 2026-10-17 03:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm_app', '0009_appointment_start_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppointmentChange',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('appointment_id', models.BigIntegerField()),
+                ('doctor_id', models.BigIntegerField()),
+                ('deleted', models.BooleanField(default=False)),
+                ('changed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['doctor_id', 'id'], name='appt_change_doctor_idx'), models.Index(fields=['changed_at'], name='appt_change_changed_idx')],
+            },
+        ),
+    ]
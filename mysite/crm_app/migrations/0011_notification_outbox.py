@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-17 03:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm_app', '0010_appointment_change_log'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationOutbox',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('booked', 'booked'), ('rescheduled', 'rescheduled'), ('cancelled', 'cancelled')], max_length=20)),
+                ('doctor_id', models.BigIntegerField()),
+                ('start_time', models.DateTimeField()),
+                ('previous_doctor_id', models.BigIntegerField(blank=True, null=True)),
+                ('previous_start_time', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('appointment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='crm_app.appointment')),
+            ],
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.7 on 2026-10-17 03:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_unread_counts(apps, schema_editor):
+    Notification = apps.get_model('crm_app', 'Notification')
+    UnreadNotificationCount = apps.get_model('crm_app', 'UnreadNotificationCount')
+
+    rows = (
+        Notification.objects
+        .filter(is_read=False)
+        .values('recipient_id')
+        .annotate(unread=Count('id'))
+        .order_by()
+    )
+    UnreadNotificationCount.objects.bulk_create(
+        [UnreadNotificationCount(**row) for row in rows],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm_app', '0011_notification_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnreadNotificationCount',
+            fields=[
+                ('recipient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='unread_notifications', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('unread', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(fill_unread_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.7 on 2026-10-17 04:13
+
+import os
+import shutil
+
+import crm_app.storage
+from django.conf import settings
+from django.db import migrations, models
+
+
+def move_export_files(apps, schema_editor):
+    # готовые выгрузки уходят из MEDIA_ROOT (публичный /media/) под
+    # REPORT_EXPORT_ROOT; имена в БД не меняются
+    ReportExport = apps.get_model('crm_app', 'ReportExport')
+    names = ReportExport.objects.exclude(file='').values_list('file', flat=True)
+    for name in names.iterator():
+        source = os.path.join(settings.MEDIA_ROOT, name)
+        if not os.path.exists(source):
+            continue
+        target = os.path.join(settings.REPORT_EXPORT_ROOT, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # shutil.move — каталоги могут быть на разных томах
+        shutil.move(source, target)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm_app', '0014_mail_outbox'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='reportexport',
+            name='file',
+            field=models.FileField(blank=True, storage=crm_app.storage.ExportStorage(), upload_to='reports/'),
+        ),
+        migrations.RunPython(move_export_files, migrations.RunPython.noop),
+    ]
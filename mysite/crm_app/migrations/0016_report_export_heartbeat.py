@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 04:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm_app', '0015_report_export_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportexport',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.7 on 2026-10-17 04:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm_app', '0016_report_export_heartbeat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppointmentChangeWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pruned_through', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -1,9 +1,13 @@
 from django.db import models
+from django.db.models import OuterRef, Subquery, Q
 from django.contrib.auth.models import AbstractUser
 from phonenumber_field.modelfields import PhoneNumberField
 from datetime import date
+from django.utils import timezone
 from django.core.exceptions import ValidationError
 
+from .storage import export_storage
+
 
 # =========================
 # USER
@@ -56,6 +60,47 @@ class Doctor(models.Model):
         return f"{self.user.get_full_name()} — {self.cabinet} кабинет"
 
 
+# =========================
+# DOCTOR WORKING HOURS
+# =========================
+class DoctorWorkingHours(models.Model):
+    """
+    Рабочие часы врача по дням недели (несколько интервалов в день — с
+    перерывом). Врач без записей работает по DEFAULT_WORKING_HOURS
+    (crm_app/scheduling.py).
+    """
+    WEEKDAY_CHOICES = (
+        (0, "Понедельник"),
+        (1, "Вторник"),
+        (2, "Среда"),
+        (3, "Четверг"),
+        (4, "Пятница"),
+        (5, "Суббота"),
+        (6, "Воскресенье"),
+    )
+
+    doctor = models.ForeignKey(
+        Doctor,
+        on_delete=models.CASCADE,
+        related_name="working_hours"
+    )
+    weekday = models.PositiveSmallIntegerField(choices=WEEKDAY_CHOICES)
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+
+    class Meta:
+        ordering = ("doctor", "weekday", "start_time")
+        constraints = [
+            models.CheckConstraint(
+                condition=Q(start_time__lt=models.F("end_time")),
+                name="working_hours_start_before_end",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.doctor} — {self.get_weekday_display()} {self.start_time}–{self.end_time}"
+
+
 # =========================
 # SERVICE
 # =========================
@@ -100,9 +145,50 @@ class Patient(models.Model):
         )
 
 
+# =========================
+# PATIENT VISIT STATS
+# =========================
+class PatientVisitStats(models.Model):
+    """
+    Счётчики записей пациента по статусам и время первой / последней
+    записи (created_at). Ведутся сигналами (crm_app/counters.py),
+    сверяются командой repair_patient_stats.
+    """
+    patient = models.OneToOneField(
+        Patient,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="visit_stats"
+    )
+    total_count = models.IntegerField(default=0)
+    queue_count = models.IntegerField(default=0)
+    confirmed_count = models.IntegerField(default=0)
+    cancelled_count = models.IntegerField(default=0)
+    completed_count = models.IntegerField(default=0)
+    first_appointment_at = models.DateTimeField(null=True, blank=True)
+    last_appointment_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.patient_id}: {self.total_count}"
+
+
 # =========================
 # APPOINTMENT
 # =========================
+class AppointmentQuerySet(models.QuerySet):
+    def with_last_payment(self):
+        # последняя оплата приёма тем же запросом, без payments.last() на строку
+        last_payment = (
+            Payment.objects
+            .filter(appointment=OuterRef("pk"))
+            .order_by("-id")
+        )
+        return self.annotate(
+            last_payment_method=Subquery(last_payment.values("method")[:1]),
+            last_payment_amount=Subquery(last_payment.values("amount")[:1]),
+        )
+
+
 class Appointment(models.Model):
     STATUS_CHOICES = (
         ("queue", "queue"),
@@ -146,21 +232,82 @@ class Appointment(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = AppointmentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # календарь врача / отделения; пересечения слотов (scheduling.py)
+            models.Index(
+                fields=["doctor", "start_time", "end_time"], name="appt_doctor_slot_idx"
+            ),
+            models.Index(fields=["department", "start_time"], name="appt_dept_start_idx"),
+            # календарь клиники без фильтра по врачу / отделению
+            models.Index(fields=["start_time"], name="appt_start_idx"),
+            # история пациента, аналитика по статусам
+            models.Index(fields=["patient", "created_at"], name="appt_patient_created_idx"),
+            models.Index(fields=["status", "created_at"], name="appt_status_created_idx"),
+            # окно аналитики
+            models.Index(fields=["created_at"], name="appt_created_idx"),
+        ]
+
     def __str__(self):
         return f"{self.patient} → {self.doctor} ({self.start_time})"
 
     def clean(self):
-        if self.doctor.department != self.department:
+        if self.doctor.department_id != self.department_id:
             raise ValidationError("Врач не относится к выбранному отделению")
 
-        if self.service.department != self.department:
+        if self.service.department_id != self.department_id:
             raise ValidationError("Услуга не относится к выбранному отделению")
 
-    def save(self, *args, **kwargs):
-        self.full_clean()
+    def save(self, *args, validate=True, **kwargs):
+        # validate=False — данные уже проверил сериализатор
+        # (scheduling.check_departments), full_clean лишь повторил бы
+        # запросы по каждому FK
+        if validate:
+            self.full_clean()
         super().save(*args, **kwargs)
 
 
+# =========================
+# APPOINTMENT CHANGE LOG (дельта-синхронизация календаря)
+# =========================
+class AppointmentChange(models.Model):
+    """
+    Журнал изменений записей. id — монотонная последовательность, он же
+    sync token клиента. Ссылки — простые числа, не FK: строка удаления
+    (tombstone) переживает саму запись.
+    """
+    id = models.BigAutoField(primary_key=True)
+    appointment_id = models.BigIntegerField()
+    doctor_id = models.BigIntegerField()
+    deleted = models.BooleanField(default=False)
+    changed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # лента врача: его изменения после токена
+            models.Index(fields=["doctor_id", "id"], name="appt_change_doctor_idx"),
+            # очистка старого журнала
+            models.Index(fields=["changed_at"], name="appt_change_changed_idx"),
+        ]
+
+    def __str__(self):
+        action = "удалена" if self.deleted else "изменена"
+        return f"#{self.id}: запись {self.appointment_id} {action}"
+
+
+class AppointmentChangeWatermark(models.Model):
+    """
+    Одна строка: последний id, удалённый из журнала. Токен ниже — 410,
+    даже если журнал очищен целиком.
+    """
+    pruned_through = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"журнал очищен до #{self.pruned_through}"
+
+
 # =========================
 # PAYMENT
 # =========================
@@ -186,10 +333,60 @@ class Payment(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # отчёты: период + способ оплаты
+            models.Index(fields=["created_at", "method"], name="payment_created_method_idx"),
+        ]
+
     def __str__(self):
         return f"{int(self.amount)} c ({self.method})"
 
 
+# =========================
+# DAILY REVENUE (ROLLUP)
+# =========================
+class DailyRevenue(models.Model):
+    """
+    Дневные итоги оплат закрытых приёмов.
+    Обновляется вместе с Payment (crm_app/rollup.py), пересобирается
+    командой rebuild_daily_revenue.
+    """
+    date = models.DateField()
+    doctor = models.ForeignKey(
+        Doctor,
+        on_delete=models.CASCADE,
+        related_name="daily_revenue"
+    )
+    department = models.ForeignKey(
+        Department,
+        on_delete=models.CASCADE
+    )
+    service = models.ForeignKey(
+        Service,
+        on_delete=models.CASCADE
+    )
+    method = models.CharField(max_length=10, choices=Payment.METHOD_CHOICES)
+
+    payments_count = models.IntegerField(default=0)
+    amount_sum = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    doctor_bonus_sum = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["date", "doctor", "department", "service", "method"],
+                name="daily_revenue_key",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["doctor", "date"], name="daily_revenue_doctor_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.doctor_id} {self.method}: {self.amount_sum}"
+
+
 # =========================
 # NOTIFICATION
 # =========================
@@ -213,3 +410,206 @@ class Notification(models.Model):
 
     class Meta:
         ordering = ("-created_at",)
+        indexes = [
+            # список врача: горячее окно по created_at
+            models.Index(
+                fields=["recipient", "created_at"],
+                name="notif_recipient_created_idx",
+            ),
+            # колокольчик: только непрочитанные
+            models.Index(
+                fields=["recipient", "created_at"],
+                condition=Q(is_read=False),
+                name="notif_unread_idx",
+            ),
+            # очистка: прочитанные старше срока хранения
+            models.Index(
+                fields=["created_at"],
+                condition=Q(is_read=True),
+                name="notif_read_created_idx",
+            ),
+        ]
+
+
+class NotificationArchive(models.Model):
+    """
+    Прочитанные уведомления, вынесенные из Notification командой
+    prune_notifications --archive. id — прежний id уведомления; ссылки —
+    простые числа, не FK: архив переживает запись и пользователя.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    recipient_id = models.BigIntegerField()
+    title = models.CharField(max_length=255)
+    message = models.TextField()
+    appointment_id = models.BigIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["recipient_id", "created_at"],
+                name="notif_archive_recipient_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.title} ({self.recipient_id})"
+
+
+class UnreadNotificationCount(models.Model):
+    """
+    Число непрочитанных уведомлений получателя — для колокольчика без
+    COUNT. Ведётся в тех же транзакциях, что вставка и прочтение
+    (crm_app/notifications.py), сверяется командой repair_unread_counts.
+    """
+    recipient = models.OneToOneField(
+        UserProfile,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="unread_notifications"
+    )
+    unread = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.recipient_id}: {self.unread}"
+
+
+# =========================
+# NOTIFICATION OUTBOX (рассылка уведомлений по событиям записей)
+# =========================
+class NotificationOutbox(models.Model):
+    """
+    Событие записи, по которому ещё не созданы уведомления. Пишется
+    одной строкой в транзакции бронирования; Notification для получателей
+    создаёт воркер (run_notification_outbox) уже после коммита. Врач и
+    время — на момент события: к разбору запись могла измениться ещё раз.
+    """
+    KIND_CHOICES = (
+        ("booked", "booked"),
+        ("rescheduled", "rescheduled"),
+        ("cancelled", "cancelled"),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    appointment = models.ForeignKey(
+        Appointment,
+        on_delete=models.CASCADE,
+        related_name="+"
+    )
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    doctor_id = models.BigIntegerField()
+    start_time = models.DateTimeField()
+    # врач и время до переноса
+    previous_doctor_id = models.BigIntegerField(null=True, blank=True)
+    previous_start_time = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"#{self.id}: {self.kind} {self.appointment_id}"
+
+
+# =========================
+# MAIL OUTBOX (письма отправляет воркер)
+# =========================
+class OutgoingMail(models.Model):
+    """
+    Письмо в очереди на отправку. Запрос только пишет строку; отправляет
+    воркер run_mail_outbox пачками через одно SMTP-соединение, с
+    повторами (crm_app/mail_outbox.py). Отправленные строки удаляются.
+    """
+    STATUS_CHOICES = (
+        ("queued", "queued"),
+        ("sending", "sending"),
+        ("failed", "failed"),
+    )
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    recipients = models.JSONField(default=list)
+
+    status = models.CharField(
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default="queued"
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # очередь воркера: готовые к (повторной) отправке
+            models.Index(
+                fields=["next_attempt_at"],
+                condition=Q(status="queued"),
+                name="mail_queued_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} → {', '.join(self.recipients)} ({self.status})"
+
+
+# =========================
+# REPORT EXPORT (фоновая выгрузка Excel)
+# =========================
+class ReportExport(models.Model):
+    KIND_CHOICES = (
+        ("detailed", "detailed"),
+        ("doctor_close", "doctor_close"),
+        ("summary", "summary"),
+    )
+    STATUS_CHOICES = (
+        ("queued", "queued"),
+        ("running", "running"),
+        ("done", "done"),
+        ("failed", "failed"),
+    )
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    params = models.JSONField(default=dict, blank=True)
+    # kind + нормализованные params: одинаковые запросы — одна задача
+    params_hash = models.CharField(max_length=64)
+
+    status = models.CharField(
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default="queued"
+    )
+    progress = models.PositiveSmallIntegerField(default=0)
+    # вне MEDIA_ROOT — только через выгрузку с авторизацией
+    file = models.FileField(upload_to="reports/", storage=export_storage, blank=True)
+    error = models.TextField(blank=True)
+
+    created_by = models.ForeignKey(
+        UserProfile,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="report_exports"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # воркер жив: обновляется при взятии задачи и с каждым progress()
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # не больше одной активной задачи на одинаковый запрос
+            models.UniqueConstraint(
+                fields=["params_hash"],
+                condition=Q(status__in=["queued", "running"]),
+                name="report_export_active_unique",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["status", "created_at"], name="report_export_queue_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
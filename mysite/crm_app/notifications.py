@@ -0,0 +1,305 @@
+"""
+Уведомления врачам о записях: бронирование, перенос, отмена.
+
+Запрос бронирования пишет только строку NotificationOutbox (одну на
+запись, при пакетной записи — один INSERT на все). Получателей и тексты
+разбирает process_pending в воркере run_notification_outbox: пачка
+событий — один bulk_create уведомлений, время бронирования от числа
+получателей не зависит.
+"""
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from . import push
+from .models import (
+    Doctor,
+    Notification,
+    NotificationArchive,
+    NotificationOutbox,
+    UnreadNotificationCount,
+)
+
+
+# событий outbox за одну транзакцию воркера
+OUTBOX_BATCH = 500
+
+# список врача по умолчанию — уведомления за этот срок (и все
+# непрочитанные); старше — явным ?since=
+HOT_WINDOW = timedelta(days=30)
+
+# прочитанные старше удаляются или уходят в архив (prune_notifications)
+RETENTION = timedelta(days=180)
+
+ARCHIVE_FIELDS = ("id", "recipient_id", "title", "message", "appointment_id", "created_at")
+
+TITLES = {
+    "booked": "Новая запись",
+    "rescheduled": "Запись перенесена",
+    "cancelled": "Запись отменена",
+    "moved_away": "Запись передана другому врачу",
+}
+
+
+def event_kind(instance, created, previous):
+    """booked / rescheduled / cancelled или None — уведомлять не о чем."""
+    if created:
+        return None if instance.status == "cancelled" else "booked"
+    if previous is None:
+        return None
+    if instance.status == "cancelled":
+        return None if previous["status"] == "cancelled" else "cancelled"
+    if previous["status"] == "cancelled":
+        # отменённую запись вернули
+        return "booked"
+    if (
+        previous["doctor_id"] != instance.doctor_id
+        or previous["start_time"] != instance.start_time
+        or previous["end_time"] != instance.end_time
+    ):
+        return "rescheduled"
+    return None
+
+
+def appointment_saved(instance, created, previous):
+    kind = event_kind(instance, created, previous)
+    if kind is None:
+        return
+    NotificationOutbox.objects.create(
+        appointment=instance,
+        kind=kind,
+        doctor_id=instance.doctor_id,
+        start_time=instance.start_time,
+        previous_doctor_id=previous["doctor_id"] if kind == "rescheduled" else None,
+        previous_start_time=previous["start_time"] if kind == "rescheduled" else None,
+    )
+
+
+def appointments_booked(appointments):
+    """Пакетная запись (bulk_create, мимо сигналов)."""
+    NotificationOutbox.objects.bulk_create([
+        NotificationOutbox(
+            appointment=appointment, kind="booked",
+            doctor_id=appointment.doctor_id, start_time=appointment.start_time,
+        )
+        for appointment in appointments
+        if appointment.status != "cancelled"
+    ])
+
+
+# ===== РАЗБОР OUTBOX =====
+
+def _when(value):
+    return timezone.localtime(value).strftime("%d.%m.%Y %H:%M")
+
+
+def _notifications(event, doctor_users):
+    recipient = doctor_users.get(event.doctor_id)
+    patient = event.appointment.patient.full_name
+    if recipient is None:
+        # врача уже удалили
+        return []
+
+    if event.kind != "rescheduled":
+        return [(recipient, event.kind, f"{patient}, {_when(event.start_time)}")]
+
+    if event.previous_doctor_id == event.doctor_id:
+        return [(recipient, "rescheduled", (
+            f"{patient}: {_when(event.previous_start_time)} → {_when(event.start_time)}"
+        ))]
+
+    result = [(recipient, "booked", f"{patient}, {_when(event.start_time)}")]
+    previous = doctor_users.get(event.previous_doctor_id)
+    if previous is not None:
+        result.append(
+            (previous, "moved_away", f"{patient}, {_when(event.previous_start_time)}")
+        )
+    return result
+
+
+def process_pending(batch_size=OUTBOX_BATCH):
+    """
+    Одна пачка outbox: уведомления — одним bulk_create, разобранные
+    события удаляются в той же транзакции. Параллельные воркеры на
+    Postgres берут разные строки (SKIP LOCKED). Возвращает число событий.
+    """
+    with transaction.atomic():
+        events = list(
+            NotificationOutbox.objects
+            .select_for_update(skip_locked=True, of=("self",))
+            .select_related("appointment__patient")
+            .order_by("id")[:batch_size]
+        )
+        if not events:
+            return 0
+
+        doctor_ids = {event.doctor_id for event in events} | {
+            event.previous_doctor_id for event in events if event.previous_doctor_id
+        }
+        doctor_users = dict(
+            Doctor.objects.filter(pk__in=doctor_ids).values_list("pk", "user_id")
+        )
+
+        notifications = [
+            Notification(
+                recipient_id=recipient_id,
+                title=TITLES[kind],
+                message=message,
+                appointment_id=event.appointment_id,
+            )
+            for event in events
+            for recipient_id, kind, message in _notifications(event, doctor_users)
+        ]
+        Notification.objects.bulk_create(notifications, batch_size=OUTBOX_BATCH)
+        # bulk_create идёт мимо сигналов
+        unread_added(notification.recipient_id for notification in notifications)
+        push.notifications_created(notifications)
+
+        NotificationOutbox.objects.filter(id__in=[event.id for event in events]).delete()
+    return len(events)
+
+
+# ===== НЕПРОЧИТАННЫЕ (UnreadNotificationCount) =====
+
+def unread_count(recipient_id):
+    return (
+        UnreadNotificationCount.objects
+        .filter(recipient_id=recipient_id)
+        .values_list("unread", flat=True)
+        .first()
+    ) or 0
+
+
+def unread_added(recipient_ids):
+    """
+    Новые непрочитанные: по id получателя на каждое уведомление.
+    Недостающие строки счётчиков — одним INSERT (конфликты пропускаются),
+    затем UPDATE на каждое различное приращение (в пачке их обычно 1–2).
+    """
+    added = Counter(recipient_ids)
+    if not added:
+        return
+    UnreadNotificationCount.objects.bulk_create(
+        [UnreadNotificationCount(recipient_id=recipient_id) for recipient_id in added],
+        ignore_conflicts=True,
+    )
+    by_delta = defaultdict(list)
+    for recipient_id, delta in added.items():
+        by_delta[delta].append(recipient_id)
+    for delta, recipient_ids in by_delta.items():
+        UnreadNotificationCount.objects.filter(recipient_id__in=recipient_ids).update(
+            unread=F("unread") + delta
+        )
+
+
+def unread_removed(recipient_id, count):
+    if count:
+        UnreadNotificationCount.objects.filter(recipient_id=recipient_id).update(
+            unread=F("unread") - count
+        )
+
+
+def mark_read(recipient, ids=None, before=None):
+    """
+    Отметить прочитанными одним UPDATE — по списку id и/или всё, что
+    создано не позже before. Счётчик уменьшается на число реально
+    изменённых строк; его и возвращает.
+    """
+    qs = Notification.objects.filter(recipient=recipient, is_read=False)
+    if ids is not None:
+        qs = qs.filter(pk__in=ids)
+    if before is not None:
+        qs = qs.filter(created_at__lte=before)
+    with transaction.atomic():
+        updated = qs.update(is_read=True)
+        unread_removed(recipient.pk, updated)
+    return updated
+
+
+def reconcile_unread():
+    """
+    Сверить счётчики с Notification и исправить расхождения.
+    Возвращает число исправленных строк.
+    """
+    actual = dict(
+        Notification.objects.filter(is_read=False)
+        .values("recipient_id")
+        .annotate(unread=Count("id"))
+        .order_by()
+        .values_list("recipient_id", "unread")
+    )
+    with transaction.atomic():
+        stored = UnreadNotificationCount.objects.select_for_update().in_bulk()
+        to_create = [
+            UnreadNotificationCount(recipient_id=recipient_id, unread=unread)
+            for recipient_id, unread in actual.items()
+            if recipient_id not in stored
+        ]
+        to_update = []
+        for recipient_id, row in stored.items():
+            unread = actual.get(recipient_id, 0)
+            if row.unread != unread:
+                row.unread = unread
+                to_update.append(row)
+        UnreadNotificationCount.objects.bulk_create(to_create)
+        UnreadNotificationCount.objects.bulk_update(to_update, ["unread"])
+    return len(to_create) + len(to_update)
+
+
+# ===== ГОРЯЧЕЕ ОКНО И ХРАНЕНИЕ =====
+
+def window_start(recipient_id, unread, now=None):
+    """
+    Начало списка по умолчанию: HOT_WINDOW назад, но не позже самого
+    старого непрочитанного (его отдаёт частичный индекс notif_unread_idx).
+    """
+    start = (now or timezone.now()) - HOT_WINDOW
+    if unread:
+        oldest = (
+            Notification.objects
+            .filter(recipient_id=recipient_id, is_read=False)
+            .order_by("created_at")
+            .values_list("created_at", flat=True)
+            .first()
+        )
+        if oldest is not None and oldest < start:
+            start = oldest
+    return start
+
+
+def prune(before, batch_size=1000, archive=False, pause=0):
+    """
+    Удаляет (archive — переносит в NotificationArchive) прочитанные
+    уведомления старше before. Пачка — своя короткая транзакция, таблица
+    целиком не блокируется; pause — секунды между пачками. Возвращает
+    число удалённых строк.
+    """
+    removed = 0
+    fields = ARCHIVE_FIELDS if archive else ("id",)
+    while True:
+        with transaction.atomic():
+            rows = list(
+                Notification.objects
+                .filter(is_read=True, created_at__lt=before)
+                .order_by("created_at")
+                .values(*fields)[:batch_size]
+            )
+            if not rows:
+                return removed
+            if archive:
+                NotificationArchive.objects.bulk_create(
+                    [NotificationArchive(**row) for row in rows],
+                    ignore_conflicts=True,
+                )
+            removed += _delete_read([row["id"] for row in rows])
+        if pause:
+            time.sleep(pause)
+
+
+def _delete_read(ids):
+    """Удалить только прочитанные: сигнал удаления для них ничего не делает."""
+    return Notification.objects.filter(id__in=ids, is_read=True).delete()[0]
@@ -0,0 +1,154 @@
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, Cursor
+from rest_framework.response import Response
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Курсорная пагинация по паре (поле, id).
+
+    В отличие от стандартной CursorPagination курсор хранит и значение
+    поля, и id крайней строки страницы, поэтому страницы стабильны даже при
+    одинаковых start_time / created_at и не требуют OFFSET.
+    """
+    page_size = settings.CRM_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = settings.CRM_MAX_PAGE_SIZE
+    ordering = ("-created_at", "-id")
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            reverse, current_position = False, None
+        else:
+            reverse, current_position = self.cursor.reverse, self.cursor.position
+
+        if reverse:
+            queryset = queryset.order_by(*_reverse(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if current_position is not None:
+            queryset = queryset.filter(
+                self._position_filter(current_position, reverse)
+            )
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = current_position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = current_position is not None
+
+        # Курсоры указывают на крайние строки страницы (не включительно)
+        if self.page:
+            self.previous_position = self._get_position_from_instance(
+                self.page[0], self.ordering
+            )
+            self.next_position = self._get_position_from_instance(
+                self.page[-1], self.ordering
+            )
+        else:
+            self.previous_position = self.next_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def get_next_link(self):
+        return self.get_links(self.get_cursors())["next"]
+
+    def get_previous_link(self):
+        return self.get_links(self.get_cursors())["previous"]
+
+    def get_cursors(self):
+        """
+        Позиции соседних страниц без URL: их можно кэшировать, ссылки
+        для конкретного запроса собирает get_links.
+        """
+        return {
+            "next": self.next_position if self.has_next else None,
+            "previous": self.previous_position if self.has_previous else None,
+        }
+
+    def get_links(self, cursors, request=None):
+        """next / previous по позициям; request — другой запрос (из кэша)."""
+        if request is not None:
+            self.base_url = request.build_absolute_uri()
+        return {
+            "next": cursors["next"] and self.encode_cursor(
+                Cursor(offset=0, reverse=False, position=cursors["next"])
+            ),
+            "previous": cursors["previous"] and self.encode_cursor(
+                Cursor(offset=0, reverse=True, position=cursors["previous"])
+            ),
+        }
+
+    def get_paginated_response(self, data, **extra):
+        # extra — блоки вроде "stats" / "summary", посчитанные по всей выборке
+        return Response({
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+            **extra,
+            "results": data,
+        })
+
+    def _get_position_from_instance(self, instance, ordering):
+        field_name = ordering[0].lstrip("-")
+        value = getattr(instance, field_name)
+        return f"{value.isoformat()}|{instance.pk}"
+
+    def _position_filter(self, position, reverse):
+        try:
+            raw_value, raw_pk = position.rsplit("|", 1)
+            value = parse_datetime(raw_value)
+            pk = int(raw_pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if value is None:
+            raise NotFound(self.invalid_cursor_message)
+
+        field_name = self.ordering[0].lstrip("-")
+        descending = self.ordering[0].startswith("-")
+        lookup = "lt" if descending != reverse else "gt"
+
+        return (
+            Q(**{f"{field_name}__{lookup}": value})
+            | Q(**{field_name: value, f"pk__{lookup}": pk})
+        )
+
+
+def _reverse(ordering):
+    return tuple(
+        field[1:] if field.startswith("-") else f"-{field}"
+        for field in ordering
+    )
+
+
+class StartTimeCursorPagination(KeysetCursorPagination):
+    ordering = ("-start_time", "-id")
+
+
+class CalendarCursorPagination(KeysetCursorPagination):
+    ordering = ("start_time", "id")
+
+
+class CreatedAtCursorPagination(KeysetCursorPagination):
+    ordering = ("-created_at", "-id")
@@ -0,0 +1,70 @@
+import hashlib
+import json
+
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from .cache_utils import get_or_compute
+from .models import Department, Service
+
+
+# прайс-лист меняется редко — кэш price-list без срока, сбрасывается сигналами
+ROLES = ("admin", "receptionist")
+
+
+def _cache():
+    return caches["price-list"]
+
+
+def _key(role):
+    return f"price-list:{role}"
+
+
+def _build(serializer_class):
+    qs = (
+        Department.objects
+        .prefetch_related(
+            Prefetch("services", queryset=Service.objects.order_by("name", "id"))
+        )
+        .order_by("name", "id")
+    )
+    data = serializer_class(qs, many=True).data
+    body = json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False, sort_keys=True)
+    return {
+        "data": data,
+        "etag": '"{}"'.format(hashlib.sha256(body.encode()).hexdigest()[:32]),
+    }
+
+
+def price_list_response(request, role, serializer_class):
+    """
+    Прайс-лист из кэша с сильным ETag. Если клиент прислал тот же
+    If-None-Match — 304 без тела и без запросов к БД.
+    """
+    entry = get_or_compute(
+        _cache(), _key(role), lambda: _build(serializer_class)
+    ).value
+
+    headers = {"ETag": entry["etag"], "Cache-Control": "private, no-cache"}
+
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        if "*" in etags or entry["etag"] in etags:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return Response(entry["data"], headers=headers)
+
+
+def invalidate():
+    def delete():
+        _cache().delete_many([_key(role) for role in ROLES])
+
+    # сразу и после коммита — чтобы не закэшировать незакоммиченное
+    delete()
+    transaction.on_commit(delete)
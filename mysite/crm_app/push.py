@@ -0,0 +1,320 @@
+"""
+Push-события календаря и уведомлений (Server-Sent Events).
+
+Издатель — код записи (сигналы, book_many): событие уходит брокеру после
+коммита транзакции. Подписчик — открытый поток /<роль>/events/
+(*EventStreamView), он слушает свои каналы:
+
+    calendar          — все записи (администратор, регистратура)
+    doctor:<id>       — записи одного врача
+    user:<id>         — уведомления получателя
+
+Событие несёт только изменённые поля записи, без связанных объектов;
+полную запись клиент берёт через calendar/sync/.
+
+Брокер (PUSH_BROKER):
+    local — в пределах процесса: один узел, runserver, тесты
+    redis — Redis pub/sub (PUSH_LOCATION=redis://...), когда издатели
+            (gunicorn, воркеры) и поток событий — разные процессы
+"""
+import asyncio
+import itertools
+import json
+import threading
+import time
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework.exceptions import APIException
+from rest_framework.fields import DateTimeField
+
+from .authentication import CachedJWTAuthentication
+
+
+CALENDAR = "calendar"
+
+# событий в очереди одного подписчика; при переполнении очередь
+# сбрасывается и клиент получает resync — догнать через calendar/sync/
+QUEUE_LIMIT = 1000
+
+# пинг-комментарий, если событий нет: прокси не рвут тихое соединение
+HEARTBEAT = 15
+
+# поток закрывается, EventSource переподключается — и токен
+# проверяется заново
+STREAM_LIFETIME = 30 * 60
+
+# пауза EventSource перед переподключением, мс
+RETRY_MS = 3000
+
+# поля записи в событии
+APPOINTMENT_FIELDS = (
+    "doctor_id", "patient_id", "department_id", "service_id",
+    "start_time", "end_time", "status",
+)
+
+
+def doctor_channel(doctor_id):
+    return f"doctor:{doctor_id}"
+
+
+def user_channel(user_id):
+    return f"user:{user_id}"
+
+
+# ===== ПОДПИСКА =====
+
+class Subscription:
+    """
+    Очередь событий одного потока. put() вызывается из любого потока
+    (издатель — синхронный код), ожидание — в event loop потока SSE.
+    """
+
+    def __init__(self, channels, limit=QUEUE_LIMIT):
+        self.channels = frozenset(channels)
+        self._limit = limit
+        self._events = deque()
+        self._overflowed = False
+        self._lock = threading.Lock()
+        self._loop = None
+        self._wakeup = None
+
+    def put(self, event):
+        with self._lock:
+            if len(self._events) >= self._limit:
+                self._events.clear()
+                self._overflowed = True
+            elif not self._overflowed:
+                self._events.append(event)
+            loop, wakeup = self._loop, self._wakeup
+        if loop is not None:
+            loop.call_soon_threadsafe(wakeup.set)
+
+    def drain(self):
+        """(события, была ли потеря) — и очередь пуста."""
+        with self._lock:
+            events, overflowed = list(self._events), self._overflowed
+            self._events.clear()
+            self._overflowed = False
+        return events, overflowed
+
+    async def wait(self, timeout):
+        """Ждёт событие не дольше timeout; False — не дождались."""
+        if self._loop is None:
+            with self._lock:
+                self._loop = asyncio.get_running_loop()
+                self._wakeup = asyncio.Event()
+        self._wakeup.clear()
+        with self._lock:
+            if self._events or self._overflowed:
+                return True
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+# ===== БРОКЕРЫ =====
+
+class LocalBroker:
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, channels, limit=QUEUE_LIMIT):
+        subscription = Subscription(channels, limit)
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscriptions.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscriptions[channel]
+
+    def publish(self, channel, event):
+        self.deliver(channel, event)
+
+    def deliver(self, channel, event):
+        with self._lock:
+            subscribers = list(self._subscriptions.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put(event)
+
+
+class RedisBroker(LocalBroker):
+    """
+    publish — PUBLISH в Redis; подписчики процесса получают события
+    через один фоновый поток PSUBSCRIBE, который запускается при первой
+    подписке (процессы-издатели его не держат).
+    """
+    PREFIX = "crm:push:"
+
+    def __init__(self, location):
+        import redis
+
+        super().__init__()
+        self._client = redis.Redis.from_url(location)
+        self._listener = None
+
+    def subscribe(self, channels, limit=QUEUE_LIMIT):
+        if self._listener is None:
+            with self._lock:
+                if self._listener is None:
+                    pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+                    pubsub.psubscribe(**{f"{self.PREFIX}*": self._on_message})
+                    self._listener = pubsub.run_in_thread(sleep_time=1, daemon=True)
+        return super().subscribe(channels, limit)
+
+    def publish(self, channel, event):
+        self._client.publish(self.PREFIX + channel, json.dumps(event))
+
+    def _on_message(self, message):
+        channel = message["channel"].decode()[len(self.PREFIX):]
+        self.deliver(channel, json.loads(message["data"]))
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                backend = getattr(settings, "PUSH_BROKER", "local")
+                if backend == "local":
+                    _broker = LocalBroker()
+                elif backend == "redis":
+                    _broker = RedisBroker(settings.PUSH_LOCATION)
+                else:
+                    raise ValueError(f"PUSH_BROKER: неизвестный брокер {backend!r}")
+    return _broker
+
+
+# ===== ПУБЛИКАЦИЯ =====
+
+def publish(messages):
+    """
+    messages — [(канал, событие)]; уходят брокеру после коммита
+    (откаченные изменения не публикуются).
+    """
+    if not messages:
+        return
+
+    def send():
+        broker = get_broker()
+        for channel, event in messages:
+            broker.publish(channel, event)
+
+    # robust: недоступный брокер не роняет уже закоммиченный запрос
+    transaction.on_commit(send, robust=True)
+
+
+# даты — как в ответах API (местное время с поясом)
+_datetime = DateTimeField()
+
+
+def appointment_event(appointment, kind):
+    event = {"type": f"appointment.{kind}", "id": appointment.pk}
+    if kind != "deleted":
+        event.update((field, getattr(appointment, field)) for field in APPOINTMENT_FIELDS)
+        event["start_time"] = _datetime.to_representation(appointment.start_time)
+        event["end_time"] = _datetime.to_representation(appointment.end_time)
+    return event
+
+
+def appointments_saved(appointments, created, previous_doctor_id=None):
+    """
+    Создание/изменение записей. Запись, ушедшая к другому врачу,
+    в канале прежнего врача — deleted.
+    """
+    kind = "created" if created else "updated"
+    messages = []
+    for appointment in appointments:
+        event = appointment_event(appointment, kind)
+        messages.append((CALENDAR, event))
+        messages.append((doctor_channel(appointment.doctor_id), event))
+        if previous_doctor_id and previous_doctor_id != appointment.doctor_id:
+            messages.append((
+                doctor_channel(previous_doctor_id), appointment_event(appointment, "deleted")
+            ))
+    publish(messages)
+
+
+def appointment_deleted(appointment):
+    event = appointment_event(appointment, "deleted")
+    publish([(CALENDAR, event), (doctor_channel(appointment.doctor_id), event)])
+
+
+def notifications_created(notifications):
+    publish([
+        (user_channel(notification.recipient_id), {
+            "type": "notification.created",
+            "id": notification.pk,
+            "title": notification.title,
+            "message": notification.message,
+            "appointment_id": notification.appointment_id,
+            "created_at": _datetime.to_representation(notification.created_at),
+        })
+        for notification in notifications
+    ])
+
+
+# ===== ПОТОК SSE =====
+
+def stream_user(request):
+    """
+    Пользователь по JWT из Authorization или ?token= (EventSource
+    заголовков не шлёт); None — без токена или с негодным.
+    """
+    auth = CachedJWTAuthentication()
+    raw_token = request.GET.get("token")
+    try:
+        if raw_token:
+            return auth.get_user(auth.get_validated_token(raw_token))
+        found = auth.authenticate(request)
+    except APIException:
+        return None
+    return found[0] if found else None
+
+
+_event_ids = itertools.count(1)
+
+
+def _sse(event):
+    data = json.dumps(event, ensure_ascii=False)
+    return f"id: {next(_event_ids)}\ndata: {data}\n\n"
+
+
+async def stream(channels, lifetime=STREAM_LIFETIME, heartbeat=HEARTBEAT):
+    """
+    Тело text/event-stream. Подписка — с первой итерации, отписка — при
+    закрытии потока (в т.ч. когда клиент отключился). После разрыва
+    пропущенное клиент догоняет через calendar/sync/.
+    """
+    broker = get_broker()
+    subscription = broker.subscribe(channels)
+    deadline = time.monotonic() + lifetime
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        while time.monotonic() < deadline:
+            events, overflowed = subscription.drain()
+            if overflowed:
+                yield _sse({"type": "resync"})
+            for event in events:
+                yield _sse(event)
+            if events or overflowed:
+                continue
+            if not await subscription.wait(min(heartbeat, deadline - time.monotonic())):
+                yield ": ping\n\n"
+    finally:
+        broker.unsubscribe(subscription)
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import time
+
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.response import Response
+
+from .cache_utils import get_or_compute
+
+
+# отчёты, которые кэшируются, и таблицы, от которых они зависят:
+# сводный — DailyRevenue (оплаты, статусы, процент бонуса врача),
+# детальный — ещё и имена пациентов, врачей, услуг, отделений и цены
+REPORT_TABLES = {
+    "summary": ("payment", "appointment", "doctor"),
+    "detailed": ("payment", "appointment", "patient", "doctor", "service", "department"),
+}
+
+# параметры, не влияющие на данные
+IGNORED_PARAMS = ("format",)
+
+
+def _cache():
+    return caches["reports"]
+
+
+def _version_key(table):
+    return f"dataversion:{table}"
+
+
+def data_versions(tables):
+    cache = _cache()
+    keys = [_version_key(table) for table in tables]
+    versions = cache.get_many(keys)
+
+    missing = {key: time.time_ns() for key in keys if key not in versions}
+    if missing:
+        # версия вытеснена из кэша — начинаем с нового числа, старые
+        # записи с ней не совпадут
+        for key, value in missing.items():
+            cache.add(key, value, timeout=None)
+        versions.update(cache.get_many(missing))
+    return [versions[key] for key in keys]
+
+
+def bump_data_version(table):
+    """
+    Новая версия данных таблицы: все закэшированные отчёты по ней
+    устаревают. Сразу и ещё раз после коммита — чтобы отчёт, посчитанный
+    внутри транзакции по незакоммиченным данным, не пережил её.
+    """
+    def bump():
+        try:
+            _cache().incr(_version_key(table))
+        except ValueError:
+            _cache().add(_version_key(table), time.time_ns(), timeout=None)
+
+    bump()
+    transaction.on_commit(bump)
+
+
+def normalize_params(params):
+    return {
+        key: params.getlist(key) if len(params.getlist(key)) > 1 else params.get(key)
+        for key in sorted(params)
+        if key not in IGNORED_PARAMS and params.get(key) not in (None, "")
+    }
+
+
+def cached_report(request, endpoint, build, render=None):
+    """
+    Ответ отчёта endpoint из кэша, иначе build() -> data и в кэш.
+    render(data) — часть ответа, зависящая от запроса (ссылки
+    пагинации), собирается при каждом ответе.
+
+    Ключ — endpoint, версии данных его таблиц и нормализованные query
+    params. На попадании — заголовок Age (секунды с момента расчёта).
+    Одновременные промахи по одному ключу считает один запрос
+    (get_or_compute).
+    """
+    params = json.dumps(
+        normalize_params(request.query_params), sort_keys=True, ensure_ascii=False
+    )
+    versions = ".".join(str(v) for v in data_versions(REPORT_TABLES[endpoint]))
+    key = "report:{}:{}:{}".format(
+        endpoint, versions, hashlib.sha256(params.encode()).hexdigest()
+    )
+
+    cached = get_or_compute(_cache(), key, build)
+    _count(endpoint, "hits" if cached.hit else "misses")
+    response = Response(render(cached.value) if render else cached.value)
+    response["X-Report-Cache"] = "hit" if cached.hit else "miss"
+    if cached.hit:
+        response["Age"] = str(int(time.time() - cached.created))
+    return response
+
+
+def _count(endpoint, kind):
+    key = f"reportstats:{endpoint}:{kind}"
+    try:
+        _cache().incr(key)
+    except ValueError:
+        if not _cache().add(key, 1, timeout=None):
+            _cache().incr(key)
+
+
+def cache_stats():
+    keys = {
+        f"reportstats:{endpoint}:{kind}": (endpoint, kind)
+        for endpoint in REPORT_TABLES
+        for kind in ("hits", "misses")
+    }
+    values = _cache().get_many(list(keys))
+    stats = {endpoint: {"hits": 0, "misses": 0} for endpoint in REPORT_TABLES}
+    for key, (endpoint, kind) in keys.items():
+        stats[endpoint][kind] = values.get(key, 0)
+    return stats
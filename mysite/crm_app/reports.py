@@ -0,0 +1,400 @@
+import tempfile
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+import openpyxl
+
+from django.db.models import (
+    Count, DecimalField, ExpressionWrapper, F, Q, Sum,
+)
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import ValidationError
+
+from .models import Appointment, DailyRevenue, Doctor, Payment
+
+
+# бонус врача с одной оплаты; не «/ 100» — на SQLite целые суммы
+# делились бы нацело
+DOCTOR_BONUS = ExpressionWrapper(
+    F("amount") * F("appointment__doctor__bonus_percent") * Decimal("0.01"),
+    output_field=DecimalField(max_digits=12, decimal_places=2)
+)
+
+CASH = Q(method="cash")
+CARD = Q(method="card")
+
+
+def to_date(value):
+    """date или строка "YYYY-MM-DD" -> date, иначе 400."""
+    if isinstance(value, str):
+        try:
+            parsed = parse_date(value)
+        except ValueError:
+            # формат верный, но такой даты нет (2024-13-01)
+            parsed = None
+        if parsed is None:
+            raise ValidationError({"date": f"Неверная дата: {value}"})
+        return parsed
+    return value
+
+
+def day_start(value):
+    """Начало дня value (date или "YYYY-MM-DD") в часовом поясе клиники."""
+    return timezone.make_aware(datetime.combine(to_date(value), time.min))
+
+
+def filter_created_between(qs, date_from=None, date_to=None):
+    """
+    Фильтр по created_at за дни [date_from, date_to] включительно.
+
+    Границы переводятся в datetime, поэтому работает индекс по
+    created_at (в отличие от created_at__date__gte).
+    """
+    if date_from:
+        qs = qs.filter(created_at__gte=day_start(date_from))
+    if date_to:
+        qs = qs.filter(created_at__lt=day_start(date_to) + timedelta(days=1))
+    return qs
+
+
+def payment_totals(qs):
+    """Количество, общая сумма, наличные и безналичные — одним запросом."""
+    totals = qs.aggregate(
+        total_count=Count("id"),
+        total_sum=Sum("amount"),
+        cash=Sum("amount", filter=CASH),
+        card=Sum("amount", filter=CARD),
+    )
+    return {key: value or 0 for key, value in totals.items()}
+
+
+def detailed_report_queryset(params):
+    """
+    Оплаты детального отчёта с фильтрами из query params:
+    doctor, department, search, period (day | week | month),
+    date_from + date_to.
+    """
+    qs = Payment.objects.select_related(
+        "appointment__patient",
+        "appointment__service",
+        "appointment__department",
+        "appointment__doctor__user",
+    )
+
+    # ===== ФИЛЬТРЫ =====
+    doctor_id = params.get("doctor")
+    department_id = params.get("department")
+    search = params.get("search")
+    period = params.get("period")
+    date_from = params.get("date_from")
+    date_to = params.get("date_to")
+
+    if doctor_id:
+        qs = qs.filter(appointment__doctor_id=doctor_id)
+
+    if department_id:
+        qs = qs.filter(appointment__department_id=department_id)
+
+    if search:
+        qs = qs.filter(
+            appointment__patient__full_name__icontains=search
+        )
+
+    # ===== ПЕРИОД =====
+    today = date.today()
+
+    if period == "day":
+        qs = filter_created_between(qs, today, today)
+
+    elif period == "week":
+        qs = filter_created_between(qs, today - timedelta(days=7))
+
+    elif period == "month":
+        qs = filter_created_between(qs, today - timedelta(days=30))
+
+    # ===== КАЛЕНДАРЬ =====
+    if date_from and date_to:
+        qs = filter_created_between(qs, date_from, date_to)
+
+    return qs
+
+
+XLSX_CONTENT_TYPE = (
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+)
+
+DETAILED_REPORT_HEADER = [
+    "Дата", "Пациент", "Услуга",
+    "Тип оплаты", "Сумма", "Врач"
+]
+
+
+# строк за один fetch при выгрузке отчётов
+EXPORT_CHUNK_SIZE = 2000
+
+
+def detailed_report_rows(qs):
+    """
+    Строки детального отчёта без создания моделей: values_list +
+    iterator, в памяти не больше пары пачек по EXPORT_CHUNK_SIZE строк.
+    """
+    rows = qs.order_by("created_at", "id").values_list(
+        "created_at",
+        "appointment__patient__full_name",
+        "appointment__service__name",
+        "method",
+        "amount",
+        "appointment__doctor__user__first_name",
+        "appointment__doctor__user__last_name",
+    )
+    for row in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        created_at, patient, service, method, amount, first_name, last_name = row
+        yield [
+            timezone.localtime(created_at).strftime("%d.%m.%Y"),
+            patient,
+            service,
+            "Наличные" if method == "cash" else "Безналичные",
+            float(amount),
+            f"{first_name} {last_name}".strip(),
+        ]
+
+
+def detailed_report_xlsx(qs, progress=None):
+    """
+    XLSX детального отчёта во временном файле.
+
+    Книга в write-only режиме: openpyxl сбрасывает строки на диск по мере
+    добавления, поэтому память не растёт с числом оплат. xlsx — это zip,
+    собрать его на лету нельзя, поэтому файл отдаётся потоком после записи
+    (FileResponse читает его блоками и удаляет при закрытии).
+
+    progress(rows) вызывается после каждой пачки строк (фоновая выгрузка).
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("Отчёт")
+
+    ws.append(DETAILED_REPORT_HEADER)
+    for done, row in enumerate(detailed_report_rows(qs), start=1):
+        ws.append(row)
+        if progress and done % EXPORT_CHUNK_SIZE == 0:
+            progress(done)
+
+    return _save_workbook(wb)
+
+
+def doctor_close_xlsx(doctor_id=None):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Закрытия врача"
+
+    ws.append(["№", "Дата", "Сумма"])
+
+    total = 0
+    for idx, row in enumerate(doctor_close_report(doctor_id), start=1):
+        ws.append([
+            idx,
+            row["date"].strftime("%d.%m.%Y"),
+            float(row["total_sum"])
+        ])
+        total += row["total_sum"]
+
+    ws.append(["", "Итого:", float(total)])
+
+    return _save_workbook(wb)
+
+
+def summary_xlsx(date_from=None, date_to=None):
+    data = summary_report(date_from=date_from, date_to=date_to)
+
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Сводный отчет"
+
+    ws.append(["Показатель", "Сумма"])
+
+    ws.append(["Оплачено наличными", data["total_cash"]])
+    ws.append(["Оплачено безналичными", data["total_card"]])
+    ws.append(["Общая сумма", data["total_sum"]])
+
+    ws.append([])
+    ws.append(["Врачам всего", data["doctors_total"]])
+    ws.append(["Врачам наличными", data["doctors_cash"]])
+    ws.append(["Врачам безналичными", data["doctors_card"]])
+
+    ws.append([])
+    ws.append(["Клиника наличными", data["clinic_cash"]])
+    ws.append(["Клиника безналичными", data["clinic_card"]])
+
+    return _save_workbook(wb)
+
+
+def _save_workbook(wb):
+    output = tempfile.TemporaryFile(suffix=".xlsx")
+    wb.save(output)
+    output.seek(0)
+    return output
+
+
+class RunningPaymentTotals:
+    """
+    Итоги как у payment_totals, но накопленные по ходу потоковой выдачи —
+    без второго прохода по таблице.
+    """
+
+    def __init__(self):
+        self.total_count = 0
+        self.total_sum = Decimal(0)
+        self.by_method = {"cash": Decimal(0), "card": Decimal(0)}
+
+    def track(self, qs):
+        for payment in qs.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            self.total_count += 1
+            self.total_sum += payment.amount
+            self.by_method[payment.method] += payment.amount
+            yield payment
+
+    def as_dict(self):
+        return {
+            "total_count": self.total_count,
+            "total_sum": self.total_sum,
+            "cash": self.by_method["cash"],
+            "card": self.by_method["card"],
+        }
+
+
+def summary_report(date_from=None, date_to=None):
+    """
+    Сводный отчёт по закрытым приёмам: суммы по способам оплаты,
+    бонусы врачей и доля клиники.
+
+    Читается из дневных итогов DailyRevenue — один запрос по строкам
+    за период, а не по всем оплатам.
+    """
+    qs = DailyRevenue.objects.all()
+    if date_from:
+        qs = qs.filter(date__gte=to_date(date_from))
+    if date_to:
+        qs = qs.filter(date__lte=to_date(date_to))
+
+    totals = qs.aggregate(
+        total_cash=Sum("amount_sum", filter=CASH),
+        total_card=Sum("amount_sum", filter=CARD),
+        doctors_cash=Sum("doctor_bonus_sum", filter=CASH),
+        doctors_card=Sum("doctor_bonus_sum", filter=CARD),
+    )
+    totals = {key: value or 0 for key, value in totals.items()}
+
+    return {
+        "total_cash": totals["total_cash"],
+        "total_card": totals["total_card"],
+        "total_sum": totals["total_cash"] + totals["total_card"],
+
+        "doctors_total": totals["doctors_cash"] + totals["doctors_card"],
+        "doctors_cash": totals["doctors_cash"],
+        "doctors_card": totals["doctors_card"],
+
+        "clinic_cash": totals["total_cash"] - totals["doctors_cash"],
+        "clinic_card": totals["total_card"] - totals["doctors_card"],
+    }
+
+
+def doctor_close_report(doctor_id=None, period=None):
+    """
+    Закрытия врача по дням из DailyRevenue.
+    period: day — сегодня, month — текущий месяц, иначе всё время.
+    """
+    # строки, обнулённые удалением оплат, не показываем
+    qs = DailyRevenue.objects.filter(payments_count__gt=0)
+    if doctor_id:
+        qs = qs.filter(doctor_id=doctor_id)
+
+    today = date.today()
+    if period == "day":
+        qs = qs.filter(date=today)
+    elif period == "month":
+        qs = qs.filter(date__gte=today.replace(day=1), date__lte=today)
+
+    return (
+        qs.values("date")
+        .annotate(total_sum=Sum("amount_sum"))
+        .order_by("date")
+    )
+
+
+ANALYTICS_PERIODS = {
+    "day": 1,
+    "week": 7,
+    "month": 30,
+}
+
+
+def analytics_report(period="week"):
+    """
+    Аналитика записей за окно period (day | week | month, по умолчанию week).
+
+    Всё считается только по записям окна: итоги, уникальные пациенты и
+    первичные из них — одним запросом, график по дням — вторым. Первичный
+    пациент — чья первая запись (PatientVisitStats.first_appointment_at)
+    попала в окно; это join по первичному ключу, а не подсчёт записей
+    каждого пациента.
+    """
+    days = ANALYTICS_PERIODS.get(period, ANALYTICS_PERIODS["week"])
+    start = day_start(date.today() - timedelta(days=days))
+
+    qs = Appointment.objects.filter(created_at__gte=start)
+
+    totals = qs.aggregate(
+        total=Count("id"),
+        cancelled=Count("id", filter=Q(status="cancelled")),
+        patients=Count("patient", distinct=True),
+        primary=Count(
+            "patient",
+            distinct=True,
+            filter=Q(patient__visit_stats__first_appointment_at__gte=start),
+        ),
+    )
+
+    chart = (
+        qs.annotate(day=TruncDate("created_at"))
+        .values("day")
+        .annotate(
+            total=Count("id"),
+            cancelled=Count("id", filter=Q(status="cancelled")),
+        )
+        .order_by("day")
+    )
+
+    total_appointments = totals["total"]
+    cancelled = totals["cancelled"]
+    total_patients = totals["patients"]
+
+    # рост / падение (примитивно, но честно)
+    growth_percent = round(
+        (total_appointments / max(1, cancelled)) * 10, 1
+    )
+    decline_percent = round(
+        (cancelled / max(1, total_appointments)) * 10, 1
+    )
+
+    primary_percent = int((totals["primary"] / max(1, total_patients)) * 100)
+
+    return {
+        "growth_percent": growth_percent,
+        "decline_percent": -decline_percent,
+        "doctors_count": Doctor.objects.count(),
+
+        "total_patients": total_patients,
+        "primary_percent": primary_percent,
+        "repeat_percent": 100 - primary_percent,
+
+        "chart": [
+            {
+                "date": row["day"],
+                "total": row["total"],
+                "cancelled": row["cancelled"],
+            }
+            for row in chart
+        ],
+    }
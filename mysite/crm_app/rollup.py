@@ -0,0 +1,135 @@
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailyRevenue, Payment
+from .reports import DOCTOR_BONUS
+
+
+# поля Appointment, от которых зависит ключ строки DailyRevenue
+KEY_FIELDS = ("doctor_id", "department_id", "service_id")
+
+TOTAL_FIELDS = ("payments_count", "amount_sum", "doctor_bonus_sum")
+
+
+def _grouped(payments):
+    return (
+        payments
+        .annotate(day=TruncDate("created_at"))
+        .values(
+            "day",
+            "appointment__doctor_id",
+            "appointment__department_id",
+            "appointment__service_id",
+            "method",
+        )
+        .annotate(
+            payments_count=Count("id"),
+            amount_sum=Sum("amount"),
+            doctor_bonus_sum=Sum(DOCTOR_BONUS),
+        )
+        .order_by()
+    )
+
+
+def _key(row):
+    return {
+        "date": row["day"],
+        "doctor_id": row["appointment__doctor_id"],
+        "department_id": row["appointment__department_id"],
+        "service_id": row["appointment__service_id"],
+        "method": row["method"],
+    }
+
+
+def _totals(row):
+    return {field: row[field] for field in TOTAL_FIELDS}
+
+
+def apply_payments(payments, sign=1):
+    """
+    Добавить (sign=1) или вычесть (sign=-1) оплаты из дневных итогов.
+
+    Учитываются только оплаты закрытых приёмов. Вызывается внутри
+    транзакции, в которой меняется Payment / Appointment.
+    """
+    rows = _grouped(payments.filter(appointment__status="completed"))
+
+    for row in rows:
+        _upsert(_key(row), _totals(row), sign)
+
+
+def apply_appointment(appointment):
+    """
+    Добавить оплаты закрытой записи: ключ и бонус — по самой записи (она
+    только что сохранена), без группировки в БД — по одному upsert на
+    оплату.
+    """
+    if appointment.status != "completed":
+        return
+    for payment in appointment.payments.all():
+        add_payment(payment, appointment)
+
+
+def add_payment(payment, appointment):
+    """Новая оплата закрытой записи — один upsert строки DailyRevenue."""
+    if appointment.status != "completed":
+        return
+    amount = Decimal(str(payment.amount))
+    key = {
+        # как TruncDate в _grouped: день в текущем часовом поясе
+        "date": timezone.localdate(payment.created_at),
+        **{field: getattr(appointment, field) for field in KEY_FIELDS},
+        "method": payment.method,
+    }
+    _upsert(key, {
+        "payments_count": 1,
+        "amount_sum": amount,
+        "doctor_bonus_sum": amount * appointment.doctor.bonus_percent / 100,
+    })
+
+
+def reprice_bonus(doctor_id, bonus_percent):
+    """
+    Новый процент врача: бонус его строк итогов — от их суммы, без
+    прохода по оплатам (процент у врача один на все оплаты).
+    """
+    return DailyRevenue.objects.filter(doctor_id=doctor_id).update(
+        doctor_bonus_sum=F("amount_sum") * (Decimal(bonus_percent) / 100)
+    )
+
+
+def _upsert(key, totals, sign=1):
+    changes = {field: F(field) + sign * totals[field] for field in TOTAL_FIELDS}
+    if DailyRevenue.objects.filter(**key).update(**changes) or sign < 0:
+        return
+
+    try:
+        with transaction.atomic():
+            DailyRevenue.objects.create(**key, **totals)
+    except IntegrityError:
+        # строку только что создал параллельный запрос
+        DailyRevenue.objects.filter(**key).update(**changes)
+
+
+def rebuild(batch_size=1000):
+    """Пересобрать дневные итоги с нуля по всем оплатам."""
+    with transaction.atomic():
+        DailyRevenue.objects.all().delete()
+
+        rows = _grouped(
+            Payment.objects.filter(appointment__status="completed")
+        )
+        batch = []
+        created = 0
+        for row in rows.iterator(chunk_size=batch_size):
+            batch.append(DailyRevenue(**_key(row), **_totals(row)))
+            if len(batch) >= batch_size:
+                DailyRevenue.objects.bulk_create(batch)
+                created += len(batch)
+                batch = []
+        DailyRevenue.objects.bulk_create(batch)
+        return created + len(batch)
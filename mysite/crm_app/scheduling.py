@@ -0,0 +1,430 @@
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from . import calendar_sync, counters, notifications, push
+from .models import Appointment, Doctor
+from .report_cache import bump_data_version
+from .reports import day_start
+
+
+# отменённые записи слот не занимают
+ACTIVE = ~Q(status="cancelled")
+
+# самый длинный приём: им ограничен поиск пересечений по индексу
+# (doctor, start_time, end_time) — иначе start_time < end тянул бы всю
+# историю врача
+MAX_APPOINTMENT_DURATION = timedelta(hours=12)
+
+# exclusion constraint на Postgres (миграция 0007)
+NO_OVERLAP_CONSTRAINT = "appt_doctor_no_overlap"
+
+
+def overlapping(qs, start, end):
+    """Записи qs, пересекающиеся с [start, end)."""
+    return qs.filter(
+        start_time__gt=start - MAX_APPOINTMENT_DURATION,
+        start_time__lt=end,
+        end_time__gt=start,
+    )
+
+
+def cabinet_doctors(doctor):
+    """Врач и все, кто принимает в его кабинете."""
+    doctors = Q(pk=doctor.pk)
+    if doctor.cabinet:
+        doctors |= Q(cabinet=doctor.cabinet)
+    return Doctor.objects.filter(doctors)
+
+
+def lock_cabinet(doctor):
+    """
+    Блокировка строк врачей кабинета до конца транзакции: проверки слотов
+    врача и кабинета идут по очереди. Порядок блокировок один для всех —
+    без взаимных блокировок.
+    """
+    list(
+        cabinet_doctors(doctor).select_for_update()
+        .order_by("pk").values_list("pk", flat=True)
+    )
+
+
+def find_conflicts(doctor, start, end, exclude_pk=None):
+    """
+    Активные записи, занимающие врача или его кабинет в [start, end).
+
+    Один запрос: по каждому врачу кабинета — диапазон по индексу
+    (doctor, start_time, end_time), O(log n) плюс найденные строки.
+    """
+    qs = overlapping(
+        Appointment.objects.filter(
+            ACTIVE, doctor_id__in=cabinet_doctors(doctor).values("pk")
+        ),
+        start, end,
+    )
+    if exclude_pk:
+        qs = qs.exclude(pk=exclude_pk)
+    return qs.order_by("start_time").values("id", "doctor_id", "start_time", "end_time")
+
+
+def conflict_error(doctor, conflicts):
+    if any(row["doctor_id"] == doctor.pk for row in conflicts):
+        message = "Врач уже занят в это время"
+    else:
+        message = f"Кабинет {doctor.cabinet} занят в это время"
+    return ValidationError({
+        "start_time": [message],
+        "conflicts": [row["id"] for row in conflicts],
+    })
+
+
+def check_departments(doctor, department, service):
+    """
+    Врач и услуга из выбранного отделения — по уже загруженным
+    объектам, без запросов. Заменяет Appointment.full_clean для записей,
+    которые сохраняются внутри reserve() и book_many().
+    """
+    if doctor.department_id != department.pk:
+        raise ValidationError("Врач не относится к выбранному отделению")
+    if service.department_id != department.pk:
+        raise ValidationError("Услуга не относится к выбранному отделению")
+
+
+@contextmanager
+def reserve(doctor, start, end, status="queue", exclude_pk=None, check=True):
+    """
+    Проверка слота и сохранение записи внутри with — в одной транзакции.
+
+    Строки врачей кабинета блокируются (select_for_update), поэтому
+    параллельные записи к тому же врачу или в тот же кабинет проверяются
+    по очереди и не могут обе пройти проверку. Exclusion constraint на
+    Postgres — страховка для записей в обход API.
+
+    check=False — слот не менялся (например, только сменили статус),
+    пересечения не ищем.
+    """
+    if start >= end:
+        raise ValidationError("Время начала должно быть меньше окончания")
+    if end - start > MAX_APPOINTMENT_DURATION:
+        raise ValidationError("Приём не может длиться дольше 12 часов")
+
+    with transaction.atomic():
+        if check and status != "cancelled":
+            lock_cabinet(doctor)
+
+            conflicts = list(find_conflicts(doctor, start, end, exclude_pk))
+            if conflicts:
+                raise conflict_error(doctor, conflicts)
+
+        try:
+            yield
+        except IntegrityError as exc:
+            # транзакция откатывается целиком — повторно не проверяем
+            if NO_OVERLAP_CONSTRAINT not in str(exc):
+                raise
+            raise ValidationError({"start_time": ["Врач уже занят в это время"]})
+
+
+def reserve_for(validated_data, instance=None):
+    """reserve() по данным сериализатора записи; недостающее — из instance."""
+    def value(name, default=None):
+        if name in validated_data:
+            return validated_data[name]
+        return getattr(instance, name, default)
+
+    check = (
+        instance is None
+        or instance.status == "cancelled"
+        or value("start_time") != instance.start_time
+        or value("end_time") != instance.end_time
+        or ("doctor" in validated_data and validated_data["doctor"].pk != instance.doctor_id)
+    )
+    return reserve(
+        # врач нужен только для проверки — без лишнего запроса по FK
+        value("doctor") if check else None,
+        value("start_time"),
+        value("end_time"),
+        status=value("status", "queue"),
+        exclude_pk=instance.pk if instance else None,
+        check=check,
+    )
+
+
+# ===== СЕРИЯ ЗАПИСЕЙ =====
+
+# самая длинная серия за один запрос
+MAX_BULK_SLOTS = 100
+
+
+def _overlaps(busy, starts, start, end):
+    """Пересекается ли [start, end) с объединёнными интервалами busy — O(log n)."""
+    i = bisect_left(starts, end)
+    return i > 0 and busy[i - 1][1] > start
+
+
+def book_many(patient, doctor, department, service, slots, status="queue", registrar=None):
+    """
+    Серия записей одного пациента к одному врачу за один проход.
+
+    Все слоты проверяются разом: один диапазонный запрос занятых
+    интервалов врача и кабинета на весь период серии, дальше — бинарный
+    поиск по объединённым интервалам и проверка слотов серии между
+    собой. Принятые вставляются одним bulk_create в той же транзакции,
+    что и блокировка врачей кабинета (как в reserve).
+
+    bulk_create идёт мимо Appointment.save() и сигналов: full_clean
+    заменяет check_departments в сериализаторе, счётчики пациента,
+    журнал календаря и версия данных отчётов обновляются здесь. В DailyRevenue новые
+    записи не попадают — у них ещё нет оплат.
+
+    Возвращает {"created": [id...], "rejected": [{start_time, end_time, reason}]}.
+    """
+    rejected = []
+
+    def reject(start, end, reason):
+        rejected.append({"start_time": start, "end_time": end, "reason": reason})
+
+    valid = []
+    for start, end in sorted(slots):
+        if start >= end:
+            reject(start, end, "Время начала должно быть меньше окончания")
+        elif end - start > MAX_APPOINTMENT_DURATION:
+            reject(start, end, "Приём не может длиться дольше 12 часов")
+        else:
+            valid.append((start, end))
+
+    with transaction.atomic():
+        accepted = valid
+        if valid and status != "cancelled":
+            lock_cabinet(doctor)
+            rows = overlapping(
+                Appointment.objects.filter(
+                    ACTIVE, doctor_id__in=cabinet_doctors(doctor).values("pk")
+                ),
+                valid[0][0], max(end for _, end in valid),
+            ).values_list("doctor_id", "start_time", "end_time")
+
+            own, cabinet = [], []
+            for doctor_id, start, end in rows:
+                (own if doctor_id == doctor.pk else cabinet).append((start, end))
+            own, cabinet = merge_intervals(own), merge_intervals(cabinet)
+            own_starts = [start for start, _ in own]
+            cabinet_starts = [start for start, _ in cabinet]
+
+            accepted = []
+            latest_end = None
+            for start, end in valid:
+                if _overlaps(own, own_starts, start, end):
+                    reject(start, end, "Врач уже занят в это время")
+                elif _overlaps(cabinet, cabinet_starts, start, end):
+                    reject(start, end, f"Кабинет {doctor.cabinet} занят в это время")
+                elif latest_end and start < latest_end:
+                    reject(start, end, "Пересекается с другим слотом серии")
+                else:
+                    accepted.append((start, end))
+                    latest_end = max(latest_end or end, end)
+
+        appointments = []
+        if accepted:
+            try:
+                appointments = Appointment.objects.bulk_create([
+                    Appointment(
+                        patient=patient, doctor=doctor, department=department,
+                        service=service, registrar=registrar,
+                        start_time=start, end_time=end, status=status,
+                    )
+                    for start, end in accepted
+                ])
+            except IntegrityError as exc:
+                if NO_OVERLAP_CONSTRAINT not in str(exc):
+                    raise
+                raise ValidationError({"slots": ["Врач уже занят в это время"]})
+
+            counters.appointments_added(appointments)
+            calendar_sync.record(appointments)
+            push.appointments_saved(appointments, created=True)
+            notifications.appointments_booked(appointments)
+            bump_data_version("appointment")
+
+    return {
+        "created": [appointment.pk for appointment in appointments],
+        "rejected": sorted(rejected, key=lambda slot: slot["start_time"]),
+    }
+
+
+# ===== ОКНО КАЛЕНДАРЯ =====
+
+# окно по умолчанию и самое длинное окно календаря, дней
+CALENDAR_DEFAULT_DAYS = 7
+CALENDAR_MAX_DAYS = 62
+
+
+def calendar_window(params):
+    """
+    start / end из query params ("YYYY-MM-DD", end включительно) ->
+    полуоткрытый интервал [начало start, начало дня после end) в часовом
+    поясе клиники. Фильтр start_time__gte / __lt идёт по индексу на
+    start_time, в отличие от start_time__date (конвертация пояса в SQL).
+
+    Без start и end — неделя с сегодняшнего дня; если задана одна
+    граница — неделя от неё. Окно длиннее CALENDAR_MAX_DAYS — 400.
+    """
+    start = params.get("start")
+    end = params.get("end")
+    default = timedelta(days=CALENDAR_DEFAULT_DAYS)
+
+    if start and end:
+        lower, upper = day_start(start), day_start(end) + timedelta(days=1)
+    elif start:
+        lower = day_start(start)
+        upper = lower + default
+    elif end:
+        upper = day_start(end) + timedelta(days=1)
+        lower = upper - default
+    else:
+        lower = day_start(timezone.localdate())
+        upper = lower + default
+
+    if upper <= lower:
+        raise ValidationError({"end": ["end раньше start"]})
+    if upper - lower > timedelta(days=CALENDAR_MAX_DAYS):
+        raise ValidationError({"end": [f"Окно календаря — не больше {CALENDAR_MAX_DAYS} дней"]})
+    return lower, upper
+
+
+# ===== СВОБОДНЫЕ СЛОТЫ =====
+
+# врач без DoctorWorkingHours: пн–сб 09:00–18:00
+DEFAULT_WORKING_HOURS = {weekday: [(time(9), time(18))] for weekday in range(6)}
+
+# начало слота округляется вверх до этого шага (если окно начинается «сейчас»)
+SLOT_ROUNDING = timedelta(minutes=5)
+
+
+def merge_intervals(intervals):
+    """Пересекающиеся и смежные интервалы -> отсортированные непересекающиеся."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def subtract_intervals(windows, busy):
+    """
+    windows минус busy — оба отсортированы и без пересечений внутри
+    себя. Один проход двумя указателями: O(len(windows) + len(busy)).
+    """
+    free = []
+    i = 0
+    for start, end in windows:
+        while i < len(busy) and busy[i][1] <= start:
+            i += 1
+        cursor = start
+        j = i
+        while j < len(busy) and busy[j][0] < end:
+            if busy[j][0] > cursor:
+                free.append((cursor, busy[j][0]))
+            cursor = max(cursor, busy[j][1])
+            j += 1
+        if cursor < end:
+            free.append((cursor, end))
+    return free
+
+
+def working_windows(hours, date_from, date_to):
+    """
+    Рабочие интервалы по дням [date_from, date_to] в часовом поясе
+    клиники. hours: weekday -> [(начало, конец)].
+    """
+    windows = []
+    day = date_from
+    while day <= date_to:
+        for start, end in hours.get(day.weekday(), ()):
+            windows.append((
+                timezone.make_aware(datetime.combine(day, start)),
+                timezone.make_aware(datetime.combine(day, end)),
+            ))
+        day += timedelta(days=1)
+    return merge_intervals(windows)
+
+
+def _round_up(moment):
+    midnight = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    steps = -(-(moment - midnight) // SLOT_ROUNDING)
+    return midnight + steps * SLOT_ROUNDING
+
+
+def free_slots(doctors, date_from, date_to, duration, now=None):
+    """
+    Свободные слоты длиной duration у врачей doctors за дни
+    [date_from, date_to].
+
+    Три запроса на всё: врачи, их рабочие часы и занятые интервалы —
+    один диапазонный запрос по индексу (doctor, start_time, end_time)
+    для врачей и их кабинетов. Дальше в памяти: по каждому врачу
+    рабочие окна минус объединённые занятые интервалы (его записи и
+    записи его кабинета), свободное время режется на слоты подряд.
+    Прошедшее время не предлагается.
+    """
+    now = now or timezone.now()
+    doctors = list(doctors.prefetch_related("working_hours"))
+    cabinets = {doctor.cabinet for doctor in doctors if doctor.cabinet}
+
+    range_start = max(day_start(date_from), _round_up(now))
+    range_end = day_start(date_to) + timedelta(days=1)
+
+    related = Doctor.objects.filter(
+        Q(pk__in=[doctor.pk for doctor in doctors]) | Q(cabinet__in=cabinets)
+    )
+    rows = overlapping(
+        Appointment.objects.filter(ACTIVE, doctor_id__in=related.values("pk")),
+        range_start, range_end,
+    ).values_list("doctor_id", "doctor__cabinet", "start_time", "end_time")
+
+    busy_by_doctor = defaultdict(list)
+    busy_by_cabinet = defaultdict(list)
+    for doctor_id, cabinet, start, end in rows:
+        busy_by_doctor[doctor_id].append((start, end))
+        if cabinet:
+            busy_by_cabinet[cabinet].append((start, end))
+
+    result = []
+    for doctor in doctors:
+        hours = defaultdict(list)
+        for item in doctor.working_hours.all():
+            hours[item.weekday].append((item.start_time, item.end_time))
+
+        windows = [
+            (max(start, range_start), end)
+            for start, end in working_windows(
+                hours or DEFAULT_WORKING_HOURS, date_from, date_to
+            )
+            if end > range_start
+        ]
+        busy = merge_intervals(
+            busy_by_doctor[doctor.pk] + busy_by_cabinet.get(doctor.cabinet, [])
+        )
+
+        slots = []
+        for start, end in subtract_intervals(windows, busy):
+            while start + duration <= end:
+                slots.append({"start_time": start, "end_time": start + duration})
+                start += duration
+
+        result.append({
+            "doctor": doctor.pk,
+            "doctor_name": doctor.user.get_full_name(),
+            "cabinet": doctor.cabinet,
+            "slots": slots,
+        })
+    return result
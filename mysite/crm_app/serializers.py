@@ -1,5 +1,10 @@
 from rest_framework import serializers
 from .models import *
+from . import scheduling
+from datetime import timedelta
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import get_user_model
 from django_rest_passwordreset.models import ResetPasswordToken
@@ -148,8 +153,9 @@ class AdminAppointmentListSerializer(serializers.ModelSerializer):
         source="doctor.user.get_full_name", read_only=True
     )
 
-    payment_method = serializers.SerializerMethodField()
-    payment_amount = serializers.SerializerMethodField()
+    # аннотации из Appointment.objects.with_last_payment()
+    payment_method = serializers.ReadOnlyField(source="last_payment_method")
+    payment_amount = serializers.ReadOnlyField(source="last_payment_amount")
 
     class Meta:
         model = Appointment
@@ -163,13 +169,26 @@ class AdminAppointmentListSerializer(serializers.ModelSerializer):
             "status",
         )
 
-    def get_payment_method(self, obj):
-        payment = obj.payments.last()
-        return payment.method if payment else None
+class AppointmentSlotMixin:
+    """
+    Запись сохраняется, только если врач и кабинет свободны (scheduling.reserve).
+    Отделения проверяет validate() (scheduling.check_departments), поэтому
+    save() идёт без full_clean.
+    """
+
+    def create(self, validated_data):
+        with scheduling.reserve_for(validated_data):
+            appointment = Appointment(**validated_data)
+            appointment.save(validate=False)
+            return appointment
+
+    def update(self, instance, validated_data):
+        with scheduling.reserve_for(validated_data, instance):
+            for field, value in validated_data.items():
+                setattr(instance, field, value)
+            instance.save(validate=False)
+            return instance
 
-    def get_payment_amount(self, obj):
-        payment = obj.payments.last()
-        return payment.amount if payment else None
 
 class AdminAddPatientSerializer(serializers.Serializer):
     # ===== PATIENT =====
@@ -206,21 +225,17 @@ class AdminAddPatientSerializer(serializers.Serializer):
                 "Время начала должно быть меньше времени окончания"
             )
 
-        # врач ↔ отделение
-        if data["doctor"].department != data["department"]:
-            raise serializers.ValidationError(
-                "Врач не относится к выбранному отделению"
-            )
-
-        # услуга ↔ отделение
-        if data["service"].department != data["department"]:
-            raise serializers.ValidationError(
-                "Услуга не относится к выбранному отделению"
-            )
+        # врач и услуга ↔ отделение
+        scheduling.check_departments(data["doctor"], data["department"], data["service"])
 
         return data
 
     def create(self, validated_data):
+        # занятый слот — ни пациента, ни записи
+        with scheduling.reserve_for(validated_data):
+            return self._create(validated_data)
+
+    def _create(self, validated_data):
         # 1️⃣ Patient
         patient = Patient.objects.create(
             full_name=validated_data["full_name"],
@@ -230,8 +245,8 @@ class AdminAddPatientSerializer(serializers.Serializer):
             note=validated_data.get("note", "")
         )
 
-        # 2️⃣ Appointment
-        Appointment.objects.create(
+        # 2️⃣ Appointment (отделения проверены в validate)
+        Appointment(
             patient=patient,
             department=validated_data["department"],
             doctor=validated_data["doctor"],
@@ -240,12 +255,12 @@ class AdminAddPatientSerializer(serializers.Serializer):
             start_time=validated_data["start_time"],
             end_time=validated_data["end_time"],
             status=validated_data["status"],
-        )
+        ).save(validate=False)
 
         return patient
 
 # serializers/admin_edit_appointment.py
-class AdminAppointmentEditSerializer(serializers.ModelSerializer):
+class AdminAppointmentEditSerializer(AppointmentSlotMixin, serializers.ModelSerializer):
     department = serializers.PrimaryKeyRelatedField(
         queryset=Department.objects.all()
     )
@@ -281,19 +296,12 @@ class AdminAppointmentEditSerializer(serializers.ModelSerializer):
                 "Время начала должно быть меньше времени окончания"
             )
 
-        department = data.get("department", self.instance.department)
-        doctor = data.get("doctor", self.instance.doctor)
-        service = data.get("service", self.instance.service)
-
-        if doctor.department != department:
-            raise serializers.ValidationError(
-                "Врач не относится к выбранному отделению"
-            )
-
-        if service.department != department:
-            raise serializers.ValidationError(
-                "Услуга не относится к выбранному отделению"
-            )
+        # из instance — только то, чего нет в запросе
+        scheduling.check_departments(
+            data.get("doctor") or self.instance.doctor,
+            data.get("department") or self.instance.department,
+            data.get("service") or self.instance.service,
+        )
 
         return data
 
@@ -428,8 +436,9 @@ class AdminPatientDetailSerializer(serializers.ModelSerializer):
         }.get(obj.gender, obj.gender)
 
 class AdminAppointmentPaymentCreateSerializer(serializers.Serializer):
+    # врач (бонус в DailyRevenue) и услуга (цена) — тем же запросом
     appointment_id = serializers.PrimaryKeyRelatedField(
-        queryset=Appointment.objects.all(),
+        queryset=Appointment.objects.select_related("doctor", "service"),
         source="appointment"
     )
     method = serializers.ChoiceField(choices=Payment.METHOD_CHOICES)
@@ -458,15 +467,17 @@ class AdminAppointmentPaymentCreateSerializer(serializers.Serializer):
     def create(self, validated_data):
         appointment = validated_data["appointment"]
 
-        payment = Payment.objects.create(
-            appointment=appointment,
-            amount=validated_data["amount"],
-            method=validated_data["method"]
-        )
+        # оплата, закрытие приёма и дневные итоги — одной транзакцией
+        with transaction.atomic():
+            payment = Payment.objects.create(
+                appointment=appointment,
+                amount=validated_data["amount"],
+                method=validated_data["method"]
+            )
 
-        # ✅ админ закрывает приём
-        appointment.status = "completed"
-        appointment.save(update_fields=["status"])
+            # ✅ админ закрывает приём; запись проверена при создании
+            appointment.status = "completed"
+            appointment.save(update_fields=["status"], validate=False)
 
         return payment
 class AdminDoctorListSerializer(serializers.ModelSerializer):
@@ -509,13 +520,14 @@ class AdminDoctorCreateUpdateSerializer(serializers.ModelSerializer):
         )
 
     def create(self, validated_data):
+        email = validated_data.pop("email")
         user_data = {
             "first_name": validated_data.pop("first_name"),
             "last_name": validated_data.pop("last_name"),
-            "email": validated_data.pop("email"),
+            "email": email,
             "phone": validated_data.pop("phone"),
             "role": "doctor",
-            "username": validated_data["email"],
+            "username": email,
         }
         password = validated_data.pop("password")
 
@@ -656,7 +668,7 @@ class AdminCalendarAppointmentSerializer(serializers.ModelSerializer):
             "completed": "#9ca3af",   # серый
         }.get(obj.status, "#9ca3af")
 
-class AdminCalendarCreateSerializer(serializers.ModelSerializer):
+class AdminCalendarCreateSerializer(AppointmentSlotMixin, serializers.ModelSerializer):
     class Meta:
         model = Appointment
         fields = (
@@ -669,8 +681,162 @@ class AdminCalendarCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 "Время начала должно быть меньше окончания"
             )
+        scheduling.check_departments(data["doctor"], data["department"], data["service"])
+        return data
+
+# ===== CALENDAR BULK (серия записей) =====
+class AppointmentSlotSerializer(serializers.Serializer):
+    start_time = serializers.DateTimeField()
+    end_time = serializers.DateTimeField()
+
+
+class AppointmentRecurrenceSerializer(serializers.Serializer):
+    """Правило повтора: первая запись, длительность, шаг и число записей."""
+    STEPS = {"daily": timedelta(days=1), "weekly": timedelta(weeks=1)}
+
+    start_time = serializers.DateTimeField()
+    # минуты
+    duration = serializers.IntegerField(min_value=5, max_value=720)
+    frequency = serializers.ChoiceField(choices=tuple(STEPS), default="weekly")
+    interval = serializers.IntegerField(min_value=1, max_value=52, default=1)
+    count = serializers.IntegerField(min_value=1, max_value=scheduling.MAX_BULK_SLOTS)
+    # только эти дни недели (0 — понедельник), для daily
+    weekdays = serializers.ListField(
+        child=serializers.IntegerField(min_value=0, max_value=6),
+        required=False, allow_empty=False,
+    )
+
+    def validate(self, data):
+        # время приёма по часам клиники, повтор — по календарным дням
+        start = timezone.localtime(data["start_time"])
+        step = self.STEPS[data["frequency"]] * data["interval"]
+        duration = timedelta(minutes=data["duration"])
+        if "weekdays" in data and data["frequency"] != "daily":
+            raise serializers.ValidationError({"weekdays": ["Дни недели — только для daily"]})
+        weekdays = set(data.get("weekdays") or range(7))
+
+        slots = []
+        for i in range(data["count"] * 7):
+            moment = start + step * i
+            if moment.weekday() in weekdays:
+                slots.append((moment, moment + duration))
+                if len(slots) == data["count"]:
+                    break
+        if len(slots) < data["count"]:
+            # шаг interval дней не попадает в weekdays достаточно часто
+            raise serializers.ValidationError(
+                {"count": [f"С такими днями недели получается записей: {len(slots)}"]}
+            )
+        return slots
+
+
+class AppointmentBulkCreateSerializer(serializers.Serializer):
+    patient = serializers.PrimaryKeyRelatedField(queryset=Patient.objects.all())
+    doctor = serializers.PrimaryKeyRelatedField(queryset=Doctor.objects.all())
+    department = serializers.PrimaryKeyRelatedField(queryset=Department.objects.all())
+    service = serializers.PrimaryKeyRelatedField(queryset=Service.objects.all())
+    status = serializers.ChoiceField(choices=Appointment.STATUS_CHOICES, default="queue")
+
+    # либо список слотов, либо правило повтора
+    slots = AppointmentSlotSerializer(many=True, required=False)
+    recurrence = AppointmentRecurrenceSerializer(required=False)
+
+    def validate(self, data):
+        scheduling.check_departments(data["doctor"], data["department"], data["service"])
+
+        if ("slots" in data) == ("recurrence" in data):
+            raise serializers.ValidationError("Укажите либо slots, либо recurrence")
+        if "slots" in data:
+            slots = [(slot["start_time"], slot["end_time"]) for slot in data.pop("slots")]
+        else:
+            slots = data.pop("recurrence")
+
+        if not slots:
+            raise serializers.ValidationError({"slots": ["Пустая серия"]})
+        if len(slots) > scheduling.MAX_BULK_SLOTS:
+            raise serializers.ValidationError(
+                {"slots": [f"Не больше {scheduling.MAX_BULK_SLOTS} записей за раз"]}
+            )
+        data["slots"] = slots
         return data
 
+
+# ===== FREE SLOTS (поиск свободного времени) =====
+class FreeSlotQuerySerializer(serializers.Serializer):
+    # самый длинный период поиска, дней
+    MAX_DAYS = 31
+
+    department = serializers.IntegerField(required=False)
+    service = serializers.PrimaryKeyRelatedField(
+        queryset=Service.objects.all(), required=False
+    )
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    # минуты
+    duration = serializers.IntegerField(min_value=5, max_value=720, default=30)
+
+    def validate(self, data):
+        department_id = data.get("department")
+        service = data.get("service")
+        if service:
+            if department_id and department_id != service.department_id:
+                raise serializers.ValidationError(
+                    "Услуга не относится к выбранному отделению"
+                )
+            department_id = service.department_id
+        if not department_id:
+            raise serializers.ValidationError("Укажите отделение или услугу")
+
+        # по умолчанию — две недели с сегодняшнего дня
+        date_from = data.get("date_from") or timezone.localdate()
+        date_to = data.get("date_to") or date_from + timedelta(days=13)
+        if date_to < date_from:
+            raise serializers.ValidationError("date_to раньше date_from")
+        if (date_to - date_from).days >= self.MAX_DAYS:
+            raise serializers.ValidationError(
+                f"Период поиска — не больше {self.MAX_DAYS} дней"
+            )
+
+        return {
+            "doctors": Doctor.objects.filter(department_id=department_id)
+                .select_related("user").order_by("id"),
+            "date_from": date_from,
+            "date_to": date_to,
+            "duration": timedelta(minutes=data["duration"]),
+        }
+
+
+# ===== REPORT EXPORTS (фоновые выгрузки) =====
+class ReportExportCreateSerializer(serializers.Serializer):
+    kind = serializers.ChoiceField(choices=ReportExport.KIND_CHOICES)
+    params = serializers.DictField(required=False, default=dict)
+
+
+class ReportExportSerializer(serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ReportExport
+        fields = (
+            "id",
+            "kind",
+            "params",
+            "status",
+            "progress",
+            "error",
+            "created_at",
+            "finished_at",
+            "download_url",
+        )
+
+    def get_download_url(self, obj):
+        if obj.status != "done":
+            return None
+        url = reverse("admin-report-export-download", args=[obj.pk])
+        request = self.context.get("request")
+        return request.build_absolute_uri(url) if request else url
+
+
 # ===== PRICE LIST (ADMIN) =====
 
 class AdminPriceListServiceSerializer(serializers.ModelSerializer):
@@ -703,8 +869,9 @@ class ReceptionistAppointmentListSerializer(serializers.ModelSerializer):
     patient = serializers.CharField(source="patient.full_name", read_only=True)
     doctor = serializers.CharField(source="doctor.user.get_full_name", read_only=True)
 
-    payment_method = serializers.SerializerMethodField()
-    payment_amount = serializers.SerializerMethodField()
+    # аннотации из Appointment.objects.with_last_payment()
+    payment_method = serializers.ReadOnlyField(source="last_payment_method")
+    payment_amount = serializers.ReadOnlyField(source="last_payment_amount")
 
     class Meta:
         model = Appointment
@@ -718,14 +885,6 @@ class ReceptionistAppointmentListSerializer(serializers.ModelSerializer):
             "status",
         )
 
-    def get_payment_method(self, obj):
-        payment = obj.payments.last()
-        return payment.method if payment else None
-
-    def get_payment_amount(self, obj):
-        payment = obj.payments.last()
-        return payment.amount if payment else None
-
 
 # ===== ADD PATIENT =====
 class ReceptionistAddPatientSerializer(serializers.Serializer):
@@ -747,15 +906,15 @@ class ReceptionistAddPatientSerializer(serializers.Serializer):
         if data["start_time"] >= data["end_time"]:
             raise serializers.ValidationError("Неверный интервал времени")
 
-        if data["doctor"].department != data["department"]:
-            raise serializers.ValidationError("Врач не из этого отделения")
-
-        if data["service"].department != data["department"]:
-            raise serializers.ValidationError("Услуга не из этого отделения")
+        scheduling.check_departments(data["doctor"], data["department"], data["service"])
 
         return data
 
     def create(self, validated_data):
+        with scheduling.reserve_for(validated_data):
+            return self._create(validated_data)
+
+    def _create(self, validated_data):
         request = self.context["request"]
 
         patient = Patient.objects.create(
@@ -766,7 +925,8 @@ class ReceptionistAddPatientSerializer(serializers.Serializer):
             note=validated_data.get("note", "")
         )
 
-        Appointment.objects.create(
+        # отделения проверены в validate
+        Appointment(
             patient=patient,
             department=validated_data["department"],
             doctor=validated_data["doctor"],
@@ -775,13 +935,13 @@ class ReceptionistAddPatientSerializer(serializers.Serializer):
             start_time=validated_data["start_time"],
             end_time=validated_data["end_time"],
             status=validated_data["status"],
-        )
+        ).save(validate=False)
 
         return patient
 
 
 # ===== EDIT APPOINTMENT =====
-class ReceptionistAppointmentEditSerializer(serializers.ModelSerializer):
+class ReceptionistAppointmentEditSerializer(AppointmentSlotMixin, serializers.ModelSerializer):
     class Meta:
         model = Appointment
         fields = (
@@ -831,8 +991,9 @@ class ReceptionistPatientPaymentSerializer(serializers.ModelSerializer):
 
 # ✅ ИСПРАВЛЕНО: Убрал проверку на registrar
 class ReceptionistAppointmentPaymentCreateSerializer(serializers.Serializer):
+    # врач (бонус в DailyRevenue) и услуга (цена) — тем же запросом
     appointment_id = serializers.PrimaryKeyRelatedField(
-        queryset=Appointment.objects.all(),
+        queryset=Appointment.objects.select_related("doctor", "service"),
         source="appointment"
     )
     method = serializers.ChoiceField(choices=Payment.METHOD_CHOICES)
@@ -851,15 +1012,18 @@ class ReceptionistAppointmentPaymentCreateSerializer(serializers.Serializer):
     def create(self, validated_data):
         request = self.context["request"]
 
-        payment = Payment.objects.create(
-            appointment=validated_data["appointment"],
-            amount=validated_data["amount"],
-            method=validated_data["method"],
-            registrar=request.user
-        )
+        # оплата, закрытие приёма и дневные итоги — одной транзакцией
+        with transaction.atomic():
+            payment = Payment.objects.create(
+                appointment=validated_data["appointment"],
+                amount=validated_data["amount"],
+                method=validated_data["method"],
+                registrar=request.user
+            )
 
-        validated_data["appointment"].status = "completed"
-        validated_data["appointment"].save(update_fields=["status"])
+            # запись проверена при создании — full_clean не нужен
+            validated_data["appointment"].status = "completed"
+            validated_data["appointment"].save(update_fields=["status"], validate=False)
 
         return payment
 
@@ -933,13 +1097,14 @@ class ReceptionistDoctorCreateUpdateSerializer(serializers.ModelSerializer):
         )
 
     def create(self, validated_data):
+        email = validated_data.pop("email")
         user_data = {
             "first_name": validated_data.pop("first_name"),
             "last_name": validated_data.pop("last_name"),
-            "email": validated_data.pop("email"),
+            "email": email,
             "phone": validated_data.pop("phone"),
             "role": "doctor",
-            "username": validated_data["email"],
+            "username": email,
         }
 
         password = validated_data.pop("password")
@@ -1038,7 +1203,7 @@ class DoctorCalendarSerializer(serializers.ModelSerializer):
         }.get(obj.status, "#9ca3af")
 
 
-class DoctorAppointmentUpdateSerializer(serializers.ModelSerializer):
+class DoctorAppointmentUpdateSerializer(AppointmentSlotMixin, serializers.ModelSerializer):
     class Meta:
         model = Appointment
         fields = ("start_time", "end_time", "status")
@@ -1138,4 +1303,21 @@ class DoctorNotificationSerializer(serializers.ModelSerializer):
             "start_time",
             "is_read",
             "created_at",
-        )
\ No newline at end of file
+        )
+
+
+class NotificationMarkReadSerializer(serializers.Serializer):
+    # за один запрос, по id
+    MAX_IDS = 500
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        required=False, allow_empty=False, max_length=MAX_IDS,
+    )
+    # всё, что создано не позже этого момента
+    before = serializers.DateTimeField(required=False)
+
+    def validate(self, data):
+        if "ids" not in data and "before" not in data:
+            raise serializers.ValidationError("Укажите ids или before")
+        return data
\ No newline at end of file
@@ -1,18 +1,248 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
 from django_rest_passwordreset.signals import reset_password_token_created
-from django.core.mail import send_mail
 import random
 
+from . import calendar_sync, counters, mail_outbox, notifications, price_list, push, rollup
+from .report_cache import bump_data_version
+from .authentication import invalidate_user
+from .models import (
+    Appointment, Department, Doctor, Notification, Patient, Payment, Service, UserProfile,
+)
+
 @receiver(reset_password_token_created)
 def password_reset_token_created(sender, instance, reset_password_token, *args, **kwargs):
     code = random.randint(1000, 9999)
     reset_password_token.key = str(code)
     reset_password_token.save()
 
-    send_mail(
+    # отправит воркер run_mail_outbox — запрос SMTP не ждёт
+    mail_outbox.enqueue(
         "Сброс пароля",
         f"Ваш код для сброса пароля: {code}",
-        "noreply@example.com",
         [reset_password_token.user.email],
-        fail_silently=False,
-    )
\ No newline at end of file
+        "noreply@example.com",
+    )
+
+
+# ===== ДНЕВНЫЕ ИТОГИ (DailyRevenue) =====
+# Вклад в итоги дают оплаты закрытых приёмов. Старое состояние вычитается
+# до сохранения, новое добавляется после — в той же транзакции.
+
+@receiver(pre_save, sender=Appointment)
+def appointment_remember_previous(sender, instance, **kwargs):
+    instance._previous = None
+    if instance.pk:
+        instance._previous = (
+            Appointment.objects
+            .filter(pk=instance.pk)
+            .values("status", "patient_id", "start_time", "end_time", *rollup.KEY_FIELDS)
+            .first()
+        )
+
+    previous = instance._previous
+    if previous and previous["status"] == "completed" and _revenue_changed(instance):
+        rollup.apply_payments(Payment.objects.filter(appointment_id=instance.pk), -1)
+
+
+@receiver(post_save, sender=Appointment)
+def appointment_update_revenue(sender, instance, created, **kwargs):
+    if created or instance.status != "completed":
+        return
+    if _revenue_changed(instance):
+        rollup.apply_appointment(instance)
+
+
+def _revenue_changed(instance):
+    previous = getattr(instance, "_previous", None)
+    if previous is None:
+        return False
+    return (
+        previous["status"] != instance.status
+        or any(previous[field] != getattr(instance, field) for field in rollup.KEY_FIELDS)
+    )
+
+
+@receiver(pre_save, sender=Payment)
+def payment_subtract_previous(sender, instance, **kwargs):
+    if instance.pk:
+        rollup.apply_payments(Payment.objects.filter(pk=instance.pk), -1)
+
+
+@receiver(post_save, sender=Payment)
+def payment_add(sender, instance, created, **kwargs):
+    if created:
+        # запись уже в памяти (сериализатор оплаты) — без группировки в БД
+        rollup.add_payment(instance, instance.appointment)
+    else:
+        rollup.apply_payments(Payment.objects.filter(pk=instance.pk))
+
+
+@receiver(pre_delete, sender=Payment)
+def payment_subtract(sender, instance, **kwargs):
+    rollup.apply_payments(Payment.objects.filter(pk=instance.pk), -1)
+
+
+# Бонус врача в итогах считается по текущему bonus_percent — как в
+# отчётах по живым оплатам и в rebuild_daily_revenue. Смена процента
+# переписывает только строки DailyRevenue врача, оплаты не перечитываются.
+
+@receiver(pre_save, sender=Doctor)
+def doctor_remember_bonus(sender, instance, **kwargs):
+    instance._bonus_changed = False
+    if not instance.pk:
+        return
+    previous = (
+        Doctor.objects.filter(pk=instance.pk).values_list("bonus_percent", flat=True).first()
+    )
+    instance._bonus_changed = previous is not None and previous != instance.bonus_percent
+
+
+@receiver(post_save, sender=Doctor)
+def doctor_reprice_bonus(sender, instance, **kwargs):
+    if getattr(instance, "_bonus_changed", False):
+        rollup.reprice_bonus(instance.pk, instance.bonus_percent)
+
+
+# ===== СЧЁТЧИКИ ЗАПИСЕЙ ПАЦИЕНТА (PatientVisitStats) =====
+
+@receiver(post_save, sender=Appointment)
+def appointment_update_patient_stats(sender, instance, created, **kwargs):
+    if created:
+        counters.appointment_added(instance)
+        return
+
+    previous = getattr(instance, "_previous", None)
+    if previous is None:
+        return
+    if previous["patient_id"] != instance.patient_id:
+        counters.recount(previous["patient_id"])
+        counters.appointment_added(instance)
+    elif previous["status"] != instance.status:
+        counters.status_changed(instance.patient_id, previous["status"], instance.status)
+
+
+@receiver(post_delete, sender=Appointment)
+def appointment_delete_patient_stats(sender, instance, **kwargs):
+    counters.recount(instance.patient_id)
+
+
+# ===== ВЕРСИИ ДАННЫХ ДЛЯ КЭША ОТЧЁТОВ =====
+
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def payment_bump_version(sender, **kwargs):
+    bump_data_version("payment")
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+def appointment_bump_version(sender, **kwargs):
+    bump_data_version("appointment")
+
+
+# имена, цены и процент бонуса в отчётах
+@receiver(post_save, sender=Patient)
+@receiver(post_delete, sender=Patient)
+@receiver(post_save, sender=Doctor)
+@receiver(post_delete, sender=Doctor)
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+@receiver(post_save, sender=Department)
+@receiver(post_delete, sender=Department)
+def reference_bump_version(sender, **kwargs):
+    bump_data_version(sender._meta.model_name)
+
+
+# ===== ЖУРНАЛ ИЗМЕНЕНИЙ КАЛЕНДАРЯ (дельта-синхронизация) =====
+
+@receiver(post_save, sender=Appointment)
+def appointment_log_change(sender, instance, **kwargs):
+    previous = getattr(instance, "_previous", None)
+    calendar_sync.record(
+        [instance], previous_doctor_id=previous["doctor_id"] if previous else None
+    )
+
+
+@receiver(post_delete, sender=Appointment)
+def appointment_log_delete(sender, instance, **kwargs):
+    calendar_sync.record_deleted(instance)
+
+
+# ===== УВЕДОМЛЕНИЯ ВРАЧУ (outbox) =====
+
+@receiver(post_save, sender=Appointment)
+def appointment_notify(sender, instance, created, **kwargs):
+    notifications.appointment_saved(instance, created, getattr(instance, "_previous", None))
+
+
+# ===== НЕПРОЧИТАННЫЕ УВЕДОМЛЕНИЯ (UnreadNotificationCount) =====
+# mark_read и разбор outbox ведут счётчик сами; здесь — одиночные
+# сохранения (админка) и каскадное удаление.
+
+@receiver(pre_save, sender=Notification)
+def notification_remember_read(sender, instance, **kwargs):
+    instance._was_read = None
+    if instance.pk:
+        instance._was_read = (
+            Notification.objects.filter(pk=instance.pk)
+            .values_list("is_read", flat=True)
+            .first()
+        )
+
+
+@receiver(post_save, sender=Notification)
+def notification_count_unread(sender, instance, created, **kwargs):
+    was_read = getattr(instance, "_was_read", None)
+    if created or was_read is None:
+        if not instance.is_read:
+            notifications.unread_added([instance.recipient_id])
+    elif was_read != instance.is_read:
+        notifications.unread_removed(instance.recipient_id, 1 if instance.is_read else -1)
+
+
+@receiver(post_delete, sender=Notification)
+def notification_uncount_unread(sender, instance, **kwargs):
+    if not instance.is_read:
+        notifications.unread_removed(instance.recipient_id, 1)
+
+
+# ===== PUSH-СОБЫТИЯ (SSE) =====
+
+@receiver(post_save, sender=Appointment)
+def appointment_push_change(sender, instance, created, **kwargs):
+    previous = getattr(instance, "_previous", None)
+    push.appointments_saved(
+        [instance], created, previous_doctor_id=previous["doctor_id"] if previous else None
+    )
+
+
+@receiver(post_delete, sender=Appointment)
+def appointment_push_delete(sender, instance, **kwargs):
+    push.appointment_deleted(instance)
+
+
+@receiver(post_save, sender=Notification)
+def notification_push(sender, instance, created, **kwargs):
+    if created:
+        push.notifications_created([instance])
+
+
+# ===== ПРАЙС-ЛИСТ =====
+
+@receiver(post_save, sender=Department)
+@receiver(post_delete, sender=Department)
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+def price_list_invalidate(sender, **kwargs):
+    price_list.invalidate()
+
+
+# ===== КЭШ ПОЛЬЗОВАТЕЛЯ JWT =====
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def user_invalidate_auth_cache(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+    transaction.on_commit(lambda: invalidate_user(instance.pk))
@@ -0,0 +1,28 @@
+import os
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+
+
+class ExportStorage(FileSystemStorage):
+    """
+    Файлы выгрузок — в REPORT_EXPORT_ROOT, вне MEDIA_ROOT: nginx раздаёт
+    /media/ без авторизации. Публичного URL нет (url() — ValueError),
+    файл отдаёт только AdminReportExportDownloadAPIView.
+    """
+
+    # каталог читается из настроек при каждом обращении (override_settings)
+    @property
+    def base_location(self):
+        return settings.REPORT_EXPORT_ROOT
+
+    @property
+    def location(self):
+        return os.path.abspath(self.base_location)
+
+    @property
+    def base_url(self):
+        return None
+
+
+export_storage = ExportStorage()
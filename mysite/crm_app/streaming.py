@@ -0,0 +1,124 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+from rest_framework.settings import api_settings
+
+
+# строк в одном куске ответа
+FLUSH_EVERY = 200
+
+
+def _json_line(data):
+    return json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False) + "\n"
+
+
+class _Echo:
+    """Файлоподобный объект для csv.writer: возвращает строку, не пишет."""
+    def write(self, value):
+        return value
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    ?format=ndjson. Строки отчёта отдаёт stream_response, сюда попадают
+    только ответы вроде ошибок валидации — одной строкой JSON.
+    """
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return _json_line(data).encode(self.charset)
+
+
+class CSVRenderer(BaseRenderer):
+    """?format=csv. Как и NDJSONRenderer — только для не-потоковых ответов."""
+    media_type = "text/csv"
+    format = "csv"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        writer = csv.writer(_Echo())
+        items = data.items() if isinstance(data, dict) else [("detail", data)]
+        return "".join(
+            writer.writerow([key, value]) for key, value in items
+        ).encode(self.charset)
+
+
+class StreamingReportMixin:
+    """
+    Отчёт отдаётся обычным JSON или потоком строк при ?format=ndjson|csv
+    (или Accept: application/x-ndjson / text/csv).
+    """
+    renderer_classes = [
+        *api_settings.DEFAULT_RENDERER_CLASSES,
+        NDJSONRenderer,
+        CSVRenderer,
+    ]
+
+    def stream_format(self):
+        renderer = getattr(self.request, "accepted_renderer", None)
+        if isinstance(renderer, (NDJSONRenderer, CSVRenderer)):
+            return renderer.format
+        return None
+
+
+def stream_response(fmt, rows, summary, filename):
+    """
+    Потоковый ответ: rows — итератор dict (строки читаются из курсора
+    по мере отправки), summary() вызывается после последней строки и
+    уходит завершающей записью.
+
+    ndjson: строка — объект, в конце {"summary": {...}}.
+    csv: заголовок по ключам первой строки, строки, в конце записи
+    summary,<поле>,<значение>.
+    """
+    if fmt == "csv":
+        chunks = _csv_chunks(rows, summary)
+        content_type = "text/csv; charset=utf-8"
+    else:
+        chunks = _ndjson_chunks(rows, summary)
+        content_type = "application/x-ndjson; charset=utf-8"
+
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="{filename}.{fmt}"'
+    # nginx не должен копить ответ целиком
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def _batched(lines):
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= FLUSH_EVERY:
+            yield "".join(batch)
+            batch = []
+    if batch:
+        yield "".join(batch)
+
+
+def _ndjson_chunks(rows, summary):
+    def lines():
+        for row in rows:
+            yield _json_line(row)
+        yield _json_line({"summary": summary()})
+    return _batched(lines())
+
+
+def _csv_chunks(rows, summary):
+    writer = csv.writer(_Echo())
+
+    def lines():
+        header = None
+        for row in rows:
+            if header is None:
+                header = list(row)
+                yield writer.writerow(header)
+            yield writer.writerow([row[key] for key in header])
+        for key, value in summary().items():
+            yield writer.writerow(["summary", key, value])
+    return _batched(lines())
@@ -1,3 +1,2678 @@
-from django.test import TestCase
+import io
+import json
+import os
+import re
+import shutil
+import smtplib
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import openpyxl
+
+from django.core import mail
+from django.core.cache import caches
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from asgiref.sync import sync_to_async
+from django.test import AsyncClient, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django_rest_passwordreset.models import ResetPasswordToken
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from . import (
+    calendar_sync, counters, exports, mail_outbox, notifications, push, reports, rollup,
+    scheduling, urls as crm_urls,
+)
+from mysite.cache_config import build_caches
+
+from .authentication import CachedJWTAuthentication
+from .cache_utils import get_or_compute
+from .models import *
+
+
+# файлы тестов — во временные каталоги, не в media/ и exports/
+TEST_MEDIA_ROOT = tempfile.mkdtemp(prefix="crm-test-media-")
+TEST_EXPORT_ROOT = tempfile.mkdtemp(prefix="crm-test-exports-")
+
+
+# те же алиасы, что в проде, но в памяти процесса
+TEST_CACHES = build_caches("locmem", None)
+
+
+def tearDownModule():
+    shutil.rmtree(TEST_MEDIA_ROOT, ignore_errors=True)
+    shutil.rmtree(TEST_EXPORT_ROOT, ignore_errors=True)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CRMTestCase(TestCase):
+    """Небольшая клиника: отделение, врач, услуга, пациент и пользователи ролей."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = UserProfile.objects.create_user(
+            username="admin@crm.kg", email="admin@crm.kg", password="pass",
+            role="admin", first_name="Админ", last_name="Главный",
+        )
+        cls.receptionist = UserProfile.objects.create_user(
+            username="reg@crm.kg", email="reg@crm.kg", password="pass",
+            role="receptionist", first_name="Айгуль", last_name="Регистратор",
+        )
+        cls.doctor_user = UserProfile.objects.create_user(
+            username="doc@crm.kg", email="doc@crm.kg", password="pass",
+            role="doctor", first_name="Бакыт", last_name="Врачев",
+        )
+        cls.department = Department.objects.create(name="Терапия")
+        cls.doctor = Doctor.objects.create(
+            user=cls.doctor_user, department=cls.department,
+            specialization="Терапевт", cabinet="101", bonus_percent=10,
+        )
+        cls.service = Service.objects.create(
+            department=cls.department, name="Консультация", price=Decimal("1000"),
+        )
+        cls.patient = Patient.objects.create(full_name="Иван Петров", gender="male")
+
+    def setUp(self):
+        # кэши процесса общие для всех тестов
+        for cache in caches.all():
+            cache.clear()
+        self.client = APIClient()
+
+    def login(self, user):
+        self.client.force_authenticate(user)
+
+    def seed_payments(self, count, method="cash"):
+        # bulk_create — мимо сигналов, для объёмных проверок
+        now = timezone.now()
+        appointments = Appointment.objects.bulk_create([
+            Appointment(
+                patient=self.patient, doctor=self.doctor,
+                department=self.department, service=self.service,
+                start_time=now, end_time=now, status="completed",
+            )
+            for _ in range(count)
+        ])
+        Payment.objects.bulk_create([
+            Payment(appointment=appointment, amount=Decimal("100"), method=method)
+            for appointment in appointments
+        ])
+
+    def make_appointment(self, start=None, minutes=30, **kwargs):
+        start = start or self.next_start(minutes)
+        data = {
+            "patient": self.patient,
+            "doctor": self.doctor,
+            "department": self.department,
+            "service": self.service,
+            "registrar": self.receptionist,
+            "start_time": start,
+            "end_time": start + timedelta(minutes=minutes),
+        }
+        data.update(kwargs)
+        return Appointment.objects.create(**data)
+
+    def next_start(self, minutes):
+        # записи без start идут подряд от текущего времени, а не одна
+        # поверх другой: на Postgres пересечение активных записей врача
+        # запрещено (appt_doctor_no_overlap); до полуночи — назад
+        self._slots = getattr(self, "_slots", -1) + 1
+        now = timezone.now()
+        start = now + timedelta(minutes=minutes) * self._slots
+        if timezone.localdate(start) != timezone.localdate(now):
+            start = now - timedelta(minutes=minutes) * self._slots
+        return start
+
+
+class CursorPaginationTests(CRMTestCase):
+    def test_pages_are_stable_for_equal_start_time(self):
+        # одно время у одного врача — только отменённые (appt_doctor_no_overlap)
+        start = timezone.now()
+        ids = {self.make_appointment(start=start, status="cancelled").id for _ in range(5)}
+
+        self.login(self.admin)
+        seen = []
+        url = "/admin_role/appointments/?page_size=2"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen += [row["id"] for row in response.data["results"]]
+            url = response.data["next"]
+
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(set(seen), ids)
+
+    def test_previous_link_returns_same_page(self):
+        base = timezone.now()
+        for i in range(5):
+            self.make_appointment(start=base + timedelta(hours=i))
+
+        self.login(self.admin)
+        first = self.client.get("/admin_role/calendar/?page_size=2").data
+        second = self.client.get(first["next"]).data
+        back = self.client.get(second["previous"]).data
+
+        self.assertEqual(
+            [row["id"] for row in back["results"]],
+            [row["id"] for row in first["results"]],
+        )
+
+    def test_stats_cover_whole_filtered_set(self):
+        for status_ in ("queue", "queue", "completed", "cancelled"):
+            self.make_appointment(status=status_)
+
+        self.login(self.admin)
+        response = self.client.get(
+            f"/admin_role/patients/{self.patient.id}/appointments/?page_size=1"
+        )
+
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(response.data["stats"]["total"], 4)
+        self.assertEqual(response.data["stats"]["queue"], 2)
+        self.assertIsNotNone(response.data["next"])
+
+
+class AppointmentListQueryTests(CRMTestCase):
+    def _pay(self, appointment, amount, method):
+        return Payment.objects.create(
+            appointment=appointment, amount=Decimal(amount), method=method
+        )
+
+    def test_last_payment_fields(self):
+        appointment = self.make_appointment()
+        self._pay(appointment, "300", "cash")
+        self._pay(appointment, "700", "card")
+        self.make_appointment()
+
+        self.login(self.admin)
+        rows = {
+            row["id"]: row
+            for row in self.client.get("/admin_role/appointments/").data["results"]
+        }
+
+        self.assertEqual(rows[appointment.id]["payment_method"], "card")
+        self.assertEqual(rows[appointment.id]["payment_amount"], Decimal("700"))
+        self.assertEqual(len(rows), 2)
+        self.assertTrue(
+            all(row["payment_method"] is None for pk, row in rows.items() if pk != appointment.id)
+        )
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        for i in range(20):
+            self._pay(self.make_appointment(), "500", "cash" if i % 2 else "card")
+
+        for url in ("/admin_role/appointments/", "/receptionist_role/appointments/"):
+            user = self.admin if url.startswith("/admin") else self.receptionist
+            self.login(user)
+            for page_size in (5, 20):
+                with self.subTest(url=url, page_size=page_size):
+                    with self.assertNumQueries(1):
+                        response = self.client.get(f"{url}?page_size={page_size}")
+                    self.assertEqual(len(response.data["results"]), page_size)
+
+
+# =========================
+# QUERY BUDGETS
+# =========================
+class QueryRecorder:
+    """Собирает SQL-запросы вместе с местом вызова в коде crm_app."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append((sql, _call_site()))
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._wrapper = connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrapper.__exit__(*exc_info)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def report(self):
+        by_site = defaultdict(list)
+        for sql, site in self.queries:
+            by_site[site].append(sql)
+
+        lines = []
+        for site, queries in sorted(by_site.items(), key=lambda item: -len(item[1])):
+            lines.append(f"  {len(queries)}× {site}")
+            lines.append(f"      {queries[0][:200]}")
+        return "\n".join(lines)
+
+
+def _call_site():
+    """
+    Поле сериализатора, которое сейчас выводится (Serializer.field),
+    иначе ближайший кадр crm_app, иначе ближайший кадр вне Django.
+    """
+    own = library = None
+    frame = sys._getframe(2)
+    while frame is not None:
+        path = frame.f_code.co_filename.replace("\\", "/")
+        name = frame.f_code.co_name
+        if name == "to_representation" and path.endswith("rest_framework/serializers.py"):
+            field = frame.f_locals.get("field")
+            if field is not None:
+                return f"{type(frame.f_locals['self']).__name__}.{field.field_name}"
+        label = f"{'/'.join(path.split('/')[-2:])}:{frame.f_lineno} {name}"
+        if "/crm_app/" in path and not path.endswith("crm_app/tests.py"):
+            own = own or label
+        elif library is None and "/django/" not in path:
+            library = label
+        frame = frame.f_back
+    return own or library or "?"
+
+
+Budget = namedtuple(
+    "Budget", "role method queries per_row kwargs data",
+    defaults=(0, None, None),
+)
+
+# route -> бюджеты по методам.
+# queries — максимум запросов на вызов с настоящим JWT и холодным кэшем
+# auth (пользователь читается из БД); с тёплым кэшем — на один меньше.
+# per_row — максимум дополнительных запросов на каждую лишнюю строку
+# в выдаче.
+ROUTE_BUDGETS = {
+    "login/": [
+        Budget(None, "post", 2, data=lambda t: {
+            "role": "admin", "email": t.admin.email, "password": "pass",
+        }),
+    ],
+    "logout/": [
+        Budget(None, "post", 8, data=lambda t: {
+            "refresh": str(RefreshToken.for_user(t.admin)),
+        }),
+    ],
+    "password_reset/": [
+        Budget(None, "post", 6, data=lambda t: {"email": t.doctor_user.email}),
+    ],
+    "password_reset/verify_code/": [
+        Budget(None, "post", 4, data=lambda t: t.reset_code_payload()),
+    ],
+
+    # Admin
+    "admin_role/users/create/": [
+        Budget("admin", "post", 2, data=lambda t: {
+            "email": "new@crm.kg", "password": "pass", "role": "receptionist",
+            "first_name": "Новый", "last_name": "Регистратор",
+        }),
+    ],
+    "admin_role/appointments/": [Budget("admin", "get", 2)],
+    "admin_role/patients/add/": [
+        Budget("admin", "post", 17, data=lambda t: t.add_patient_payload(registrar=True)),
+    ],
+    "admin_role/appointments/<int:pk>/edit/": [
+        Budget("admin", "get", 2, kwargs=lambda t: {"pk": t.appointment.pk}),
+        Budget("admin", "patch", 10, kwargs=lambda t: {"pk": t.appointment.pk},
+               data=lambda t: {"status": "confirmed"}),
+    ],
+    "admin_role/patients/<int:patient_id>/appointments/": [
+        Budget("admin", "get", 3, kwargs=lambda t: {"patient_id": t.patient.pk}),
+    ],
+    "admin_role/appointments/<int:pk>/delete/": [
+        Budget("admin", "delete", 9, kwargs=lambda t: {"pk": t.make_appointment().pk}),
+    ],
+    "admin_role/patients/<int:patient_id>/visits/": [
+        Budget("admin", "get", 3, kwargs=lambda t: {"patient_id": t.patient.pk}),
+    ],
+    "admin_role/patients/<int:patient_id>/payments/": [
+        Budget("admin", "get", 3, kwargs=lambda t: {"patient_id": t.patient.pk}),
+    ],
+    "admin_role/patients/<int:id>/": [
+        Budget("admin", "get", 2, kwargs=lambda t: {"id": t.patient.pk}),
+    ],
+    "admin_role/appointments/payment/": [
+        # DailyRevenue — один upsert (UPDATE, при новой строке INSERT)
+        Budget("admin", "post", 15, data=lambda t: t.payment_payload()),
+    ],
+    "admin_role/doctors/": [Budget("admin", "get", 2)],
+    "admin_role/doctors/create/": [
+        Budget("admin", "post", 5, data=lambda t: t.doctor_payload("new-doc@crm.kg")),
+    ],
+    "admin_role/doctors/<int:pk>/": [
+        Budget("admin", "get", 2, kwargs=lambda t: {"pk": t.doctor.pk}),
+        # + прежний bonus_percent (смена процента — UPDATE строк DailyRevenue)
+        Budget("admin", "patch", 5, kwargs=lambda t: {"pk": t.doctor.pk},
+               data=lambda t: {"cabinet": "202"}),
+        Budget("admin", "delete", 6, kwargs=lambda t: {"pk": t.spare_doctor().pk}),
+    ],
+    "admin_role/analytics/": [Budget("admin", "get", 4)],
+    "admin_role/reports/detailed/": [Budget("admin", "get", 3)],
+    "admin_role/reports/detailed/excel/": [Budget("admin", "get", 2)],
+    "admin_role/reports/doctors-close/": [Budget("admin", "get", 2)],
+    "admin_role/reports/doctors-close/excel/": [Budget("admin", "get", 2)],
+    "admin_role/reports/summary/": [Budget("admin", "get", 2)],
+    "admin_role/reports/summary/excel/": [Budget("admin", "get", 2)],
+    "admin_role/reports/cache-stats/": [Budget("admin", "get", 1)],
+    "admin_role/reports/exports/": [
+        Budget("admin", "post", 5, data=lambda t: {
+            "kind": "detailed", "params": {"period": "month"},
+        }),
+    ],
+    "admin_role/reports/exports/<int:pk>/": [
+        Budget("admin", "get", 2, kwargs=lambda t: {"pk": t.done_export().pk}),
+    ],
+    "admin_role/reports/exports/<int:pk>/download/": [
+        Budget("admin", "get", 2, kwargs=lambda t: {"pk": t.done_export().pk}),
+    ],
+    "admin_role/calendar/": [Budget("admin", "get", 2)],
+    "admin_role/calendar/sync/": [
+        # auth, водяной знак очистки, окно id журнала, строки журнала, записи
+        Budget("admin", "get", 5, data=lambda t: {"token": 0}),
+    ],
+    "admin_role/events/": [Budget("admin", "get", 1)],
+    "admin_role/calendar/create/": [
+        # auth, 4 FK, блокировка и поиск пересечений, INSERT, счётчики,
+        # журнал календаря, outbox уведомлений, 2 SAVEPOINT
+        Budget("admin", "post", 13, data=lambda t: t.calendar_payload()),
+    ],
+    "admin_role/calendar/bulk/": [
+        Budget("admin", "post", 13, data=lambda t: t.bulk_payload()),
+    ],
+    "admin_role/calendar/<int:pk>/update/": [
+        Budget("admin", "put", 17, kwargs=lambda t: {"pk": t.appointment.pk},
+               data=lambda t: t.calendar_payload()),
+    ],
+    "admin_role/calendar/<int:pk>/delete/": [
+        Budget("admin", "delete", 9, kwargs=lambda t: {"pk": t.make_appointment().pk}),
+    ],
+    "admin_role/free-slots/": [
+        Budget("admin", "get", 4, data=lambda t: {"department": t.department.pk}),
+    ],
+    "admin_role/price-list/": [Budget("admin", "get", 3)],
+    "admin_role/services/create/": [
+        Budget("admin", "post", 3, data=lambda t: {
+            "department": t.department.pk, "name": "УЗИ", "price": "1500",
+        }),
+    ],
+    "admin_role/services/<int:pk>/update/": [
+        Budget("admin", "patch", 3, kwargs=lambda t: {"pk": t.service.pk},
+               data=lambda t: {"price": "1200"}),
+    ],
+    "admin_role/services/<int:pk>/delete/": [
+        Budget("admin", "delete", 5, kwargs=lambda t: {"pk": t.spare_service().pk}),
+    ],
+
+    # Receptionist
+    "receptionist_role/appointments/": [Budget("receptionist", "get", 2)],
+    "receptionist_role/patients/add/": [
+        Budget("receptionist", "post", 16, data=lambda t: t.add_patient_payload()),
+    ],
+    "receptionist_role/appointments/<int:pk>/edit/": [
+        Budget("receptionist", "get", 2, kwargs=lambda t: {"pk": t.appointment.pk}),
+        Budget("receptionist", "patch", 10, kwargs=lambda t: {"pk": t.appointment.pk},
+               data=lambda t: {"status": "confirmed"}),
+    ],
+    "receptionist_role/patients/<int:patient_id>/appointments/": [
+        Budget("receptionist", "get", 2, kwargs=lambda t: {"patient_id": t.patient.pk}),
+    ],
+    "receptionist_role/patients/<int:patient_id>/payments/": [
+        Budget("receptionist", "get", 2, kwargs=lambda t: {"patient_id": t.patient.pk}),
+    ],
+    "receptionist_role/appointments/payment/": [
+        Budget("receptionist", "post", 15, data=lambda t: t.payment_payload()),
+    ],
+    "receptionist_role/profile/": [Budget("receptionist", "get", 1)],
+    "receptionist_role/doctors/": [Budget("receptionist", "get", 2)],
+    "receptionist_role/doctors/create/": [
+        Budget("receptionist", "post", 5, data=lambda t: t.doctor_payload("reg-doc@crm.kg")),
+    ],
+    "receptionist_role/doctors/<int:pk>/": [
+        Budget("receptionist", "get", 2, kwargs=lambda t: {"pk": t.doctor.pk}),
+        # + прежний bonus_percent (смена процента — UPDATE строк DailyRevenue)
+        Budget("receptionist", "patch", 5, kwargs=lambda t: {"pk": t.doctor.pk},
+               data=lambda t: {"cabinet": "303"}),
+        Budget("receptionist", "delete", 6, kwargs=lambda t: {"pk": t.spare_doctor().pk}),
+    ],
+    "receptionist_role/price-list/": [Budget("receptionist", "get", 3)],
+    "receptionist_role/reports/detailed/": [Budget("receptionist", "get", 3)],
+    "receptionist_role/reports/summary/": [Budget("receptionist", "get", 1)],
+    "receptionist_role/calendar/": [Budget("receptionist", "get", 2)],
+    "receptionist_role/calendar/sync/": [
+        Budget("receptionist", "get", 5, data=lambda t: {"token": 0}),
+    ],
+    "receptionist_role/events/": [Budget("receptionist", "get", 1)],
+    "receptionist_role/free-slots/": [
+        Budget("receptionist", "get", 5, data=lambda t: {"service": t.service.pk}),
+    ],
+    "receptionist_role/calendar/create/": [
+        Budget("receptionist", "post", 13, data=lambda t: t.calendar_payload()),
+    ],
+    "receptionist_role/calendar/bulk/": [
+        Budget("receptionist", "post", 13, data=lambda t: t.bulk_payload()),
+    ],
+    "receptionist_role/calendar/<int:pk>/update/": [
+        Budget("receptionist", "put", 17, kwargs=lambda t: {"pk": t.appointment.pk},
+               data=lambda t: t.calendar_payload()),
+    ],
+    "receptionist_role/calendar/<int:pk>/delete/": [
+        Budget("receptionist", "delete", 9, kwargs=lambda t: {"pk": t.make_appointment().pk}),
+    ],
+
+    # Doctor
+    "doctor_role/calendar/": [Budget("doctor", "get", 2)],
+    "doctor_role/calendar/sync/": [
+        Budget("doctor", "get", 6, data=lambda t: {"token": 0}),
+    ],
+    "doctor_role/events/": [Budget("doctor", "get", 2)],
+    "doctor_role/appointments/<int:pk>/update/": [
+        Budget("doctor", "patch", 10, kwargs=lambda t: {"pk": t.appointment.pk},
+               data=lambda t: {
+                   "start_time": t.appointment.start_time,
+                   "end_time": t.appointment.end_time,
+                   "status": "confirmed",
+               }),
+    ],
+    "doctor_role/profile/": [Budget("doctor", "get", 2)],
+    "doctor_role/patients/<int:pk>/": [
+        Budget("doctor", "get", 2, kwargs=lambda t: {"pk": t.patient.pk}),
+    ],
+    "doctor_role/patients/<int:patient_id>/appointments/": [
+        Budget("doctor", "get", 2, kwargs=lambda t: {"patient_id": t.patient.pk}),
+    ],
+    "doctor_role/patients/<int:patient_id>/payments/": [
+        Budget("doctor", "get", 2, kwargs=lambda t: {"patient_id": t.patient.pk}),
+    ],
+    "doctor_role/notifications/": [Budget("doctor", "get", 4)],
+    "doctor_role/notifications/unread-count/": [Budget("doctor", "get", 2)],
+    "doctor_role/notifications/read/": [
+        Budget("doctor", "post", 6, data=lambda t: {"before": timezone.now()}),
+    ],
+    "doctor_role/notifications/<int:pk>/read/": [
+        Budget("doctor", "post", 5, kwargs=lambda t: {"pk": t.notification.pk}),
+    ],
+}
+
+
+@override_settings(
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"],
+    MEDIA_ROOT=TEST_MEDIA_ROOT,
+    REPORT_EXPORT_ROOT=TEST_EXPORT_ROOT,
+)
+class QueryBudgetTests(CRMTestCase):
+    """
+    Каждый маршрут crm_app/urls.py вызывается от нужной роли на
+    заполненной базе. Лишние запросы или рост числа запросов вместе с
+    количеством строк (N+1) валят тест со списком запросов по месту вызова.
+    """
+    GROW_BY = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.department_2 = Department.objects.create(name="Неврология")
+        cls.service_2 = Service.objects.create(
+            department=cls.department_2, name="Приём невролога", price=Decimal("1500"),
+        )
+        for i in range(2):
+            user = UserProfile.objects.create_user(
+                username=f"neuro{i}@crm.kg", email=f"neuro{i}@crm.kg", password="pass",
+                role="doctor", first_name=f"Невролог{i}", last_name="Тестов",
+            )
+            Doctor.objects.create(
+                user=user, department=cls.department_2,
+                specialization="Невролог", cabinet=f"20{i}", bonus_percent=15,
+            )
+
+        now = timezone.now()
+        doctors = list(Doctor.objects.select_related("department"))
+        for i in range(6):
+            patient = Patient.objects.create(
+                full_name=f"Пациент {i}", gender="female" if i % 2 else "male",
+            )
+            for j, doctor in enumerate(doctors):
+                service = cls.service if doctor.department == cls.department else cls.service_2
+                cls._seed_visit(patient, doctor, service, now - timedelta(days=i + j + 1), i + j)
+
+        # визиты не пересекаются: now и дальше — под make_appointment() и grow()
+        for i in range(3):
+            cls._seed_visit(cls.patient, cls.doctor, cls.service, now - timedelta(hours=i + 1), i)
+
+        cls.appointment = Appointment.objects.filter(
+            patient=cls.patient, doctor=cls.doctor
+        ).first()
+        cls.notification = Notification.objects.filter(recipient=cls.doctor_user).first()
+
+    @classmethod
+    def _seed_visit(cls, patient, doctor, service, start, n):
+        status_ = ("completed", "queue", "confirmed", "cancelled")[n % 4]
+        appointment = Appointment.objects.create(
+            patient=patient, doctor=doctor, department=doctor.department,
+            service=service, registrar=cls.receptionist, status=status_,
+            start_time=start, end_time=start + timedelta(minutes=30),
+        )
+        if status_ == "completed":
+            Payment.objects.create(
+                appointment=appointment, amount=service.price,
+                method="cash" if n % 2 else "card", registrar=cls.receptionist,
+            )
+        Notification.objects.create(
+            recipient=doctor.user, title="Новая запись", message=str(patient),
+            appointment=appointment, is_read=bool(n % 2),
+        )
+        return appointment
+
+    # ===== данные для маршрутов =====
+    def grow(self):
+        now = timezone.now()
+        for i in range(self.GROW_BY):
+            start = now + timedelta(minutes=30 * (i + 1))
+            self._seed_visit(self.patient, self.doctor, self.service, start, 0)
+
+    def spare_doctor(self):
+        user = UserProfile.objects.create_user(
+            username="spare@crm.kg", email="spare@crm.kg", role="doctor",
+        )
+        return Doctor.objects.create(
+            user=user, department=self.department, specialization="-", cabinet="999",
+        )
+
+    def done_export(self):
+        job, _ = exports.enqueue("summary", {}, user=self.admin)
+        return exports.run(exports.claim_next())
+
+    def spare_service(self):
+        return Service.objects.create(department=self.department, name="Лишняя", price=1)
+
+    def reset_code_payload(self):
+        ResetPasswordToken.objects.create(user=self.doctor_user, key="1234")
+        return {
+            "email": self.doctor_user.email, "reset_code": 1234,
+            "new_password": "secret", "confirm_password": "secret",
+        }
+
+    def add_patient_payload(self, registrar=False):
+        start = timezone.now() + timedelta(days=3)
+        data = {
+            "full_name": "Новый Пациент", "birth_date": "1990-01-01",
+            "gender": "male", "department": self.department.pk,
+            "doctor": self.doctor.pk, "service": self.service.pk,
+            "start_time": start, "end_time": start + timedelta(minutes=30),
+            "status": "queue",
+        }
+        if registrar:
+            data["registrar"] = self.receptionist.pk
+        return data
+
+    def payment_payload(self):
+        appointment = self.make_appointment(start=timezone.now() + timedelta(days=5))
+        return {"appointment_id": appointment.pk, "method": "cash", "amount": "500"}
+
+    def doctor_payload(self, email):
+        return {
+            "first_name": "Новый", "last_name": "Врач", "email": email,
+            "phone": "+996700000000", "password": "pass",
+            "department": self.department.pk, "specialization": "Терапевт",
+            "cabinet": "404", "bonus_percent": 5,
+        }
+
+    def bulk_payload(self):
+        return {
+            "patient": self.patient.pk, "doctor": self.doctor.pk,
+            "department": self.department.pk, "service": self.service.pk,
+            "recurrence": {
+                "start_time": timezone.now() + timedelta(days=14),
+                "duration": 30, "count": 10,
+            },
+        }
+
+    def calendar_payload(self):
+        start = timezone.now() + timedelta(days=7)
+        return {
+            "patient": self.patient.pk, "doctor": self.doctor.pk,
+            "department": self.department.pk, "service": self.service.pk,
+            "start_time": start, "end_time": start + timedelta(minutes=30),
+            "status": "queue",
+        }
+
+    # ===== вызов маршрута =====
+    def call(self, route, budget, warm=False):
+        """
+        Запрос с заголовком Authorization: Bearer, как у клиента: запросы
+        аутентификации тоже считаются. Токен каждый раз новый — кэш auth
+        холодный; warm — пользователь токена заранее положен в кэш.
+        """
+        path = "/" + route
+        for name, value in (budget.kwargs(self) if budget.kwargs else {}).items():
+            path = re.sub(rf"<\w+:{name}>", str(value), path)
+        data = budget.data(self) if budget.data else None
+
+        user = {"admin": self.admin, "receptionist": self.receptionist,
+                "doctor": self.doctor_user, None: None}[budget.role]
+        if user is None:
+            self.client.credentials()
+        else:
+            token = AccessToken.for_user(user)
+            if warm:
+                CachedJWTAuthentication().get_user(token)
+            self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+        with QueryRecorder() as recorder:
+            response = getattr(self.client, budget.method)(path, data, format="json")
+
+        self.assertLess(
+            response.status_code, 400,
+            f"{budget.method.upper()} {path}: {getattr(response, 'data', response)}",
+        )
+        return recorder
+
+    def assertWithinBudget(self, route, budget, recorder, warm=False):
+        queries = budget.queries - 1 if warm and budget.role else budget.queries
+        self.assertLessEqual(
+            len(recorder), queries,
+            f"\n{budget.method.upper()} /{route} как {budget.role}"
+            f"{' (тёплый кэш)' if warm else ''}: "
+            f"{len(recorder)} запросов при бюджете {queries}\n{recorder.report()}",
+        )
+
+    def test_every_route_has_a_budget(self):
+        routes = {str(pattern.pattern) for pattern in crm_urls.urlpatterns}
+        self.assertEqual(routes - set(ROUTE_BUDGETS), set())
+        self.assertEqual(set(ROUTE_BUDGETS) - routes, set())
+
+    def test_read_routes(self):
+        reads = [
+            (route, budget)
+            for route, budgets in ROUTE_BUDGETS.items()
+            for budget in budgets if budget.method == "get"
+        ]
+
+        before = {}
+        for route, budget in reads:
+            with self.subTest(route=route, role=budget.role):
+                before[route] = self.call(route, budget)
+                self.assertWithinBudget(route, budget, before[route])
+            with self.subTest(route=route, role=budget.role, warm=True):
+                self.assertWithinBudget(route, budget, self.call(route, budget, warm=True), warm=True)
+
+        self.grow()
+
+        for route, budget in reads:
+            with self.subTest(route=route, role=budget.role, grown=True):
+                after = self.call(route, budget)
+                per_row = (len(after) - len(before[route])) / self.GROW_BY
+                self.assertLessEqual(
+                    per_row, budget.per_row,
+                    f"\nGET /{route} как {budget.role}: +{per_row:g} запросов на строку "
+                    f"при бюджете {budget.per_row}\n{after.report()}",
+                )
+
+    def test_write_routes(self):
+        for route, budgets in ROUTE_BUDGETS.items():
+            for budget in budgets:
+                if budget.method == "get":
+                    continue
+                for warm in (False, True):
+                    with self.subTest(route=route, method=budget.method, role=budget.role, warm=warm):
+                        # каждая запись откатывается, чтобы маршруты не влияли друг на друга
+                        with transaction.atomic():
+                            recorder = self.call(route, budget, warm=warm)
+                            transaction.set_rollback(True)
+                        self.assertWithinBudget(route, budget, recorder, warm=warm)
+
+
+# =========================
+# INDEX USAGE
+# =========================
+class IndexUsageTests(CRMTestCase):
+    """
+    EXPLAIN горячих запросов на большой базе: ни один не должен
+    сваливаться в последовательное чтение таблицы.
+    """
+    DOCTORS = 30
+    PATIENTS = 2000
+    APPOINTMENTS = 20000
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        users = UserProfile.objects.bulk_create([
+            UserProfile(username=f"seed-doc{i}", role="doctor")
+            for i in range(cls.DOCTORS)
+        ])
+        doctors = Doctor.objects.bulk_create([
+            Doctor(user=user, department=cls.department, specialization="-", cabinet=str(i))
+            for i, user in enumerate(users)
+        ])
+        patients = Patient.objects.bulk_create([
+            Patient(full_name=f"Пациент {i}", gender="male")
+            for i in range(cls.PATIENTS)
+        ])
+
+        base = timezone.now() - timedelta(days=3 * 365)
+        statuses = [choice for choice, _ in Appointment.STATUS_CHOICES]
+        appointments = Appointment.objects.bulk_create([
+            Appointment(
+                patient=patients[i % cls.PATIENTS],
+                doctor=doctors[i % cls.DOCTORS],
+                department=cls.department,
+                service=cls.service,
+                start_time=base + timedelta(hours=i),
+                end_time=base + timedelta(hours=i, minutes=30),
+                status=statuses[i % len(statuses)],
+            )
+            for i in range(cls.APPOINTMENTS)
+        ])
+        Payment.objects.bulk_create([
+            Payment(appointment=appointment, amount=1000, method=("cash", "card")[i % 2])
+            for i, appointment in enumerate(appointments[::2])
+        ])
+        Notification.objects.bulk_create([
+            Notification(
+                recipient=doctors[i % cls.DOCTORS].user, title="-", message="-",
+                appointment=appointment, is_read=i % 3 > 0,
+            )
+            for i, appointment in enumerate(appointments)
+        ])
+
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def assertUsesIndexes(self, queryset):
+        plan = queryset.explain()
+        if connection.vendor == "postgresql":
+            full_scan = re.search(r"Seq Scan on (\w+)", plan)
+        else:
+            full_scan = re.search(r"\bSCAN (crm_app_\w+)\b(?! USING)", plan)
+        self.assertIsNone(full_scan, f"\n{queryset.query}\n{plan}")
+
+    def test_hot_queries_use_indexes(self):
+        doctor = Doctor.objects.last()
+        patient = Patient.objects.last()
+        since = timezone.now() - timedelta(days=30)
+        until = since + timedelta(days=7)
+
+        queries = {
+            "appointment by doctor": Appointment.objects.filter(
+                doctor=doctor, start_time__gte=since, start_time__lt=until
+            ),
+            "appointment conflicts": scheduling.find_conflicts(
+                doctor, since, since + timedelta(minutes=30)
+            ),
+            "calendar window": Appointment.objects.filter(
+                start_time__gte=since, start_time__lt=until
+            ).order_by("start_time", "id"),
+            "appointment by department": Appointment.objects.filter(
+                department=self.department, start_time__gte=since, start_time__lt=until
+            ),
+            "appointment by patient": Appointment.objects.filter(
+                patient=patient
+            ).order_by("-created_at"),
+            "appointment by status": Appointment.objects.filter(
+                status="cancelled", created_at__gte=since
+            ),
+            "appointment window": Appointment.objects.filter(created_at__gte=since),
+            "payment by period": Payment.objects.filter(
+                created_at__gte=since, created_at__lt=until, method="cash"
+            ),
+            "payment by status": Payment.objects.filter(
+                appointment__status="completed", created_at__gte=since
+            ),
+            "payment by patient": Payment.objects.filter(
+                appointment__patient=patient
+            ),
+            "unread notifications": Notification.objects.filter(
+                recipient=doctor.user, is_read=False
+            ),
+            "notifications": Notification.objects.filter(recipient=doctor.user),
+            "notification window": Notification.objects.filter(
+                recipient=doctor.user, created_at__gte=since
+            ).order_by("-created_at", "-id"),
+            "oldest unread notification": Notification.objects.filter(
+                recipient=doctor.user, is_read=False
+            ).order_by("created_at")[:1],
+            "notification retention": Notification.objects.filter(
+                is_read=True, created_at__lt=since
+            ).order_by("created_at")[:1000],
+        }
+        for name, queryset in queries.items():
+            with self.subTest(name):
+                self.assertUsesIndexes(queryset)
+
+
+class SummaryReportTests(CRMTestCase):
+    def setUp(self):
+        super().setUp()
+        for amount, method, status_ in (
+            ("1000", "cash", "completed"),
+            ("400", "cash", "completed"),
+            ("600", "card", "completed"),
+            ("900", "card", "confirmed"),
+        ):
+            Payment.objects.create(
+                appointment=self.make_appointment(status=status_),
+                amount=Decimal(amount), method=method,
+            )
+
+    def test_summary_in_one_query(self):
+        self.login(self.admin)
+        with self.assertNumQueries(1):
+            data = self.client.get("/admin_role/reports/summary/").data
+
+        self.assertEqual(data["total_cash"], Decimal("1400"))
+        self.assertEqual(data["total_card"], Decimal("600"))
+        self.assertEqual(data["total_sum"], Decimal("2000"))
+        self.assertEqual(data["doctors_cash"], Decimal("140"))
+        self.assertEqual(data["doctors_card"], Decimal("60"))
+        self.assertEqual(data["doctors_total"], Decimal("200"))
+        self.assertEqual(data["clinic_cash"], Decimal("1260"))
+        self.assertEqual(data["clinic_card"], Decimal("540"))
+
+    def test_receptionist_and_excel_share_the_numbers(self):
+        today = timezone.localdate().isoformat()
+        self.login(self.receptionist)
+        data = self.client.get(
+            f"/receptionist_role/reports/summary/?date_from={today}&date_to={today}"
+        ).data
+        self.assertEqual(data["total_sum"], Decimal("2000"))
+
+        self.login(self.admin)
+        with self.assertNumQueries(1):
+            response = self.client.get("/admin_role/reports/summary/excel/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_empty_period(self):
+        self.login(self.admin)
+        data = self.client.get("/admin_role/reports/summary/?date_to=2000-01-01").data
+        self.assertEqual(data["total_sum"], 0)
+        self.assertEqual(data["doctors_total"], 0)
+
+    def test_invalid_date(self):
+        self.login(self.admin)
+        response = self.client.get("/admin_role/reports/summary/?date_from=вчера")
+        self.assertEqual(response.status_code, 400)
+
+
+class DetailedReportExcelTests(CRMTestCase):
+    def download(self, query="", stream_only=False):
+        response = self.client.get(f"/admin_role/reports/detailed/excel/{query}")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        if stream_only:
+            # читаем поток, не собирая файл в памяти
+            for _ in response.streaming_content:
+                pass
+            response.close()
+            return None
+        content = b"".join(response.streaming_content)
+        response.close()
+        return content
+
+    def test_filters_match_detailed_report(self):
+        self.seed_payments(3)
+        self.seed_payments(2, method="card")
+        other = Patient.objects.create(full_name="Асанов", gender="male")
+        Payment.objects.create(
+            appointment=self.make_appointment(patient=other),
+            amount=Decimal("50"), method="cash",
+        )
+
+        self.login(self.admin)
+        workbook = openpyxl.load_workbook(
+            io.BytesIO(self.download("?search=Асанов")), read_only=True
+        )
+        rows = list(workbook.active.values)
+
+        self.assertEqual(rows[0][0], "Дата")
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][1], "Асанов")
+
+        workbook = openpyxl.load_workbook(
+            io.BytesIO(self.download("?period=day")), read_only=True
+        )
+        self.assertEqual(len(list(workbook.active.values)), 7)
+
+    @mock.patch.object(reports, "EXPORT_CHUNK_SIZE", 100)
+    def test_memory_does_not_grow_with_rows(self):
+        self.login(self.admin)
+
+        # пик — пара пачек iterator; оба объёма в несколько пачек
+        peaks = []
+        for count in (1000, 4000):
+            self.seed_payments(count - Payment.objects.count())
+            tracemalloc.start()
+            self.download(stream_only=True)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+        # в 4 раза больше строк — пик памяти почти тот же
+        self.assertLess(peaks[1], peaks[0] * 1.5, peaks)
+
+
+class CachedJWTAuthenticationTests(CRMTestCase):
+    def bearer(self, user):
+        token = RefreshToken.for_user(user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def test_user_is_loaded_once_per_token(self):
+        self.bearer(self.receptionist)
+        self.client.get("/receptionist_role/price-list/")
+
+        # прайс-лист тоже в кэше — запрос не трогает БД вообще
+        with self.assertNumQueries(0):
+            response = self.client.get("/receptionist_role/price-list/")
+        self.assertEqual(response.status_code, 200)
+
+        # профиль читает email и phone из кэша, без догрузки полей
+        with self.assertNumQueries(0):
+            profile = self.client.get("/receptionist_role/profile/")
+        self.assertEqual(profile.status_code, 200)
+        self.assertEqual(profile.data["email"], self.receptionist.email)
+
+    def test_profiles_with_warm_cache(self):
+        self.doctor_user.phone = "+996700123456"
+        self.doctor_user.save()
+        for user, path in (
+            (self.receptionist, "/receptionist_role/profile/"),
+            (self.doctor_user, "/doctor_role/profile/"),
+        ):
+            with self.subTest(path):
+                self.bearer(user)
+                self.client.get(path)
+                # доктор: одна строка Doctor, пользователь — из кэша
+                with self.assertNumQueries(1 if user.role == "doctor" else 0):
+                    response = self.client.get(path)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.data["email"], user.email)
+        self.assertEqual(response.data["phone"], "+996700123456")
+
+    def test_deactivation_and_role_change_apply_immediately(self):
+        self.bearer(self.admin)
+        self.assertEqual(self.client.get("/admin_role/price-list/").status_code, 200)
+
+        self.admin.role = "receptionist"
+        self.admin.save()
+        self.assertEqual(self.client.get("/admin_role/price-list/").status_code, 403)
+
+        self.admin.is_active = False
+        self.admin.save()
+        self.assertEqual(self.client.get("/receptionist_role/price-list/").status_code, 401)
+
+    def test_cached_user_saves_only_loaded_fields(self):
+        self.bearer(self.doctor_user)
+        self.client.get("/doctor_role/profile/")
+
+        request = APIRequestFactory().get(
+            "/", HTTP_AUTHORIZATION=self.client._credentials["HTTP_AUTHORIZATION"]
+        )
+        user, _ = CachedJWTAuthentication().authenticate(request)
+        self.assertEqual(user.get_deferred_fields(), {"password"})
+        self.assertEqual(user.email, self.doctor_user.email)
+
+        user.first_name = "Новое"
+        user.save()
+        self.doctor_user.refresh_from_db()
+        self.assertEqual(self.doctor_user.first_name, "Новое")
+        self.assertTrue(self.doctor_user.check_password("pass"))
+
+
+class PriceListTests(CRMTestCase):
+    def setUp(self):
+        super().setUp()
+        Service.objects.create(department=self.department, name="Анализы", price=300)
+        Department.objects.create(name="Аллергология")
+        self.login(self.receptionist)
+
+    def test_sorted_cached_and_revalidated(self):
+        with self.assertNumQueries(2):
+            first = self.client.get("/receptionist_role/price-list/")
+        self.assertEqual([d["name"] for d in first.data], ["Аллергология", "Терапия"])
+        self.assertEqual(
+            [s["name"] for s in first.data[1]["services"]], ["Анализы", "Консультация"]
+        )
+
+        etag = first["ETag"]
+        with self.assertNumQueries(0):
+            cached = self.client.get("/receptionist_role/price-list/")
+            not_modified = self.client.get(
+                "/receptionist_role/price-list/", HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(cached.data, first.data)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b"")
+        self.assertEqual(not_modified["ETag"], etag)
+
+    def test_service_change_gives_new_etag(self):
+        etag = self.client.get("/receptionist_role/price-list/")["ETag"]
+
+        self.service.price = 1200
+        self.service.save()
+
+        response = self.client.get("/receptionist_role/price-list/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertIn("1200 сом", str(response.data))
+
+        self.login(self.admin)
+        Department.objects.filter(name="Аллергология").delete()
+        self.assertEqual(len(self.client.get("/admin_role/price-list/").data), 1)
+
+
+class ReportCacheTests(CRMTestCase):
+    def setUp(self):
+        super().setUp()
+        self.payment = Payment.objects.create(
+            appointment=self.make_appointment(status="completed"),
+            amount=Decimal("1000"), method="cash",
+        )
+        self.login(self.admin)
+
+    def test_hit_for_same_normalized_params(self):
+        today = timezone.localdate().isoformat()
+        first = self.client.get(f"/admin_role/reports/summary/?date_from={today}&date_to={today}")
+        with self.assertNumQueries(0):
+            second = self.client.get(
+                f"/admin_role/reports/summary/?date_to={today}&date_from={today}&search=&format=json"
+            )
+
+        self.assertEqual(first["X-Report-Cache"], "miss")
+        self.assertEqual(second["X-Report-Cache"], "hit")
+        self.assertEqual(second["Age"], "0")
+        self.assertEqual(second.data, first.data)
+
+        # регистратор видит тот же отчёт — та же запись кэша
+        self.login(self.receptionist)
+        self.assertEqual(
+            self.client.get(f"/receptionist_role/reports/summary/?date_from={today}&date_to={today}")["X-Report-Cache"],
+            "hit",
+        )
+
+    def test_payment_and_appointment_writes_invalidate(self):
+        self.client.get("/admin_role/reports/detailed/")
+        Payment.objects.create(
+            appointment=self.make_appointment(status="completed"),
+            amount=Decimal("500"), method="card",
+        )
+        response = self.client.get("/admin_role/reports/detailed/")
+        self.assertEqual(response["X-Report-Cache"], "miss")
+        self.assertEqual(response.data["summary"]["total_count"], 2)
+
+        self.client.get("/admin_role/reports/summary/")
+        appointment = self.payment.appointment
+        appointment.status = "cancelled"
+        appointment.save()
+        response = self.client.get("/admin_role/reports/summary/")
+        self.assertEqual(response["X-Report-Cache"], "miss")
+        self.assertEqual(response.data["total_sum"], Decimal("500"))
+
+    def test_pagination_links_follow_request(self):
+        Payment.objects.create(
+            appointment=self.make_appointment(status="completed"),
+            amount=Decimal("500"), method="card",
+        )
+        url = "/admin_role/reports/detailed/?page_size=1"
+        first = self.client.get(url)
+        second = self.client.get(url, secure=True)
+
+        self.assertEqual(second["X-Report-Cache"], "hit")
+        self.assertTrue(first.data["next"].startswith("http://testserver/"))
+        self.assertTrue(second.data["next"].startswith("https://testserver/"))
+        self.assertIsNone(second.data["previous"])
+        self.assertEqual(second.data["results"], first.data["results"])
+
+        page_2 = self.client.get(second.data["next"])
+        self.assertEqual(len(page_2.data["results"]), 1)
+        self.assertIsNone(page_2.data["next"])
+        self.assertIsNotNone(page_2.data["previous"])
+
+    def test_reference_writes_invalidate_detailed(self):
+        appointment = self.payment.appointment
+        for obj, field, value in (
+            (appointment.patient, "full_name", "Переименован"),
+            (appointment.service, "name", "Новая услуга"),
+            (appointment.department, "name", "Новое отделение"),
+            (appointment.doctor, "bonus_percent", 40),
+        ):
+            with self.subTest(model=type(obj).__name__):
+                self.client.get("/admin_role/reports/detailed/")
+                setattr(obj, field, value)
+                obj.save()
+                response = self.client.get("/admin_role/reports/detailed/")
+                self.assertEqual(response["X-Report-Cache"], "miss")
+
+        row = response.data["results"][0]
+        self.assertEqual(
+            (row["patient"], row["service"], row["department"]),
+            ("Переименован", "Новая услуга", "Новое отделение"),
+        )
+        self.assertEqual(row["doctor_bonus"], "40%")
+
+    def test_stats_per_endpoint(self):
+        for _ in range(3):
+            self.client.get("/admin_role/reports/summary/")
+        self.client.get("/admin_role/reports/detailed/")
+
+        self.assertEqual(
+            self.client.get("/admin_role/reports/cache-stats/").data,
+            {
+                "summary": {"hits": 2, "misses": 1},
+                "detailed": {"hits": 0, "misses": 1},
+            },
+        )
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CacheStampedeTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = caches["reports"]
+        self.cache.clear()
+        self.calls = 0
+
+    def slow_compute(self):
+        self.calls += 1
+        time.sleep(0.2)
+        return {"calls": self.calls}
+
+    def test_concurrent_misses_compute_once(self):
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(
+                    get_or_compute(self.cache, "report:x", self.slow_compute)
+                )
+            )
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual([r.value for r in results], [{"calls": 1}] * 8)
+        self.assertEqual(sum(not r.hit for r in results), 1)
+        self.assertIsNone(self.cache.get("report:x:lock"))
+
+    def test_stale_value_served_while_locked(self):
+        get_or_compute(self.cache, "report:x", self.slow_compute)
+        self.cache.add("report:x:lock", 1)
+
+        # огромный beta — раннее обновление наверняка, но lock занят
+        # другим процессом
+        cached = get_or_compute(self.cache, "report:x", self.slow_compute, beta=1e9)
+        self.assertEqual((cached.value, cached.hit), ({"calls": 1}, True))
+        self.assertEqual(self.calls, 1)
+
+    def test_file_backend_sequential(self):
+        # add у file не атомарен: лавину между процессами он не держит,
+        # но по очереди — кэш, блокировка и устаревшее значение как у остальных
+        directory = tempfile.mkdtemp(prefix="crm-test-cache-")
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        with override_settings(CACHES=build_caches("file", directory)):
+            cache = caches["reports"]
+            first = get_or_compute(cache, "report:x", self.slow_compute)
+            second = get_or_compute(cache, "report:x", self.slow_compute)
+            self.assertEqual((first.hit, second.hit, second.value), (False, True, {"calls": 1}))
+            self.assertIsNone(cache.get("report:x:lock"))
+
+            self.assertTrue(cache.add("report:x:lock", 1))
+            cached = get_or_compute(cache, "report:x", self.slow_compute, beta=1e9)
+            self.assertEqual((cached.value, self.calls), ({"calls": 1}, 1))
+
+    def test_build_caches_per_alias(self):
+        config = build_caches("file", "/var/cache/crm")
+        self.assertEqual(set(config), {"default", "reports", "auth", "price-list"})
+        self.assertEqual(config["reports"]["LOCATION"], "/var/cache/crm/reports")
+        self.assertIsNone(config["price-list"]["TIMEOUT"])
+        self.assertEqual(
+            build_caches("redis", "redis://redis:6379/1")["auth"]["KEY_PREFIX"], "crm:auth"
+        )
+        with self.assertRaises(ValueError):
+            build_caches("mongo", "")
+
+
+class StreamingReportTests(CRMTestCase):
+    def setUp(self):
+        super().setUp()
+        for amount, method in (("1000", "cash"), ("400", "card"), ("250", "cash")):
+            Payment.objects.create(
+                appointment=self.make_appointment(status="completed"),
+                amount=Decimal(amount), method=method,
+            )
+        self.login(self.admin)
+
+    def lines(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content).decode().splitlines()
+
+    def test_detailed_ndjson_has_rows_and_trailing_summary(self):
+        rows = [
+            json.loads(line)
+            for line in self.lines(self.client.get("/admin_role/reports/detailed/?format=ndjson"))
+        ]
+        page = self.client.get("/admin_role/reports/detailed/").data
+
+        self.assertEqual(
+            rows[:-1], json.loads(json.dumps(page["results"], cls=DjangoJSONEncoder))
+        )
+        self.assertEqual(rows[-1]["summary"]["total_count"], 3)
+        self.assertEqual(Decimal(rows[-1]["summary"]["total_sum"]), page["summary"]["total_sum"])
+        self.assertEqual(Decimal(rows[-1]["summary"]["cash"]), Decimal("1250"))
+
+    def test_rows_are_read_while_streaming(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                "/admin_role/reports/detailed/?format=csv",
+                HTTP_ACCEPT="text/csv",
+            )
+            before = len(queries)
+            self.lines(response)
+
+        # курсор по оплатам открывается только при чтении тела ответа
+        self.assertEqual(before, 0)
+        self.assertEqual(len(queries), 1)
+
+    def test_doctor_close_csv(self):
+        lines = self.lines(self.client.get(
+            f"/admin_role/reports/doctors-close/?doctor={self.doctor.pk}&format=csv"
+        ))
+        self.assertEqual(lines[0], "id,date,total_sum")
+        self.assertEqual(len(lines), 1 + 1 + 2)
+        self.assertEqual(Decimal(lines[-1].split(",")[2]), Decimal("1650"))
+
+    def test_patient_payments_accept_header(self):
+        response = self.client.get(
+            f"/admin_role/patients/{self.patient.pk}/payments/",
+            HTTP_ACCEPT="application/x-ndjson",
+        )
+        lines = self.lines(response)
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(
+            json.loads(lines[-1])["summary"],
+            {"total": "1650.00", "cash": "1250.00", "card": "400.00"},
+        )
+
+    @mock.patch.object(reports, "EXPORT_CHUNK_SIZE", 100)
+    def test_memory_does_not_grow_with_rows(self):
+        peaks = []
+        for count in (1000, 4000):
+            self.seed_payments(count - Payment.objects.count())
+            response = self.client.get("/admin_role/reports/detailed/?format=ndjson")
+            tracemalloc.start()
+            for _ in response.streaming_content:
+                pass
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            response.close()
+
+        self.assertLess(peaks[1], peaks[0] * 1.5, peaks)
+
+    def test_errors_in_stream_format(self):
+        response = self.client.get(
+            "/admin_role/reports/detailed/?format=ndjson&date_from=x&date_to=y"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("date", json.loads(response.content))
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT, REPORT_EXPORT_ROOT=TEST_EXPORT_ROOT)
+class ReportExportTests(CRMTestCase):
+    def enqueue(self, kind, **params):
+        self.login(self.admin)
+        return self.client.post(
+            "/admin_role/reports/exports/",
+            {"kind": kind, "params": params},
+            format="json",
+        )
+
+    def work(self):
+        call_command(
+            "run_report_exports", "--once", "--concurrency", "1",
+            stdout=io.StringIO(),
+        )
+
+    def test_identical_requests_share_one_job(self):
+        first = self.enqueue("detailed", period="month", doctor=self.doctor.pk)
+        same = self.enqueue("detailed", doctor=str(self.doctor.pk), period="month", search="")
+        other = self.enqueue("detailed", period="day")
+
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(same.status_code, 200)
+        self.assertEqual(same.data["id"], first.data["id"])
+        self.assertNotEqual(other.data["id"], first.data["id"])
+        self.assertEqual(ReportExport.objects.count(), 2)
+
+    def test_worker_builds_file_for_download(self):
+        Payment.objects.create(
+            appointment=self.make_appointment(status="completed"),
+            amount=Decimal("700"), method="card",
+        )
+        job_id = self.enqueue("detailed", period="day").data["id"]
+        self.work()
+
+        data = self.client.get(f"/admin_role/reports/exports/{job_id}/").data
+        self.assertEqual(data["status"], "done")
+        self.assertEqual(data["progress"], 100)
+        self.assertTrue(data["download_url"].endswith(f"/exports/{job_id}/download/"))
+
+        response = self.client.get(f"/admin_role/reports/exports/{job_id}/download/")
+        rows = list(openpyxl.load_workbook(
+            io.BytesIO(b"".join(response.streaming_content)), read_only=True
+        ).active.values)
+        response.close()
+        self.assertEqual(rows[1][4], 700)
+
+        # после готовности такой же запрос — уже новая задача
+        self.assertEqual(self.enqueue("detailed", period="day").status_code, 202)
+
+    def test_file_is_outside_media_root(self):
+        job, _ = exports.enqueue("summary", {}, user=self.admin)
+        job = exports.run(exports.claim_next())
+
+        path = job.file.path
+        self.assertTrue(path.startswith(TEST_EXPORT_ROOT + os.sep))
+        self.assertFalse(path.startswith(TEST_MEDIA_ROOT + os.sep))
+        # публичной ссылки нет — только download/
+        with self.assertRaises(ValueError):
+            job.file.url
+
+    def test_stale_job_is_requeued_on_next_poll(self):
+        stale = []
+
+        def sleep(seconds):
+            if stale:
+                raise KeyboardInterrupt
+            # задача упавшего воркера появилась, пока этот ждал
+            job, _ = exports.enqueue("summary", {}, user=self.admin)
+            hour_ago = timezone.now() - timedelta(hours=1)
+            ReportExport.objects.filter(pk=job.pk).update(
+                status="running", started_at=hour_ago, heartbeat_at=hour_ago,
+            )
+            stale.append(job.pk)
+
+        with mock.patch("crm_app.management.commands.run_report_exports.time.sleep", sleep):
+            with self.assertRaises(KeyboardInterrupt):
+                call_command("run_report_exports", "--concurrency", "1", stdout=io.StringIO())
+
+        self.assertEqual(ReportExport.objects.get(pk=stale[0]).status, "done")
+
+    def finished(self, **params):
+        exports.enqueue("summary", params, user=self.admin)
+        return exports.run(exports.claim_next())
+
+    def test_long_job_with_heartbeat_is_not_requeued(self):
+        exports.enqueue("summary", {}, user=self.admin)
+        job = exports.claim_next()
+        long_ago = timezone.now() - timedelta(hours=2)
+        requeued = []
+
+        def build(params, progress):
+            # выгрузка идёт дольше STALE_AFTER, но пишет progress
+            ReportExport.objects.filter(pk=job.pk).update(
+                started_at=long_ago, heartbeat_at=long_ago,
+            )
+            progress(50)
+            requeued.append(exports.requeue_stale())
+            return reports.summary_xlsx()
+
+        with mock.patch.dict(exports.EXPORTS, {"summary": ((), build)}):
+            job = exports.run(job)
+
+        self.assertEqual((requeued, job.status), ([0], "done"))
+
+        ReportExport.objects.filter(pk=job.pk).update(status="running", heartbeat_at=long_ago)
+        self.assertEqual(exports.requeue_stale(), 1)
+
+    def test_old_exports_expire_with_files(self):
+        old = self.finished()
+        ReportExport.objects.filter(pk=old.pk).update(
+            created_at=timezone.now() - timedelta(days=2),
+        )
+        fresh = self.finished(date_from="2024-01-01")
+
+        self.assertEqual(exports.expire(), 1)
+        self.assertFalse(os.path.exists(old.file.path))
+        self.assertEqual(list(ReportExport.objects.values_list("pk", flat=True)), [fresh.pk])
+        self.assertTrue(os.path.exists(fresh.file.path))
+
+    def test_failed_job_reports_error(self):
+        job_id = self.enqueue("summary", date_from="2024-13-01").data["id"]
+        self.work()
+
+        job = ReportExport.objects.get(pk=job_id)
+        self.assertEqual(job.status, "failed")
+        self.assertIn("2024-13-01", job.error)
+        response = self.client.get(f"/admin_role/reports/exports/{job_id}/download/")
+        self.assertEqual(response.status_code, 404)
+
+
+class DailyRevenueTests(CRMTestCase):
+    def rollup(self):
+        return sorted(
+            DailyRevenue.objects
+            .filter(payments_count__gt=0)
+            .values_list("doctor_id", "method", "payments_count", "amount_sum", "doctor_bonus_sum")
+        )
+
+    def pay(self, appointment, amount="1000", method="cash"):
+        self.login(self.receptionist)
+        response = self.client.post("/receptionist_role/appointments/payment/", {
+            "appointment_id": appointment.pk, "amount": amount, "method": method,
+        })
+        self.assertEqual(response.status_code, 201, response.data)
+        return Payment.objects.get(appointment=appointment)
+
+    def test_payment_updates_rollup(self):
+        self.pay(self.make_appointment())
+        self.pay(self.make_appointment(), amount="500")
+        self.pay(self.make_appointment(), amount="300", method="card")
+
+        self.assertEqual(self.rollup(), [
+            (self.doctor.pk, "card", 1, Decimal("300"), Decimal("30")),
+            (self.doctor.pk, "cash", 2, Decimal("1500"), Decimal("150")),
+        ])
+
+    def test_status_change_and_delete(self):
+        appointment = self.make_appointment()
+        payment = self.pay(appointment)
+
+        appointment.refresh_from_db()
+        appointment.status = "cancelled"
+        appointment.save()
+        self.assertEqual(self.rollup(), [])
+
+        appointment.status = "completed"
+        appointment.save()
+        self.assertEqual(len(self.rollup()), 1)
+
+        payment.delete()
+        self.assertEqual(self.rollup(), [])
+
+    def test_doctor_change_moves_revenue(self):
+        other = Doctor.objects.create(
+            user=UserProfile.objects.create(username="other", role="doctor"),
+            department=self.department, specialization="-", cabinet="102",
+            bonus_percent=20,
+        )
+        appointment = self.make_appointment()
+        self.pay(appointment)
+
+        appointment.refresh_from_db()
+        appointment.doctor = other
+        appointment.save()
+
+        self.assertEqual(self.rollup(), [
+            (other.pk, "cash", 1, Decimal("1000"), Decimal("200")),
+        ])
+
+    def test_rebuild_matches_incremental(self):
+        self.pay(self.make_appointment())
+        self.pay(self.make_appointment(), amount="700", method="card")
+        expected = self.rollup()
+
+        DailyRevenue.objects.update(amount_sum=0)
+        call_command("rebuild_daily_revenue", stdout=io.StringIO())
+
+        self.assertEqual(self.rollup(), expected)
+
+    def test_bonus_percent_change_matches_rebuild(self):
+        self.pay(self.make_appointment())
+        self.pay(self.make_appointment(), amount="410", method="card")
+
+        # прежний процент, UPDATE врача, UPDATE его строк итогов — оплаты не читаются
+        self.doctor.bonus_percent = 25
+        with self.assertNumQueries(3):
+            self.doctor.save()
+        self.assertEqual(self.rollup(), [
+            (self.doctor.pk, "card", 1, Decimal("410"), Decimal("102.5")),
+            (self.doctor.pk, "cash", 1, Decimal("1000"), Decimal("250")),
+        ])
+
+        self.login(self.admin)
+        path = f"/admin_role/reports/doctors-close/?doctor={self.doctor.pk}&period=day"
+        incremental = (self.rollup(), self.client.get(path).data)
+
+        rollup.rebuild()
+        caches["reports"].clear()
+        self.assertEqual((self.rollup(), self.client.get(path).data), incremental)
+
+    def test_doctor_close_report_reads_rollup(self):
+        self.pay(self.make_appointment())
+        self.pay(self.make_appointment(), amount="250", method="card")
+
+        self.login(self.admin)
+        with self.assertNumQueries(1):
+            data = self.client.get(
+                f"/admin_role/reports/doctors-close/?doctor={self.doctor.pk}&period=day"
+            ).data
+        self.assertEqual(data["total_sum"], Decimal("1250"))
+        self.assertEqual(len(data["results"]), 1)
+
+
+class PatientVisitStatsTests(CRMTestCase):
+    def stats(self):
+        self.login(self.admin)
+        return self.client.get(
+            f"/admin_role/patients/{self.patient.pk}/appointments/"
+        ).data["stats"]
+
+    def test_counters_follow_appointments(self):
+        first = self.make_appointment()
+        second = self.make_appointment()
+        self.make_appointment(status="cancelled")
+
+        second.status = "completed"
+        second.save()
+        first.delete()
+
+        self.assertEqual(
+            self.stats(),
+            {"total": 2, "queue": 0, "completed": 1, "cancelled": 1},
+        )
+        row = PatientVisitStats.objects.get(patient=self.patient)
+        self.assertEqual(row.first_appointment_at, second.created_at)
+
+    def test_moving_appointment_to_another_patient(self):
+        other = Patient.objects.create(full_name="Другой", gender="female")
+        appointment = self.make_appointment()
+
+        appointment.patient = other
+        appointment.save()
+
+        self.assertEqual(self.stats()["total"], 0)
+        self.assertEqual(other.visit_stats.total_count, 1)
+
+    def test_stats_block_is_one_query(self):
+        self.make_appointment(status="completed")
+        self.login(self.admin)
+        with self.assertNumQueries(1):
+            counters.patient_stats(self.patient.pk)
+
+        data = self.client.get(
+            f"/admin_role/patients/{self.patient.pk}/visits/"
+        ).data
+        self.assertEqual(data["stats"]["total"], 1)
+
+    def test_repair_command(self):
+        self.make_appointment()
+        self.make_appointment(status="completed")
+        PatientVisitStats.objects.update(total_count=0, completed_count=5)
+        Appointment.objects.bulk_create([
+            Appointment(
+                patient=Patient.objects.create(full_name="Импорт", gender="male"),
+                doctor=self.doctor, department=self.department,
+                service=self.service,
+                start_time=timezone.now(), end_time=timezone.now(),
+            )
+        ])
+
+        out = io.StringIO()
+        call_command("repair_patient_stats", stdout=out)
+
+        self.assertIn("2", out.getvalue())
+        self.assertEqual(
+            self.stats(),
+            {"total": 2, "queue": 1, "completed": 1, "cancelled": 0},
+        )
+        self.assertEqual(
+            PatientVisitStats.objects.get(patient__full_name="Импорт").queue_count, 1
+        )
+
+
+class AnalyticsTests(CRMTestCase):
+    def _created(self, appointment, days_ago):
+        Appointment.objects.filter(pk=appointment.pk).update(
+            created_at=timezone.now() - timedelta(days=days_ago)
+        )
+        # update() мимо сигналов — счётчики пациента пересчитываем сами
+        counters.recount(appointment.patient_id)
+
+    def test_primary_and_repeat_within_window(self):
+        old_patient = Patient.objects.create(full_name="Старый", gender="male")
+        self._created(self.make_appointment(patient=old_patient), days_ago=100)
+        self.make_appointment(patient=old_patient)
+        self.make_appointment(status="cancelled")
+        self.make_appointment()
+
+        # пациент только из прошлого не влияет на окно
+        Patient.objects.bulk_create([
+            Patient(full_name=f"Архив {i}", gender="female") for i in range(50)
+        ])
+
+        self.login(self.admin)
+        data = self.client.get("/admin_role/analytics/?period=week").data
+
+        self.assertEqual(data["total_patients"], 2)
+        self.assertEqual(data["primary_percent"], 50)
+        self.assertEqual(data["repeat_percent"], 50)
+        self.assertEqual(sum(day["total"] for day in data["chart"]), 3)
+        self.assertEqual(sum(day["cancelled"] for day in data["chart"]), 1)
+
+    def test_query_count_does_not_grow_with_days(self):
+        for days_ago in range(10):
+            self._created(self.make_appointment(status="cancelled"), days_ago)
+
+        self.login(self.admin)
+        with self.assertNumQueries(3):
+            data = self.client.get("/admin_role/analytics/?period=month").data
+        self.assertGreaterEqual(len(data["chart"]), 9)
+
+
+class AppointmentOverlapTests(CRMTestCase):
+    def setUp(self):
+        super().setUp()
+        self.start = timezone.now().replace(microsecond=0) + timedelta(days=1)
+        self.booked = self.make_appointment(start=self.start, minutes=60)
+        self.login(self.receptionist)
+
+    def book(self, offset, minutes=30, doctor=None):
+        start = self.start + timedelta(minutes=offset)
+        doctor = doctor or self.doctor
+        return self.client.post("/receptionist_role/calendar/create/", {
+            "patient": self.patient.pk, "doctor": doctor.pk,
+            "department": doctor.department_id, "service": self.service.pk,
+            "start_time": start, "end_time": start + timedelta(minutes=minutes),
+            "status": "queue",
+        }, format="json")
+
+    def other_doctor(self, cabinet):
+        user = UserProfile.objects.create(username=f"doc{cabinet}@crm.kg", role="doctor")
+        return Doctor.objects.create(
+            user=user, department=self.department, specialization="-", cabinet=cabinet,
+        )
+
+    def test_doctor_overlap_rejected(self):
+        response = self.book(30)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["conflicts"], [str(self.booked.pk)])
+        self.assertIn("Врач", str(response.data["start_time"]))
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_adjacent_and_cancelled_do_not_conflict(self):
+        # интервалы полуоткрытые: конец одного — начало другого
+        self.assertEqual(self.book(60).status_code, 201)
+        self.assertEqual(self.book(-30).status_code, 201)
+
+        self.booked.status = "cancelled"
+        self.booked.save()
+        self.assertEqual(self.book(15).status_code, 201)
+
+    def test_cabinet_shared_by_other_doctor(self):
+        self.assertEqual(self.book(0, doctor=self.other_doctor("102")).status_code, 201)
+
+        response = self.book(0, doctor=self.other_doctor("101"))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Кабинет 101", str(response.data["start_time"]))
+
+    def test_edit_checks_new_slot_only(self):
+        other = self.make_appointment(start=self.start + timedelta(hours=2))
+        url = f"/receptionist_role/appointments/{other.pk}/edit/"
+
+        response = self.client.patch(url, {"start_time": self.start}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+        # слот не меняется — старые пересечения смену статуса не блокируют;
+        # свой врач в БД пересечься не может (appt_doctor_no_overlap), поэтому
+        # пересечение по кабинету: врач того же кабинета 101
+        Appointment.objects.filter(pk=other.pk).update(
+            doctor=self.other_doctor("101"),
+            start_time=self.start, end_time=self.start + timedelta(minutes=30),
+        )
+        response = self.client.patch(url, {"status": "confirmed"}, format="json")
+        self.assertEqual(response.status_code, 200)
+
+        # отменённую нельзя вернуть в занятый слот
+        Appointment.objects.filter(pk=other.pk).update(status="cancelled")
+        response = self.client.patch(url, {"status": "queue"}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_appointment_longer_than_limit_rejected(self):
+        response = self.book(24 * 60, minutes=13 * 60)
+        self.assertEqual(response.status_code, 400)
+
+    def test_doctor_from_other_department_rejected(self):
+        # full_clean при сохранении больше нет — проверяет сериализатор
+        other = Department.objects.create(name="Хирургия")
+        doctor = self.other_doctor("300")
+        Doctor.objects.filter(pk=doctor.pk).update(department=other)
+        doctor.refresh_from_db()
+
+        response = self.client.post("/receptionist_role/calendar/create/", {
+            "patient": self.patient.pk, "doctor": doctor.pk,
+            "department": self.department.pk, "service": self.service.pk,
+            "start_time": self.start + timedelta(hours=3),
+            "end_time": self.start + timedelta(hours=4), "status": "queue",
+        }, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("отделению", str(response.data))
+        self.assertEqual(Appointment.objects.count(), 1)
+
+
+class FreeSlotTests(CRMTestCase):
+    def setUp(self):
+        super().setUp()
+        today = timezone.localdate()
+        # следующий понедельник
+        self.monday = today + timedelta(days=7 - today.weekday())
+        DoctorWorkingHours.objects.create(
+            doctor=self.doctor, weekday=0, start_time="09:00", end_time="12:00",
+        )
+        self.login(self.receptionist)
+
+    def at(self, hour, minute=0):
+        return timezone.make_aware(
+            timezone.datetime.combine(self.monday, timezone.datetime.min.time())
+        ).replace(hour=hour, minute=minute)
+
+    def get_slots(self, **params):
+        params.setdefault("department", self.department.pk)
+        params.setdefault("date_from", self.monday.isoformat())
+        params.setdefault("date_to", self.monday.isoformat())
+        return self.client.get("/receptionist_role/free-slots/", params)
+
+    def test_interval_helpers(self):
+        self.assertEqual(
+            scheduling.merge_intervals([(5, 7), (1, 3), (2, 4), (4, 5), (9, 10)]),
+            [(1, 7), (9, 10)],
+        )
+        self.assertEqual(
+            scheduling.subtract_intervals([(0, 10), (20, 30)], [(2, 4), (8, 22), (25, 26)]),
+            [(0, 2), (4, 8), (22, 25), (26, 30)],
+        )
+
+    def test_working_hours_minus_doctor_and_cabinet_appointments(self):
+        self.make_appointment(start=self.at(10))
+        self.make_appointment(start=self.at(9, 30), status="cancelled")
+        neighbour = Doctor.objects.create(
+            user=UserProfile.objects.create(username="n@crm.kg", role="doctor"),
+            department=Department.objects.create(name="Хирургия"),
+            specialization="-", cabinet=self.doctor.cabinet,
+        )
+        Appointment.objects.bulk_create([Appointment(
+            patient=self.patient, doctor=neighbour, department=neighbour.department,
+            service=self.service, start_time=self.at(11, 30), end_time=self.at(12),
+        )])
+
+        with self.assertNumQueries(3):
+            response = self.get_slots()
+
+        self.assertEqual(response.status_code, 200)
+        [doctor] = response.data
+        self.assertEqual(doctor["doctor"], self.doctor.pk)
+        self.assertEqual(
+            [slot["start_time"] for slot in doctor["slots"]],
+            [self.at(9), self.at(9, 30), self.at(10, 30), self.at(11)],
+        )
+
+    def test_default_hours_and_duration(self):
+        DoctorWorkingHours.objects.all().delete()
+        slots = self.get_slots(service=self.service.pk, duration=60).data[0]["slots"]
+        self.assertEqual((slots[0]["start_time"], slots[-1]["end_time"]), (self.at(9), self.at(18)))
+        self.assertEqual(len(slots), 9)
+
+    def test_validation(self):
+        self.assertEqual(self.get_slots(department="").status_code, 400)
+        self.assertEqual(
+            self.get_slots(date_to=(self.monday + timedelta(days=31)).isoformat()).status_code,
+            400,
+        )
+        self.assertEqual(
+            self.get_slots(date_to=(self.monday - timedelta(days=1)).isoformat()).status_code,
+            400,
+        )
+
+
+class CalendarWindowTests(CRMTestCase):
+    def setUp(self):
+        super().setUp()
+        self.today = timezone.localdate()
+
+    def at(self, day, hour, minute=0):
+        return timezone.make_aware(
+            timezone.datetime.combine(day, timezone.datetime.min.time())
+        ).replace(hour=hour, minute=minute)
+
+    def ids(self, response):
+        self.assertEqual(response.status_code, 200, response.data)
+        return [row["id"] for row in response.data["results"]]
+
+    def test_default_window_is_bounded(self):
+        current = self.make_appointment(start=self.at(self.today, 12))
+        self.make_appointment(start=self.at(self.today - timedelta(days=400), 12))
+        self.make_appointment(start=self.at(self.today + timedelta(days=30), 12))
+
+        self.login(self.admin)
+        self.assertEqual(self.ids(self.client.get("/admin_role/calendar/")), [current.pk])
+        self.login(self.doctor_user)
+        self.assertEqual(self.ids(self.client.get("/doctor_role/calendar/")), [current.pk])
+
+    def test_half_open_local_day_bounds(self):
+        day = self.today + timedelta(days=3)
+        late = self.make_appointment(start=self.at(day, 23, 30))
+        early = self.make_appointment(start=self.at(day, 0))
+        self.make_appointment(start=self.at(day + timedelta(days=1), 0))
+
+        self.login(self.receptionist)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                f"/receptionist_role/calendar/?start={day}&end={day}"
+            )
+        self.assertEqual(self.ids(response), [early.pk, late.pk])
+        # без приведения start_time к дате в SQL — иначе индекс не работает
+        self.assertNotIn("cast_date", queries[-1]["sql"])
+
+    def test_window_validation(self):
+        self.login(self.admin)
+        too_long = self.today + timedelta(days=62)
+        self.assertEqual(
+            self.client.get(f"/admin_role/calendar/?start={self.today}&end={too_long}").status_code,
+            400,
+        )
+        self.assertEqual(
+            self.client.get(
+                f"/admin_role/calendar/?start={self.today}&end={self.today - timedelta(days=1)}"
+            ).status_code,
+            400,
+        )
+        self.assertEqual(self.client.get("/admin_role/calendar/?start=2024-13-01").status_code, 400)
+
+
+class BulkAppointmentTests(CRMTestCase):
+    def setUp(self):
+        super().setUp()
+        today = timezone.localdate()
+        self.monday = timezone.make_aware(
+            timezone.datetime.combine(today + timedelta(days=7 - today.weekday()),
+                                      timezone.datetime.min.time())
+        ).replace(hour=10)
+        self.login(self.receptionist)
+
+    def post(self, **payload):
+        data = {
+            "patient": self.patient.pk, "doctor": self.doctor.pk,
+            "department": self.department.pk, "service": self.service.pk,
+        }
+        data.update(payload)
+        return self.client.post("/receptionist_role/calendar/bulk/", data, format="json")
+
+    def test_recurrence_skips_busy_slots(self):
+        busy = self.make_appointment(start=self.monday + timedelta(weeks=2))
+
+        response = self.post(recurrence={
+            "start_time": self.monday, "duration": 45, "count": 4,
+        })
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data["created"]), 3)
+        [rejected] = response.data["rejected"]
+        self.assertEqual(rejected["start_time"], self.monday + timedelta(weeks=2))
+        self.assertIn("Врач", rejected["reason"])
+
+        created = Appointment.objects.filter(pk__in=response.data["created"])
+        self.assertEqual(
+            sorted(created.values_list("start_time", flat=True)),
+            [self.monday + timedelta(weeks=week) for week in (0, 1, 3)],
+        )
+        self.assertTrue(all(a.registrar_id == self.receptionist.pk for a in created))
+        self.assertEqual(
+            {a.end_time - a.start_time for a in created}, {timedelta(minutes=45)}
+        )
+
+        # мимо сигналов, но счётчики пациента сходятся
+        self.assertEqual(counters.patient_stats(self.patient.pk)["total"], 4)
+        self.assertEqual(busy.patient.visit_stats.queue_count, 4)
+
+    def test_daily_weekdays_and_slot_list(self):
+        response = self.post(recurrence={
+            "start_time": self.monday, "duration": 30, "count": 5,
+            "frequency": "daily", "weekdays": [0, 2, 4],
+        })
+        self.assertEqual(response.status_code, 201)
+        days = Appointment.objects.filter(
+            pk__in=response.data["created"]
+        ).values_list("start_time", flat=True)
+        self.assertEqual(
+            sorted(timezone.localtime(day).weekday() for day in days), [0, 0, 2, 2, 4]
+        )
+
+        # слоты списком: второй пересекается с первым, третий — с серией выше
+        start = self.monday + timedelta(days=1)
+        response = self.post(slots=[
+            {"start_time": start, "end_time": start + timedelta(minutes=30)},
+            {"start_time": start + timedelta(minutes=15), "end_time": start + timedelta(minutes=45)},
+            {"start_time": self.monday, "end_time": self.monday + timedelta(minutes=30)},
+        ])
+        self.assertEqual(len(response.data["created"]), 1)
+        self.assertEqual(
+            [slot["reason"] for slot in response.data["rejected"]],
+            ["Врач уже занят в это время", "Пересекается с другим слотом серии"],
+        )
+
+    def test_query_count_does_not_grow_with_series(self):
+        # строка счётчиков пациента уже есть — дальше только UPDATE
+        self.make_appointment(start=self.monday - timedelta(days=1))
+        with CaptureQueriesContext(connection) as small:
+            self.post(recurrence={"start_time": self.monday, "duration": 30, "count": 2})
+        with CaptureQueriesContext(connection) as large:
+            self.post(recurrence={
+                "start_time": self.monday + timedelta(hours=1), "duration": 30, "count": 50,
+            })
+        self.assertEqual(len(large), len(small))
+        self.assertEqual(Appointment.objects.count(), 53)
+
+    def test_all_rejected_and_invalid(self):
+        self.make_appointment(start=self.monday)
+        response = self.post(slots=[
+            {"start_time": self.monday, "end_time": self.monday + timedelta(minutes=30)},
+        ])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data["created"], [])
+
+        self.assertEqual(self.post().status_code, 400)
+        self.assertEqual(
+            self.post(recurrence={"start_time": self.monday, "duration": 30, "count": 101}).status_code,
+            400,
+        )
+
+    def test_recurrence_weekdays_only_for_daily_and_full_count(self):
+        response = self.post(recurrence={
+            "start_time": self.monday, "duration": 30, "count": 3,
+            "frequency": "weekly", "weekdays": [0, 2],
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("weekdays", response.data["recurrence"])
+
+        # каждые 7 дней от понедельника — среда не наступит никогда
+        response = self.post(recurrence={
+            "start_time": self.monday, "duration": 30, "count": 3,
+            "frequency": "daily", "interval": 7, "weekdays": [2],
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("count", response.data["recurrence"])
+        self.assertFalse(Appointment.objects.filter(start_time__gte=self.monday).exists())
+
+
+class CalendarSyncTests(CRMTestCase):
+    def sync(self, url, token=None):
+        params = {} if token is None else {"token": token}
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, getattr(response, "data", None))
+        return response.data
+
+    def test_changes_and_tombstones_since_token(self):
+        self.login(self.receptionist)
+        kept = self.make_appointment()
+        token = self.sync("/receptionist_role/calendar/sync/")["sync_token"]
+
+        moved = self.make_appointment()
+        moved.status = "confirmed"
+        moved.save()
+        gone = self.make_appointment()
+        gone_pk = gone.pk
+        gone.delete()
+
+        data = self.sync("/receptionist_role/calendar/sync/", token)
+        self.assertEqual([row["id"] for row in data["changed"]], [moved.pk])
+        self.assertEqual(data["changed"][0]["status"], "confirmed")
+        self.assertEqual(data["deleted"], [gone_pk])
+        self.assertFalse(data["has_more"])
+
+        again = self.sync("/receptionist_role/calendar/sync/", data["sync_token"])
+        self.assertEqual((again["changed"], again["deleted"]), ([], []))
+        self.assertEqual(again["sync_token"], data["sync_token"])
+        self.assertNotIn(kept.pk, [row["id"] for row in data["changed"]])
+
+    def test_doctor_feed_gets_tombstone_when_appointment_moves(self):
+        other = Doctor.objects.create(
+            user=UserProfile.objects.create(username="other@crm.kg", role="doctor"),
+            department=self.department, specialization="-", cabinet="202",
+        )
+        appointment = self.make_appointment()
+        self.make_appointment(doctor=other, start=timezone.now() + timedelta(days=1))
+
+        self.login(self.doctor_user)
+        data = self.sync("/doctor_role/calendar/sync/", 0)
+        self.assertEqual([row["id"] for row in data["changed"]], [appointment.pk])
+
+        appointment.doctor = other
+        appointment.start_time += timedelta(days=2)
+        appointment.end_time += timedelta(days=2)
+        appointment.save()
+
+        data = self.sync("/doctor_role/calendar/sync/", data["sync_token"])
+        self.assertEqual((data["changed"], data["deleted"]), ([], [appointment.pk]))
+
+    def test_lower_id_committed_late_is_not_skipped(self):
+        self.login(self.admin)
+        token = self.sync("/admin_role/calendar/sync/")["sync_token"]
+        slow = self.make_appointment()
+        fast = self.make_appointment(start=timezone.now() + timedelta(days=2))
+
+        # транзакция slow ещё не закоммичена: её строки журнала не видно
+        late = AppointmentChange.objects.get(appointment_id=slow.pk).pk
+        AppointmentChange.objects.filter(pk=late).delete()
+        data = self.sync("/admin_role/calendar/sync/", token)
+        self.assertEqual([row["id"] for row in data["changed"]], [fast.pk])
+        self.assertEqual(data["sync_token"], f"{late + 1}:{late}")
+
+        AppointmentChange.objects.create(
+            id=late, appointment_id=slow.pk, doctor_id=slow.doctor_id,
+        )
+        data = self.sync("/admin_role/calendar/sync/", data["sync_token"])
+        self.assertEqual([row["id"] for row in data["changed"]], [slow.pk])
+        self.assertEqual(data["sync_token"], str(late + 1))
+
+        # пропуск старше окна — откат, токен его больше не держит
+        with mock.patch.object(calendar_sync, "GAP_WINDOW", 1):
+            self.assertEqual(
+                self.sync("/admin_role/calendar/sync/", f"{late + 1}:{late - 1}")["sync_token"],
+                str(late + 1),
+            )
+
+    def test_batches_bulk_and_expired_token(self):
+        today = timezone.localdate()
+        start = timezone.make_aware(
+            timezone.datetime.combine(today + timedelta(days=1), timezone.datetime.min.time())
+        )
+        scheduling.book_many(
+            self.patient, self.doctor, self.department, self.service,
+            [(start + timedelta(hours=i), start + timedelta(hours=i, minutes=30)) for i in range(3)],
+        )
+
+        self.login(self.admin)
+        with mock.patch.object(calendar_sync, "SYNC_BATCH", 2):
+            first = self.sync("/admin_role/calendar/sync/", 0)
+            second = self.sync("/admin_role/calendar/sync/", first["sync_token"])
+        self.assertTrue(first["has_more"])
+        self.assertEqual(len(first["changed"]) + len(second["changed"]), 3)
+        self.assertFalse(second["has_more"])
+
+        call_command("prune_appointment_changes", keep_days=-1, stdout=io.StringIO())
+        self.make_appointment()
+        self.assertEqual(
+            self.client.get("/admin_role/calendar/sync/", {"token": first["sync_token"]}).status_code,
+            410,
+        )
+        self.assertEqual(
+            self.client.get("/admin_role/calendar/sync/", {"token": "abc"}).status_code, 400
+        )
+
+    def test_token_below_pruned_watermark_expires(self):
+        self.make_appointment()
+        self.login(self.admin)
+        token = self.sync("/admin_role/calendar/sync/", 0)["sync_token"]
+        self.assertEqual(token, str(AppointmentChange.objects.latest("id").pk))
+
+        # журнал очищен целиком: токен 0 — 410, последний токен ещё годен
+        call_command("prune_appointment_changes", keep_days=-1, stdout=io.StringIO())
+        self.assertFalse(AppointmentChange.objects.exists())
+        response = self.client.get("/admin_role/calendar/sync/", {"token": 0})
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(self.sync("/admin_role/calendar/sync/", token)["sync_token"], token)
+        self.assertEqual(self.sync("/admin_role/calendar/sync/")["sync_token"], token)
+
+
+class PushEventTests(CRMTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(push, "_broker", push.LocalBroker())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.other = Doctor.objects.create(
+            user=UserProfile.objects.create(username="other@crm.kg", role="doctor"),
+            department=self.department, specialization="-", cabinet="202",
+        )
+
+    def subscribe(self, *channels):
+        return push.get_broker().subscribe(channels)
+
+    def types(self, subscription):
+        events, overflowed = subscription.drain()
+        self.assertFalse(overflowed)
+        return [(event["type"], event["id"]) for event in events]
+
+    def test_appointment_events_scoped_by_doctor(self):
+        calendar = self.subscribe(push.CALENDAR)
+        mine = self.subscribe(push.doctor_channel(self.doctor.pk))
+        theirs = self.subscribe(push.doctor_channel(self.other.pk))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment = self.make_appointment()
+        event = mine.drain()[0][0]
+        self.assertEqual(event["status"], "queue")
+        self.assertEqual(
+            event["start_time"], timezone.localtime(appointment.start_time).isoformat()
+        )
+        self.assertNotIn("patient", event)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment.doctor = self.other
+            appointment.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment_pk = appointment.pk
+            appointment.delete()
+
+        self.assertEqual(self.types(calendar), [
+            ("appointment.created", appointment_pk),
+            ("appointment.updated", appointment_pk),
+            ("appointment.deleted", appointment_pk),
+        ])
+        self.assertEqual(self.types(mine), [("appointment.deleted", appointment_pk)])
+        self.assertEqual(self.types(theirs), [
+            ("appointment.updated", appointment_pk),
+            ("appointment.deleted", appointment_pk),
+        ])
+
+    def test_nothing_published_before_commit(self):
+        calendar = self.subscribe(push.CALENDAR)
+        with self.captureOnCommitCallbacks(execute=False):
+            self.make_appointment()
+        self.assertEqual(self.types(calendar), [])
+
+    def test_bulk_booking_and_notifications(self):
+        calendar = self.subscribe(push.CALENDAR)
+        inbox = self.subscribe(push.user_channel(self.doctor_user.pk))
+        start = timezone.now() + timedelta(days=1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            result = scheduling.book_many(
+                self.patient, self.doctor, self.department, self.service,
+                [(start + timedelta(hours=i), start + timedelta(hours=i, minutes=30)) for i in range(3)],
+            )
+            notification = Notification.objects.create(
+                recipient=self.doctor_user, title="Новая запись", message="-",
+            )
+
+        self.assertEqual(
+            self.types(calendar), [("appointment.created", pk) for pk in result["created"]]
+        )
+        self.assertEqual(self.types(inbox), [("notification.created", notification.pk)])
+
+    def test_overflow_replaced_by_resync(self):
+        subscription = push.get_broker().subscribe([push.CALENDAR], limit=2)
+        for i in range(3):
+            push.get_broker().publish(push.CALENDAR, {"type": "x", "id": i})
+        self.assertEqual(subscription.drain(), ([], True))
+        self.assertEqual(subscription.drain(), ([], False))
+
+    def test_stream_auth_and_role(self):
+        self.assertEqual(self.client.get("/doctor_role/events/").status_code, 401)
+        self.assertEqual(
+            self.client.get("/doctor_role/events/", {"token": "bad"}).status_code, 401
+        )
+        token = str(AccessToken.for_user(self.admin))
+        self.assertEqual(
+            self.client.get("/doctor_role/events/", {"token": token}).status_code, 403
+        )
+        response = self.client.get(
+            "/admin_role/events/", HTTP_AUTHORIZATION=f"Bearer {token}"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        response.close()
+
+    async def test_stream_over_asgi(self):
+        token = await sync_to_async(lambda: str(AccessToken.for_user(self.doctor_user)))()
+        response = await AsyncClient().get("/doctor_role/events/", {"token": token})
+        self.assertEqual(response.status_code, 200)
+        body = aiter(response.streaming_content)
+        self.assertEqual(await anext(body), f"retry: {push.RETRY_MS}\n\n".encode())
+
+        push.get_broker().publish(
+            push.doctor_channel(self.doctor.pk), {"type": "appointment.deleted", "id": 1}
+        )
+        self.assertIn(b'"appointment.deleted"', await anext(body))
+        await body.aclose()
+
+
+class NotificationOutboxTests(CRMTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other_user = UserProfile.objects.create(username="other@crm.kg", role="doctor")
+        self.other = Doctor.objects.create(
+            user=self.other_user, department=self.department,
+            specialization="-", cabinet="202",
+        )
+        self.start = timezone.now() + timedelta(days=2)
+
+    def inbox(self, user):
+        return list(
+            Notification.objects.filter(recipient=user)
+            .order_by("id").values_list("title", "message")
+        )
+
+    def test_booking_writes_outbox_only(self):
+        self.login(self.receptionist)
+        response = self.client.post("/receptionist_role/calendar/create/", {
+            "patient": self.patient.pk, "doctor": self.doctor.pk,
+            "department": self.department.pk, "service": self.service.pk,
+            "start_time": self.start, "end_time": self.start + timedelta(minutes=30),
+            "status": "queue",
+        }, format="json")
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(
+            list(NotificationOutbox.objects.values_list("kind", "doctor_id")),
+            [("booked", self.doctor.pk)],
+        )
+        self.assertEqual(self.inbox(self.doctor_user), [])
+
+        self.assertEqual(notifications.process_pending(), 1)
+        [(title, message)] = self.inbox(self.doctor_user)
+        self.assertEqual(title, "Новая запись")
+        self.assertIn(self.patient.full_name, message)
+        self.assertFalse(NotificationOutbox.objects.exists())
+
+    def test_reschedule_cancel_and_status_changes(self):
+        appointment = self.make_appointment(start=self.start)
+        notifications.process_pending()
+
+        appointment.status = "confirmed"
+        appointment.save()
+        self.assertFalse(NotificationOutbox.objects.exists())
+
+        appointment.start_time += timedelta(hours=1)
+        appointment.end_time += timedelta(hours=1)
+        appointment.save()
+        appointment.doctor = self.other
+        appointment.save()
+        appointment.status = "cancelled"
+        appointment.save()
+        appointment.save()
+
+        self.assertEqual(notifications.process_pending(), 3)
+        self.assertEqual(
+            [title for title, _ in self.inbox(self.doctor_user)],
+            ["Новая запись", "Запись перенесена", "Запись передана другому врачу"],
+        )
+        self.assertIn("→", self.inbox(self.doctor_user)[1][1])
+        self.assertEqual(
+            [title for title, _ in self.inbox(self.other_user)],
+            ["Новая запись", "Запись отменена"],
+        )
+
+    def test_fan_out_is_batched(self):
+        result = scheduling.book_many(
+            self.patient, self.doctor, self.department, self.service,
+            [(self.start + timedelta(hours=i), self.start + timedelta(hours=i, minutes=30))
+             for i in range(20)],
+        )
+        self.assertEqual(NotificationOutbox.objects.count(), 20)
+
+        # выборка outbox, врачи, bulk_create, счётчик непрочитанных
+        # (INSERT + UPDATE), удаление + savepoint
+        with self.assertNumQueries(8):
+            self.assertEqual(notifications.process_pending(), 20)
+        self.assertEqual(
+            sorted(Notification.objects.values_list("appointment_id", flat=True)),
+            sorted(result["created"]),
+        )
+
+    def test_worker_command(self):
+        for i in range(3):
+            self.make_appointment(start=self.start + timedelta(hours=i))
+        out = io.StringIO()
+        call_command("run_notification_outbox", "--once", "--batch-size", "2", stdout=out)
+        self.assertEqual(len(self.inbox(self.doctor_user)), 3)
+        self.assertFalse(NotificationOutbox.objects.exists())
+
+    def test_deleted_appointment_drops_pending_event(self):
+        self.make_appointment(start=self.start).delete()
+        self.assertEqual(notifications.process_pending(), 0)
+
+
+class UnreadNotificationCountTests(CRMTestCase):
+    def setUp(self):
+        super().setUp()
+        self.login(self.doctor_user)
+
+    def notify(self, count=1, **kwargs):
+        return [
+            Notification.objects.create(
+                recipient=self.doctor_user, title="t", message="m", **kwargs
+            )
+            for _ in range(count)
+        ]
+
+    def unread(self):
+        response = self.client.get("/doctor_role/notifications/unread-count/")
+        self.assertEqual(response.status_code, 200)
+        return response.data["unread_count"]
+
+    def test_counter_follows_inserts_reads_and_deletes(self):
+        first, second, third = self.notify(3)
+        self.notify(is_read=True)
+        self.assertEqual(self.unread(), 3)
+
+        response = self.client.post(f"/doctor_role/notifications/{first.pk}/read/")
+        self.assertEqual(response.status_code, 200)
+        # повторное прочтение счётчик не трогает
+        self.client.post(f"/doctor_role/notifications/{first.pk}/read/")
+        self.assertEqual(self.unread(), 2)
+
+        second.is_read = True
+        second.save()
+        third.delete()
+        self.assertEqual(self.unread(), 0)
+
+        self.assertEqual(
+            self.client.post("/doctor_role/notifications/999999/read/").status_code, 404
+        )
+
+    def test_unread_count_is_one_query(self):
+        self.notify(2)
+        self.client.get("/doctor_role/notifications/unread-count/")
+        with self.assertNumQueries(1):
+            self.assertEqual(self.unread(), 2)
+
+    def test_bulk_mark_read_by_ids_and_before(self):
+        notes = self.notify(5)
+        Notification.objects.filter(pk=notes[4].pk).update(
+            created_at=timezone.now() + timedelta(hours=1)
+        )
+        other = Notification.objects.create(
+            recipient=self.admin, title="t", message="m",
+        )
+
+        response = self.client.post("/doctor_role/notifications/read/", {
+            "ids": [notes[0].pk, notes[1].pk, other.pk],
+        }, format="json")
+        self.assertEqual(response.data, {"updated": 2, "unread_count": 3})
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post("/doctor_role/notifications/read/", {
+                "before": timezone.now(),
+            }, format="json")
+        self.assertEqual(response.data, {"updated": 2, "unread_count": 1})
+        updates = [q["sql"] for q in queries if q["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 2)
+        self.assertFalse(Notification.objects.get(pk=other.pk).is_read)
+
+        response = self.client.post("/doctor_role/notifications/read/", {}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_outbox_fan_out_and_reconcile(self):
+        self.make_appointment(start=timezone.now() + timedelta(days=1))
+        self.make_appointment(start=timezone.now() + timedelta(days=2))
+        notifications.process_pending()
+        self.assertEqual(self.unread(), 2)
+
+        UnreadNotificationCount.objects.filter(recipient=self.doctor_user).update(unread=40)
+        UnreadNotificationCount.objects.create(recipient=self.admin, unread=3)
+        out = io.StringIO()
+        call_command("repair_unread_counts", stdout=out)
+        self.assertIn("2", out.getvalue())
+        self.assertEqual(self.unread(), 2)
+        self.assertEqual(notifications.unread_count(self.admin.pk), 0)
+
+
+class NotificationRetentionTests(CRMTestCase):
+    def setUp(self):
+        super().setUp()
+        self.login(self.doctor_user)
+
+    def notify(self, days_ago, is_read, recipient=None):
+        notification = Notification.objects.create(
+            recipient=recipient or self.doctor_user, title=f"{days_ago}", message="-",
+            is_read=is_read,
+        )
+        Notification.objects.filter(pk=notification.pk).update(
+            created_at=timezone.now() - timedelta(days=days_ago)
+        )
+        return notification.pk
+
+    def listed(self, params=None):
+        response = self.client.get("/doctor_role/notifications/", params or {})
+        self.assertEqual(response.status_code, 200)
+        return [row["id"] for row in response.data["results"]], response.data["unread_count"]
+
+    def test_list_reads_hot_window(self):
+        fresh = self.notify(1, True)
+        self.notify(90, True)
+        self.assertEqual(self.listed(), ([fresh], 0))
+
+        old_unread = self.notify(60, False)
+        self.assertEqual(self.listed(), ([fresh, old_unread], 1))
+
+        since = (timezone.localdate() - timedelta(days=100)).isoformat()
+        self.assertEqual(len(self.listed({"since": since})[0]), 3)
+        self.assertEqual(
+            self.client.get("/doctor_role/notifications/", {"since": "x"}).status_code, 400
+        )
+
+    def test_prune_deletes_old_read_in_batches(self):
+        old_read = [self.notify(200 + i, True) for i in range(5)]
+        old_unread = self.notify(300, False)
+        recent = self.notify(10, True)
+
+        with CaptureQueriesContext(connection) as queries:
+            removed = notifications.prune(
+                timezone.now() - notifications.RETENTION, batch_size=2
+            )
+        self.assertEqual(removed, 5)
+        deletes = [q["sql"] for q in queries if q["sql"].startswith("DELETE")]
+        self.assertEqual(len(deletes), 3)
+        self.assertEqual(
+            set(Notification.objects.values_list("pk", flat=True)), {old_unread, recent}
+        )
+        self.assertFalse(NotificationArchive.objects.filter(pk__in=old_read).exists())
+        self.assertEqual(notifications.unread_count(self.doctor_user.pk), 1)
+
+        # непрочитанное, попавшее в пачку (снова сделали непрочитанным), не удаляется
+        self.assertEqual(notifications._delete_read([old_unread]), 0)
+        self.assertTrue(Notification.objects.filter(pk=old_unread).exists())
+
+    def test_command_archives(self):
+        old = self.notify(400, True)
+        self.notify(400, False)
+        out = io.StringIO()
+        call_command("prune_notifications", "--archive", "--keep-days", "365", stdout=out)
+        self.assertIn("1", out.getvalue())
+
+        archived = NotificationArchive.objects.get()
+        self.assertEqual(archived.pk, old)
+        self.assertEqual(archived.recipient_id, self.doctor_user.pk)
+        self.assertEqual(archived.title, "400")
+        self.assertFalse(Notification.objects.filter(pk=old).exists())
+
+
+class RecordingEmailBackend(BaseEmailBackend):
+    """Бэкенд для тестов outbox: считает соединения, падает по заказу."""
+    opened = 0
+    sent = []
+    down = False
+    refuse = set()
+    # адреса, на которых сервер один раз рвёт соединение
+    disconnect = set()
+
+    def open(self):
+        if RecordingEmailBackend.down:
+            raise ConnectionRefusedError("SMTP недоступен")
+        RecordingEmailBackend.opened += 1
+        return True
+
+    def send_messages(self, messages):
+        for message in messages:
+            if set(message.to) & RecordingEmailBackend.disconnect:
+                RecordingEmailBackend.disconnect -= set(message.to)
+                raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+            if set(message.to) & RecordingEmailBackend.refuse:
+                raise OSError(f"адрес отклонён: {message.to}")
+            RecordingEmailBackend.sent.append(message)
+        return len(messages)
+
+
+@override_settings(EMAIL_BACKEND="crm_app.tests.RecordingEmailBackend")
+class MailOutboxTests(CRMTestCase):
+    def setUp(self):
+        super().setUp()
+        RecordingEmailBackend.opened = 0
+        RecordingEmailBackend.sent = []
+        RecordingEmailBackend.down = False
+        RecordingEmailBackend.refuse = set()
+        RecordingEmailBackend.disconnect = set()
+
+    def queue(self, *addresses):
+        return [
+            mail_outbox.enqueue("Тема", "Текст", [address], "noreply@example.com")
+            for address in addresses
+        ]
+
+    @override_settings(EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend")
+    def test_reset_request_only_enqueues(self):
+        with self.assertNumQueries(6):
+            response = self.client.post("/password_reset/", {"email": self.doctor_user.email})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mail.outbox, [])
+
+        queued = OutgoingMail.objects.get()
+        self.assertEqual(queued.recipients, [self.doctor_user.email])
+        token = ResetPasswordToken.objects.get(user=self.doctor_user)
+        self.assertIn(token.key, queued.body)
+
+        self.assertEqual(mail_outbox.process_pending(), 1)
+        [sent] = mail.outbox
+        self.assertEqual(sent.subject, "Сброс пароля")
+        self.assertIn(token.key, sent.body)
+        self.assertFalse(OutgoingMail.objects.exists())
+
+    def test_reset_request_does_not_touch_smtp(self):
+        RecordingEmailBackend.down = True
+        response = self.client.post("/password_reset/", {"email": self.doctor_user.email})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(OutgoingMail.objects.count(), 1)
+
+    def test_batch_reuses_one_connection(self):
+        self.queue("a@crm.kg", "b@crm.kg", "c@crm.kg")
+        self.assertEqual(mail_outbox.process_pending(), 3)
+        self.assertEqual(RecordingEmailBackend.opened, 1)
+        self.assertEqual(
+            [message.to for message in RecordingEmailBackend.sent],
+            [["a@crm.kg"], ["b@crm.kg"], ["c@crm.kg"]],
+        )
+
+    def test_disconnect_mid_batch_reopens_connection(self):
+        RecordingEmailBackend.disconnect = {"b@crm.kg"}
+        self.queue("a@crm.kg", "b@crm.kg", "c@crm.kg")
+        self.assertEqual(mail_outbox.process_pending(), 3)
+        self.assertEqual(RecordingEmailBackend.opened, 2)
+        self.assertEqual(len(RecordingEmailBackend.sent), 3)
+        self.assertFalse(OutgoingMail.objects.exists())
+
+    def test_retries_with_backoff_then_fails(self):
+        RecordingEmailBackend.refuse = {"bad@crm.kg"}
+        self.queue("ok@crm.kg", "bad@crm.kg")
+        now = timezone.now()
+
+        mail_outbox.process_pending(now=now)
+        bad = OutgoingMail.objects.get()
+        self.assertEqual((bad.status, bad.attempts), ("queued", 1))
+        self.assertEqual(bad.next_attempt_at, now + mail_outbox.BACKOFF_BASE)
+        self.assertIn("адрес отклонён", bad.last_error)
+        self.assertEqual(len(RecordingEmailBackend.sent), 1)
+
+        # раньше срока повтора письмо не берётся
+        self.assertEqual(mail_outbox.process_pending(now=now), 0)
+
+        delays = []
+        while bad.status == "queued":
+            now = bad.next_attempt_at
+            mail_outbox.process_pending(now=now)
+            bad.refresh_from_db()
+            delays.append(bad.next_attempt_at - now)
+        self.assertEqual(bad.attempts, mail_outbox.MAX_ATTEMPTS)
+        self.assertEqual(bad.status, "failed")
+        self.assertEqual(delays[:3], [timedelta(minutes=1), timedelta(minutes=2), timedelta(minutes=4)])
+
+    def test_server_down_requeues_whole_batch(self):
+        RecordingEmailBackend.down = True
+        self.queue("a@crm.kg", "b@crm.kg")
+        mail_outbox.process_pending()
+        self.assertEqual(
+            list(OutgoingMail.objects.values_list("status", "attempts")),
+            [("queued", 1), ("queued", 1)],
+        )
+
+    def test_stale_sending_requeued(self):
+        [stuck] = self.queue("a@crm.kg")
+        OutgoingMail.objects.filter(pk=stuck.pk).update(
+            status="sending", claimed_at=timezone.now() - timedelta(hours=1),
+        )
+        call_command("run_mail_outbox", "--once", stdout=io.StringIO())
+        self.assertEqual(len(RecordingEmailBackend.sent), 1)
+        self.assertFalse(OutgoingMail.objects.exists())
+
+    def test_stale_sending_requeued_on_next_poll(self):
+        stale = []
+
+        def sleep(seconds):
+            if stale:
+                raise KeyboardInterrupt
+            # письмо упавшего воркера появилось, пока этот ждал
+            [stuck] = self.queue("a@crm.kg")
+            OutgoingMail.objects.filter(pk=stuck.pk).update(
+                status="sending", claimed_at=timezone.now() - timedelta(hours=1),
+            )
+            stale.append(stuck.pk)
+
+        with mock.patch("crm_app.management.commands.run_mail_outbox.time.sleep", sleep):
+            with self.assertRaises(KeyboardInterrupt):
+                call_command("run_mail_outbox", stdout=io.StringIO())
+
+        self.assertEqual(len(RecordingEmailBackend.sent), 1)
+        self.assertFalse(OutgoingMail.objects.exists())
+
+    def test_worker_with_file_backend(self):
+        directory = tempfile.mkdtemp(prefix="crm-test-mail-")
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.queue("a@crm.kg", "b@crm.kg")
+
+        with self.settings(
+            EMAIL_BACKEND="django.core.mail.backends.filebased.EmailBackend",
+            EMAIL_FILE_PATH=directory,
+        ):
+            call_command("run_mail_outbox", "--once", stdout=io.StringIO())
+
+        [name] = os.listdir(directory)
+        with open(os.path.join(directory, name), encoding="utf-8") as output:
+            content = output.read()
+        self.assertIn("a@crm.kg", content)
+        self.assertIn("b@crm.kg", content)
+
+
+class PushStreamTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(push, "_broker", push.LocalBroker())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_stream_heartbeat_and_cross_thread_publish(self):
+        body = push.stream([push.CALENDAR], heartbeat=0.05)
+        self.assertEqual(await anext(body), f"retry: {push.RETRY_MS}\n\n")
+        self.assertEqual(await anext(body), ": ping\n\n")
+
+        # издатель — синхронный код в другом потоке
+        publisher = threading.Timer(
+            0.01, push.get_broker().publish, (push.CALENDAR, {"type": "appointment.deleted", "id": 7}),
+        )
+        publisher.start()
+        chunk = await anext(body)
+        while chunk == ": ping\n\n":
+            chunk = await anext(body)
+        self.assertTrue(chunk.startswith("id: "))
+        self.assertIn('data: {"type": "appointment.deleted", "id": 7}', chunk)
+
+        await body.aclose()
+        self.assertEqual(push.get_broker()._subscriptions, {})
+
+    async def test_stream_ends_after_lifetime(self):
+        chunks = [chunk async for chunk in push.stream([push.CALENDAR], lifetime=0.1, heartbeat=0.05)]
+        self.assertEqual(chunks[0], f"retry: {push.RETRY_MS}\n\n")
+        self.assertEqual(push.get_broker()._subscriptions, {})
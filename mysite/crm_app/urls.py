@@ -28,10 +28,18 @@ urlpatterns = [
     path("admin_role/reports/doctors-close/excel/",AdminDoctorCloseReportExcelAPIView.as_view(),name="admin-doctor-close-report-excel"),
     path("admin_role/reports/summary/",AdminSummaryReportAPIView.as_view(),name="admin-summary-report"),
     path("admin_role/reports/summary/excel/",AdminSummaryReportExcelAPIView.as_view(),name="admin-summary-report-excel"),
+    path("admin_role/reports/cache-stats/",AdminReportCacheStatsAPIView.as_view(),name="admin-report-cache-stats"),
+    path("admin_role/reports/exports/",AdminReportExportCreateAPIView.as_view(),name="admin-report-export-create"),
+    path("admin_role/reports/exports/<int:pk>/",AdminReportExportDetailAPIView.as_view(),name="admin-report-export-detail"),
+    path("admin_role/reports/exports/<int:pk>/download/",AdminReportExportDownloadAPIView.as_view(),name="admin-report-export-download"),
     path("admin_role/calendar/",AdminCalendarListAPIView.as_view(),name="admin-calendar"),
+    path("admin_role/calendar/sync/",AdminCalendarSyncAPIView.as_view(),name="admin-calendar-sync"),
+    path("admin_role/events/",AdminEventStreamView.as_view(),name="admin-events"),
     path("admin_role/calendar/create/",AdminCalendarCreateAPIView.as_view(),name="admin-calendar-create"),
+    path("admin_role/calendar/bulk/",AdminCalendarBulkCreateAPIView.as_view(),name="admin-calendar-bulk"),
     path("admin_role/calendar/<int:pk>/update/",AdminCalendarUpdateAPIView.as_view(),name="admin-calendar-update"),
     path("admin_role/calendar/<int:pk>/delete/",AdminCalendarDeleteAPIView.as_view(),name="admin-calendar-delete"),
+    path("admin_role/free-slots/",AdminFreeSlotsAPIView.as_view(),name="admin-free-slots"),
     path("admin_role/price-list/",AdminPriceListAPIView.as_view(),name="admin-price-list"),
     path("admin_role/services/create/",AdminServiceCreateAPIView.as_view(),name="admin-service-create"),
     path("admin_role/services/<int:pk>/update/",AdminServiceUpdateAPIView.as_view(),name="admin-service-update"),
@@ -55,12 +63,18 @@ urlpatterns = [
     path("receptionist_role/reports/detailed/",ReceptionistDetailedReportAPIView.as_view()),
     path("receptionist_role/reports/summary/",ReceptionistSummaryReportAPIView.as_view()),
     path("receptionist_role/calendar/",ReceptionistCalendarListAPIView.as_view()),
+    path("receptionist_role/calendar/sync/",ReceptionistCalendarSyncAPIView.as_view()),
+    path("receptionist_role/events/",ReceptionistEventStreamView.as_view()),
     path("receptionist_role/calendar/create/",ReceptionistCalendarCreateAPIView.as_view()),
+    path("receptionist_role/calendar/bulk/",ReceptionistCalendarBulkCreateAPIView.as_view()),
     path("receptionist_role/calendar/<int:pk>/update/",ReceptionistCalendarUpdateAPIView.as_view()),
     path("receptionist_role/calendar/<int:pk>/delete/",ReceptionistCalendarDeleteAPIView.as_view()),
+    path("receptionist_role/free-slots/",ReceptionistFreeSlotsAPIView.as_view()),
 # Doctor role
     # Doctor
     path("doctor_role/calendar/", DoctorCalendarAPIView.as_view()),
+    path("doctor_role/calendar/sync/", DoctorCalendarSyncAPIView.as_view()),
+    path("doctor_role/events/", DoctorEventStreamView.as_view()),
     path("doctor_role/appointments/<int:pk>/update/", DoctorAppointmentUpdateAPIView.as_view()),
     path("doctor_role/profile/", DoctorProfileAPIView.as_view()),
     path("doctor_role/patients/<int:pk>/", DoctorPatientDetailAPIView.as_view()),
@@ -69,6 +83,8 @@ urlpatterns = [
 
 # Doctor notifications
     path("doctor_role/notifications/",DoctorNotificationListAPIView.as_view(),name="doctor-notifications"),
+    path("doctor_role/notifications/unread-count/",DoctorNotificationUnreadCountAPIView.as_view(),name="doctor-notifications-unread-count"),
+    path("doctor_role/notifications/read/",DoctorNotificationReadManyAPIView.as_view(),name="doctor-notifications-read-many"),
     path("doctor_role/notifications/<int:pk>/read/",DoctorNotificationReadAPIView.as_view(),name="doctor-notification-read"),
 
 ]
\ No newline at end of file
@@ -6,17 +6,43 @@ from rest_framework.views import APIView
 from .serializers import *
 from .permissions import *
 from .filters import AppointmentFilter
+from .calendar_sync import sync as calendar_sync
+from . import push
+from .counters import patient_stats
+from .notifications import mark_read, unread_count, window_start
+from .exports import enqueue as enqueue_export
+from .price_list import price_list_response
+from .scheduling import book_many, calendar_window, free_slots
+from .report_cache import cache_stats as report_cache_stats, cached_report
+from .reports import (
+    XLSX_CONTENT_TYPE,
+    analytics_report,
+    day_start,
+    detailed_report_queryset,
+    detailed_report_xlsx,
+    doctor_close_report,
+    doctor_close_xlsx,
+    RunningPaymentTotals,
+    payment_totals,
+    summary_report,
+    summary_xlsx,
+)
+from .streaming import StreamingReportMixin, stream_response
+from .pagination import (
+    StartTimeCursorPagination,
+    CalendarCursorPagination,
+    CreatedAtCursorPagination,
+)
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
 from .serializers import VerifyResetCodeSerializer
-from django.db.models import Sum, F, DecimalField, ExpressionWrapper
-from django.db.models import Count, Q
-from datetime import timedelta, date
-import openpyxl
-from django.http import HttpResponse
-from django.db.models.functions import TruncDate
+import os
+from asgiref.sync import sync_to_async
+from django.http import FileResponse, JsonResponse, StreamingHttpResponse
+from django.views import View
+from django.shortcuts import get_object_or_404
 
 
 
@@ -64,6 +90,7 @@ class AdminAppointmentListAPIView(generics.ListAPIView):
     serializer_class = AdminAppointmentListSerializer
     permission_classes = [IsAuthenticated, IsAdmin]
     filter_backends = [DjangoFilterBackend]
+    pagination_class = StartTimeCursorPagination
 
     filterset_fields = {
         "doctor": ["exact"],
@@ -74,7 +101,7 @@ class AdminAppointmentListAPIView(generics.ListAPIView):
         return (
             Appointment.objects
             .select_related("patient", "doctor__user")
-            .prefetch_related("payments")
+            .with_last_payment()
             .order_by("-start_time")
         )
 
@@ -119,20 +146,16 @@ class AdminPatientAppointmentHistoryAPIView(APIView):
             .order_by("-created_at")
         )
 
-        # 🔹 статистика (то, что ты просил)
-        stats = {
-            "total": qs.count(),
-            "queue": qs.filter(status="queue").count(),
-            "completed": qs.filter(status="completed").count(),
-            "cancelled": qs.filter(status="cancelled").count(),
-        }
+        # 🔹 статистика (то, что ты просил) — из счётчиков пациента
+        stats = patient_stats(patient_id)
 
-        data = {
-            "stats": stats,
-            "results": AdminPatientAppointmentHistorySerializer(qs, many=True).data
-        }
+        paginator = CreatedAtCursorPagination()
+        page = paginator.paginate_queryset(qs, request, view=self)
 
-        return Response(data)
+        return paginator.get_paginated_response(
+            AdminPatientAppointmentHistorySerializer(page, many=True).data,
+            stats=stats,
+        )
 
 class AdminAppointmentDeleteAPIView(generics.DestroyAPIView):
     queryset = Appointment.objects.all()
@@ -157,23 +180,20 @@ class AdminPatientVisitHistoryAPIView(APIView):
             .order_by("-created_at")
         )
 
-        # 🔹 общая статистика (как на макете)
-        all_qs = Appointment.objects.filter(patient_id=patient_id)
+        # 🔹 общая статистика (как на макете): total — только визиты
+        stats = patient_stats(patient_id)
+        stats["total"] = stats["completed"]
 
-        stats = {
-            "total": all_qs.filter(status="completed").count(),
-            "queue": all_qs.filter(status="queue").count(),
-            "completed": all_qs.filter(status="completed").count(),
-            "cancelled": all_qs.filter(status="cancelled").count(),
-        }
+        paginator = CreatedAtCursorPagination()
+        page = paginator.paginate_queryset(qs, request, view=self)
 
-        return Response({
-            "stats": stats,
-            "results": AdminPatientVisitHistorySerializer(qs, many=True).data
-        })
+        return paginator.get_paginated_response(
+            AdminPatientVisitHistorySerializer(page, many=True).data,
+            stats=stats,
+        )
 
 
-class AdminPatientPaymentAPIView(APIView):
+class AdminPatientPaymentAPIView(StreamingReportMixin, APIView):
     permission_classes = [IsAuthenticated, IsAdmin]
 
     def get(self, request, patient_id):
@@ -185,25 +205,40 @@ class AdminPatientPaymentAPIView(APIView):
                 "appointment__doctor__user",
                 "appointment__service",
             )
-            .order_by("-created_at")
+            .order_by("-created_at", "-id")
+        )
+
+        fmt = self.stream_format()
+        if fmt:
+            running = RunningPaymentTotals()
+            return stream_response(
+                fmt,
+                map(
+                    AdminPatientPaymentSerializer().to_representation,
+                    running.track(qs),
+                ),
+                lambda: _patient_payment_summary(running.as_dict()),
+                f"patient_{patient_id}_payments",
+            )
+
+        totals = payment_totals(qs)
+
+        paginator = CreatedAtCursorPagination()
+        page = paginator.paginate_queryset(qs, request, view=self)
+
+        return paginator.get_paginated_response(
+            AdminPatientPaymentSerializer(page, many=True).data,
+            summary=_patient_payment_summary(totals),
         )
 
-        total = qs.aggregate(total=Sum("amount"))["total"] or 0
-        cash = qs.filter(method="cash").aggregate(
-            total=Sum("amount")
-        )["total"] or 0
-        card = qs.filter(method="card").aggregate(
-            total=Sum("amount")
-        )["total"] or 0
 
-        return Response({
-            "summary": {
-                "total": total,
-                "cash": cash,
-                "card": card,
-            },
-            "results": AdminPatientPaymentSerializer(qs, many=True).data
-        })
+def _patient_payment_summary(totals):
+    return {
+        "total": totals["total_sum"],
+        "cash": totals["cash"],
+        "card": totals["card"],
+    }
+
 
 class AdminPatientDetailAPIView(generics.RetrieveAPIView):
     queryset = Patient.objects.all()
@@ -258,397 +293,181 @@ class AdminAnalyticsAPIView(APIView):
     permission_classes = [IsAuthenticated, IsAdmin]
 
     def get(self, request):
-        period = request.query_params.get("period", "week")
-
-        today = date.today()
-
-        if period == "month":
-            start_date = today - timedelta(days=30)
-        elif period == "day":
-            start_date = today - timedelta(days=1)
-        else:  # week
-            start_date = today - timedelta(days=7)
-
-        # ===== ВРАЧИ =====
-        doctors_count = Doctor.objects.count()
-
-        # ===== ЗАПИСИ =====
-        qs = Appointment.objects.filter(
-            created_at__date__gte=start_date
-        )
-
-        total_appointments = qs.count()
-        cancelled = qs.filter(status="cancelled").count()
-
-        # рост / падение (примитивно, но честно)
-        growth_percent = round(
-            (total_appointments / max(1, cancelled)) * 10, 1
-        )
-        decline_percent = round(
-            (cancelled / max(1, total_appointments)) * 10, 1
-        )
-
-        # ===== КЛИЕНТЫ =====
-        total_patients = qs.values("patient").distinct().count()
-
-        primary = (
-            Patient.objects
-            .annotate(cnt=Count("appointments"))
-            .filter(cnt=1)
-            .count()
-        )
-        repeat = max(0, total_patients - primary)
-
-        primary_percent = int((primary / max(1, total_patients)) * 100)
-        repeat_percent = 100 - primary_percent
-
-        # ===== ГРАФИК =====
-        chart = (
-            qs.values("created_at__date")
-            .annotate(
-                total=Count("id"),
-                cancelled=Count("id", filter=Q(status="cancelled"))
-            )
-            .order_by("created_at__date")
+        return Response(
+            analytics_report(request.query_params.get("period", "week"))
         )
 
-        chart_data = []
-        for item in chart:
-            chart_data.append({
-                "date": item["created_at__date"],
-                "total": item["total"],
-                "cancelled": qs.filter(
-                    created_at__date=item["created_at__date"],
-                    status="cancelled"
-                ).count()
-            })
-
-        return Response({
-            "growth_percent": growth_percent,
-            "decline_percent": -decline_percent,
-            "doctors_count": doctors_count,
-
-            "total_patients": total_patients,
-            "primary_percent": primary_percent,
-            "repeat_percent": repeat_percent,
-
-            "chart": chart_data
-        })
-
-class AdminDetailedReportAPIView(APIView):
+class AdminDetailedReportAPIView(StreamingReportMixin, APIView):
     permission_classes = [IsAuthenticated, IsAdmin]
 
     def get(self, request):
-        qs = Payment.objects.select_related(
-            "appointment__patient",
-            "appointment__service",
-            "appointment__department",
-            "appointment__doctor__user",
-        )
-
-        # ===== ФИЛЬТРЫ =====
-        doctor_id = request.query_params.get("doctor")
-        department_id = request.query_params.get("department")
-        search = request.query_params.get("search")
-        period = request.query_params.get("period")  # day | week | month
-        date_from = request.query_params.get("date_from")
-        date_to = request.query_params.get("date_to")
-
-        if doctor_id:
-            qs = qs.filter(appointment__doctor_id=doctor_id)
-
-        if department_id:
-            qs = qs.filter(appointment__department_id=department_id)
-
-        if search:
-            qs = qs.filter(
-                appointment__patient__full_name__icontains=search
+        qs = detailed_report_queryset(request.query_params)
+
+        # ===== ПОТОК (format=ndjson|csv) =====
+        fmt = self.stream_format()
+        if fmt:
+            totals = RunningPaymentTotals()
+            return stream_response(
+                fmt,
+                map(
+                    AdminDetailedReportRowSerializer().to_representation,
+                    totals.track(qs.order_by("-created_at", "-id")),
+                ),
+                totals.as_dict,
+                "detailed_report",
             )
 
-        # ===== ПЕРИОД =====
-        today = date.today()
-
-        if period == "day":
-            qs = qs.filter(created_at__date=today)
+        paginator = CreatedAtCursorPagination()
 
-        elif period == "week":
-            qs = qs.filter(created_at__date__gte=today - timedelta(days=7))
+        def build():
+            # ===== ИТОГИ =====
+            totals = payment_totals(qs)
+            page = paginator.paginate_queryset(qs, request, view=self)
 
-        elif period == "month":
-            qs = qs.filter(created_at__date__gte=today - timedelta(days=30))
-
-        # ===== КАЛЕНДАРЬ =====
-        if date_from and date_to:
-            qs = qs.filter(
-                created_at__date__gte=date_from,
-                created_at__date__lte=date_to
-            )
-
-        # ===== ИТОГИ =====
-        total_count = qs.count()
-        total_sum = qs.aggregate(total=Sum("amount"))["total"] or 0
-        cash_sum = qs.filter(method="cash").aggregate(
-            s=Sum("amount")
-        )["s"] or 0
-        card_sum = qs.filter(method="card").aggregate(
-            s=Sum("amount")
-        )["s"] or 0
+            # в кэше — позиции курсоров, не ссылки: адрес (хост, схема)
+            # у запросов к одной записи кэша разный
+            return {
+                "cursors": paginator.get_cursors(),
+                "summary": totals,
+                "results": AdminDetailedReportRowSerializer(page, many=True).data,
+            }
 
-        return Response({
-            "results": AdminDetailedReportRowSerializer(qs, many=True).data,
-            "summary": {
-                "total_count": total_count,
-                "total_sum": total_sum,
-                "cash": cash_sum,
-                "card": card_sum,
+        def render(data):
+            return {
+                **paginator.get_links(data["cursors"], request),
+                "summary": data["summary"],
+                "results": data["results"],
             }
-        })
+
+        return cached_report(request, "detailed", build, render)
 
 class AdminDetailedReportExcelAPIView(APIView):
     permission_classes = [IsAuthenticated, IsAdmin]
 
     def get(self, request):
-        qs = Payment.objects.select_related(
-            "appointment__patient",
-            "appointment__service",
-            "appointment__doctor__user",
-        )
+        # те же фильтры, что и у AdminDetailedReportAPIView
+        qs = detailed_report_queryset(request.query_params)
 
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Отчёт"
-
-        ws.append([
-            "Дата", "Пациент", "Услуга",
-            "Тип оплаты", "Сумма", "Врач"
-        ])
-
-        for p in qs:
-            ws.append([
-                p.created_at.strftime("%d.%m.%Y"),
-                p.appointment.patient.full_name,
-                p.appointment.service.name,
-                "Наличные" if p.method == "cash" else "Безналичные",
-                float(p.amount),
-                p.appointment.doctor.user.get_full_name(),
-            ])
-
-        response = HttpResponse(
-            content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        return FileResponse(
+            detailed_report_xlsx(qs),
+            as_attachment=True,
+            filename="report.xlsx",
+            content_type=XLSX_CONTENT_TYPE,
         )
-        response["Content-Disposition"] = 'attachment; filename="report.xlsx"'
-        wb.save(response)
-
-        return response
 
-class AdminDoctorCloseReportAPIView(APIView):
+class AdminDoctorCloseReportAPIView(StreamingReportMixin, APIView):
     permission_classes = [IsAuthenticated, IsAdmin]
 
     def get(self, request):
         doctor_id = request.query_params.get("doctor")
         period = request.query_params.get("period", "month")
 
-        qs = Payment.objects.filter(
-            appointment__status="completed"
-        )
-
-        if doctor_id:
-            qs = qs.filter(
-                appointment__doctor_id=doctor_id
-            )
-
-        # ===== ПЕРИОД =====
-        today = date.today()
-
-        if period == "day":
-            qs = qs.filter(created_at__date=today)
-
-        elif period == "month":
-            qs = qs.filter(
-                created_at__year=today.year,
-                created_at__month=today.month
+        rows = doctor_close_report(doctor_id, period)
+        totals = {"doctor": doctor_id, "total_sum": 0}
+
+        def numbered():
+            for idx, row in enumerate(rows.iterator(), start=1):
+                totals["total_sum"] += row["total_sum"]
+                yield {
+                    "id": idx,
+                    "date": row["date"],
+                    "total_sum": row["total_sum"]
+                }
+
+        fmt = self.stream_format()
+        if fmt:
+            return stream_response(
+                fmt, numbered(), lambda: totals, "doctor_close_report"
             )
 
-        # ===== ГРУППИРОВКА =====
-        rows = (
-            qs
-            .annotate(day=TruncDate("created_at"))
-            .values("day")
-            .annotate(total_sum=Sum("amount"))
-            .order_by("day")
-        )
-
-        data = []
-        total = 0
-
-        for idx, row in enumerate(rows, start=1):
-            total += row["total_sum"]
-            data.append({
-                "id": idx,
-                "date": row["day"],
-                "total_sum": row["total_sum"]
-            })
+        data = list(numbered())
 
         return Response({
             "doctor": doctor_id,
             "results": data,
-            "total_sum": total
+            "total_sum": totals["total_sum"]
         })
 
 class AdminDoctorCloseReportExcelAPIView(APIView):
     permission_classes = [IsAuthenticated, IsAdmin]
 
     def get(self, request):
-        doctor_id = request.query_params.get("doctor")
-
-        qs = Payment.objects.filter(
-            appointment__status="completed"
+        return FileResponse(
+            doctor_close_xlsx(request.query_params.get("doctor")),
+            as_attachment=True,
+            filename="doctor_close_report.xlsx",
+            content_type=XLSX_CONTENT_TYPE,
         )
 
-        if doctor_id:
-            qs = qs.filter(
-                appointment__doctor_id=doctor_id
-            )
-
-        rows = (
-            qs
-            .annotate(day=TruncDate("created_at"))
-            .values("day")
-            .annotate(total_sum=Sum("amount"))
-            .order_by("day")
-        )
-
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Закрытия врача"
-
-        ws.append(["№", "Дата", "Сумма"])
-
-        total = 0
-        for idx, row in enumerate(rows, start=1):
-            ws.append([
-                idx,
-                row["day"].strftime("%d.%m.%Y"),
-                float(row["total_sum"])
-            ])
-            total += row["total_sum"]
-
-        ws.append(["", "Итого:", float(total)])
-
-        response = HttpResponse(
-            content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
-        response["Content-Disposition"] = (
-            'attachment; filename="doctor_close_report.xlsx"'
-        )
-
-        wb.save(response)
-        return response
-
 class AdminSummaryReportAPIView(APIView):
     permission_classes = [IsAuthenticated, IsAdmin]
 
     def get(self, request):
-        date_from = request.query_params.get("date_from")
-        date_to = request.query_params.get("date_to")
-
-        qs = Payment.objects.filter(
-            appointment__status="completed"
-        )
-
-        if date_from:
-            qs = qs.filter(created_at__date__gte=date_from)
-
-        if date_to:
-            qs = qs.filter(created_at__date__lte=date_to)
-
-        # ===== ОБЩИЕ СУММЫ =====
-        total_cash = qs.filter(method="cash").aggregate(
-            s=Sum("amount")
-        )["s"] or 0
-
-        total_card = qs.filter(method="card").aggregate(
-            s=Sum("amount")
-        )["s"] or 0
-
-        total_sum = total_cash + total_card
-
-        # ===== БОНУС ВРАЧЕЙ =====
-        doctor_bonus_expr = ExpressionWrapper(
-            F("amount") * F("appointment__doctor__bonus_percent") / 100,
-            output_field=DecimalField(max_digits=12, decimal_places=2)
-        )
-
-        doctors_cash = qs.filter(method="cash").aggregate(
-            s=Sum(doctor_bonus_expr)
-        )["s"] or 0
+        return cached_report(request, "summary", lambda: summary_report(
+            date_from=request.query_params.get("date_from"),
+            date_to=request.query_params.get("date_to"),
+        ))
 
-        doctors_card = qs.filter(method="card").aggregate(
-            s=Sum(doctor_bonus_expr)
-        )["s"] or 0
-
-        doctors_total = doctors_cash + doctors_card
-
-        # ===== КЛИНИКА =====
-        clinic_cash = total_cash - doctors_cash
-        clinic_card = total_card - doctors_card
-
-        return Response({
-            "total_cash": total_cash,
-            "total_card": total_card,
-            "total_sum": total_sum,
-
-            "doctors_total": doctors_total,
-            "doctors_cash": doctors_cash,
-            "doctors_card": doctors_card,
+class AdminReportCacheStatsAPIView(APIView):
+    permission_classes = [IsAuthenticated, IsAdmin]
 
-            "clinic_cash": clinic_cash,
-            "clinic_card": clinic_card,
-        })
+    def get(self, request):
+        return Response(report_cache_stats())
 
 class AdminSummaryReportExcelAPIView(APIView):
     permission_classes = [IsAuthenticated, IsAdmin]
 
     def get(self, request):
-        api = AdminSummaryReportAPIView()
-        api.request = request
-        data = api.get(request).data
-
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Сводный отчет"
+        return FileResponse(
+            summary_xlsx(
+                date_from=request.query_params.get("date_from"),
+                date_to=request.query_params.get("date_to"),
+            ),
+            as_attachment=True,
+            filename="summary_report.xlsx",
+            content_type=XLSX_CONTENT_TYPE,
+        )
+
+# ===== ФОНОВЫЕ ВЫГРУЗКИ =====
+class AdminReportExportCreateAPIView(APIView):
+    permission_classes = [IsAuthenticated, IsAdmin]
 
-        ws.append(["Показатель", "Сумма"])
+    def post(self, request):
+        serializer = ReportExportCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
 
-        ws.append(["Оплачено наличными", data["total_cash"]])
-        ws.append(["Оплачено безналичными", data["total_card"]])
-        ws.append(["Общая сумма", data["total_sum"]])
+        job, created = enqueue_export(
+            serializer.validated_data["kind"],
+            serializer.validated_data["params"],
+            user=request.user,
+        )
+        return Response(
+            ReportExportSerializer(job, context={"request": request}).data,
+            status=status.HTTP_202_ACCEPTED if created else status.HTTP_200_OK
+        )
 
-        ws.append([])
-        ws.append(["Врачам всего", data["doctors_total"]])
-        ws.append(["Врачам наличными", data["doctors_cash"]])
-        ws.append(["Врачам безналичными", data["doctors_card"]])
+class AdminReportExportDetailAPIView(generics.RetrieveAPIView):
+    queryset = ReportExport.objects.all()
+    serializer_class = ReportExportSerializer
+    permission_classes = [IsAuthenticated, IsAdmin]
 
-        ws.append([])
-        ws.append(["Клиника наличными", data["clinic_cash"]])
-        ws.append(["Клиника безналичными", data["clinic_card"]])
+class AdminReportExportDownloadAPIView(APIView):
+    permission_classes = [IsAuthenticated, IsAdmin]
 
-        response = HttpResponse(
-            content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    def get(self, request, pk):
+        job = get_object_or_404(ReportExport, pk=pk, status="done")
+        return FileResponse(
+            job.file.open("rb"),
+            as_attachment=True,
+            filename=os.path.basename(job.file.name),
+            content_type=XLSX_CONTENT_TYPE,
         )
-        response["Content-Disposition"] = (
-            'attachment; filename="summary_report.xlsx"'
-        )
-
-        wb.save(response)
-        return response
 
 class AdminCalendarListAPIView(APIView):
     permission_classes = [IsAuthenticated, IsAdmin]
 
     def get(self, request):
-        start = request.query_params.get("start")
-        end = request.query_params.get("end")
+        start, end = calendar_window(request.query_params)
         doctor_id = request.query_params.get("doctor")
         department_id = request.query_params.get("department")
 
@@ -657,13 +476,7 @@ class AdminCalendarListAPIView(APIView):
             "doctor__user",
             "service",
             "department",
-        )
-
-        if start and end:
-            qs = qs.filter(
-                start_time__date__gte=start,
-                start_time__date__lte=end
-            )
+        ).filter(start_time__gte=start, start_time__lt=end)
 
         if doctor_id:
             qs = qs.filter(doctor_id=doctor_id)
@@ -671,16 +484,67 @@ class AdminCalendarListAPIView(APIView):
         if department_id:
             qs = qs.filter(department_id=department_id)
 
-        serializer = AdminCalendarAppointmentSerializer(qs, many=True)
-        return Response(serializer.data)
+        paginator = CalendarCursorPagination()
+        page = paginator.paginate_queryset(qs, request, view=self)
+
+        serializer = AdminCalendarAppointmentSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+class AdminCalendarSyncAPIView(APIView):
+    """
+    Изменения календаря после ?token= (sync_token прошлого ответа):
+    changed — записи целиком, deleted — id удалённых.
+    """
+    permission_classes = [IsAuthenticated, IsAdmin]
+    serializer_class = AdminCalendarAppointmentSerializer
+
+    def get_doctor_id(self):
+        return None
+
+    def get(self, request):
+        return Response(calendar_sync(
+            request.query_params.get("token"),
+            self.serializer_class,
+            doctor_id=self.get_doctor_id(),
+        ))
+
+class AdminEventStreamView(View):
+    """
+    Поток событий календаря и уведомлений (text/event-stream) вместо
+    опроса списков. Токен — в Authorization или ?token=. Обслуживается
+    ASGI-сервером (mysite.asgi): под WSGI поток занимает воркер целиком.
+    """
+    role = "admin"
+
+    def get_channels(self, user):
+        return [push.CALENDAR, push.user_channel(user.pk)]
+
+    async def get(self, request):
+        user = await sync_to_async(push.stream_user)(request)
+        if user is None:
+            return JsonResponse(
+                {"detail": "Учетные данные не были предоставлены."},
+                status=status.HTTP_401_UNAUTHORIZED,
+            )
+        if user.role != self.role:
+            return JsonResponse(
+                {"detail": "У вас недостаточно прав для выполнения данного действия."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        channels = await sync_to_async(self.get_channels)(user)
+
+        response = StreamingHttpResponse(
+            push.stream(channels), content_type="text/event-stream"
+        )
+        response["Cache-Control"] = "no-cache"
+        # nginx не буферизует поток
+        response["X-Accel-Buffering"] = "no"
+        return response
 
 class AdminCalendarCreateAPIView(generics.CreateAPIView):
     serializer_class = AdminCalendarCreateSerializer
     permission_classes = [IsAuthenticated, IsAdmin]
 
-    def perform_create(self, serializer):
-        serializer.save(registrar=self.request.user)
-
 class AdminCalendarUpdateAPIView(generics.UpdateAPIView):
     queryset = Appointment.objects.all()
     serializer_class = AdminCalendarCreateSerializer
@@ -690,20 +554,46 @@ class AdminCalendarDeleteAPIView(generics.DestroyAPIView):
     queryset = Appointment.objects.all()
     permission_classes = [IsAuthenticated, IsAdmin]
 
+class AdminCalendarBulkCreateAPIView(APIView):
+    """
+    Серия записей: slots — список {start_time, end_time} или recurrence —
+    правило повтора. Создаются свободные слоты, занятые возвращаются в
+    rejected с причиной.
+    """
+    permission_classes = [IsAuthenticated, IsAdmin]
+
+    def get_registrar(self):
+        return None
+
+    def post(self, request):
+        serializer = AppointmentBulkCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        result = book_many(registrar=self.get_registrar(), **serializer.validated_data)
+        return Response(
+            result,
+            status=status.HTTP_201_CREATED if result["created"] else status.HTTP_409_CONFLICT,
+        )
+
+class AdminFreeSlotsAPIView(APIView):
+    """
+    Свободные слоты врачей отделения (или услуги) за период:
+    ?department= | ?service=, date_from, date_to, duration (минуты).
+    """
+    permission_classes = [IsAuthenticated, IsAdmin]
+
+    def get(self, request):
+        params = FreeSlotQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        return Response(free_slots(**params.validated_data))
+
 # ===== PRICE LIST =====
 
 class AdminPriceListAPIView(APIView):
     permission_classes = [IsAuthenticated, IsAdmin]
 
     def get(self, request):
-        qs = (
-            Department.objects
-            .prefetch_related("services")
-            .order_by("name")
-        )
-
-        return Response(
-            AdminPriceListDepartmentSerializer(qs, many=True).data
+        return price_list_response(
+            request, "admin", AdminPriceListDepartmentSerializer
         )
 
 
@@ -730,6 +620,7 @@ class ReceptionistAppointmentListAPIView(generics.ListAPIView):
     serializer_class = ReceptionistAppointmentListSerializer
     permission_classes = [IsAuthenticated, IsReceptionist]
     filter_backends = [DjangoFilterBackend]
+    pagination_class = StartTimeCursorPagination
 
     filterset_fields = {
         "doctor": ["exact"],
@@ -741,7 +632,7 @@ class ReceptionistAppointmentListAPIView(generics.ListAPIView):
         return (
             Appointment.objects
             .select_related("patient", "doctor__user")
-            .prefetch_related("payments")
+            .with_last_payment()
             .order_by("-start_time")
         )
 
@@ -779,11 +670,14 @@ class ReceptionistAppointmentEditAPIView(generics.RetrieveUpdateAPIView):
 class ReceptionistPatientAppointmentHistoryAPIView(generics.ListAPIView):
     serializer_class = ReceptionistPatientAppointmentHistorySerializer
     permission_classes = [IsAuthenticated, IsReceptionist]
+    pagination_class = CreatedAtCursorPagination
 
     def get_queryset(self):
         # ✅ Показываем ВСЕ записи пациента
         return Appointment.objects.filter(
             patient_id=self.kwargs["patient_id"]
+        ).select_related(
+            "department", "doctor__user", "service"
         ).order_by("-created_at")
 
 
@@ -791,11 +685,16 @@ class ReceptionistPatientAppointmentHistoryAPIView(generics.ListAPIView):
 class ReceptionistPatientPaymentAPIView(generics.ListAPIView):
     serializer_class = ReceptionistPatientPaymentSerializer
     permission_classes = [IsAuthenticated, IsReceptionist]
+    pagination_class = CreatedAtCursorPagination
 
     def get_queryset(self):
         # ✅ Показываем ВСЕ платежи пациента
         return Payment.objects.filter(
             appointment__patient_id=self.kwargs["patient_id"]
+        ).select_related(
+            "appointment__department",
+            "appointment__doctor__user",
+            "appointment__service",
         ).order_by("-created_at")
 
 
@@ -855,9 +754,8 @@ class ReceptionistPriceListAPIView(APIView):
     permission_classes = [IsAuthenticated, IsReceptionist]
 
     def get(self, request):
-        qs = Department.objects.prefetch_related("services")
-        return Response(
-            ReceptionistPriceListDepartmentSerializer(qs, many=True).data
+        return price_list_response(
+            request, "receptionist", ReceptionistPriceListDepartmentSerializer
         )
 
 class ReceptionistDetailedReportAPIView(
@@ -876,6 +774,12 @@ class ReceptionistCalendarListAPIView(
 ):
     permission_classes = [IsAuthenticated, IsReceptionist]
 
+class ReceptionistCalendarSyncAPIView(AdminCalendarSyncAPIView):
+    permission_classes = [IsAuthenticated, IsReceptionist]
+
+class ReceptionistEventStreamView(AdminEventStreamView):
+    role = "receptionist"
+
 class ReceptionistCalendarCreateAPIView(generics.CreateAPIView):
     serializer_class = ReceptionistCalendarCreateSerializer
     permission_classes = [IsAuthenticated, IsReceptionist]
@@ -892,6 +796,15 @@ class ReceptionistCalendarDeleteAPIView(generics.DestroyAPIView):
     queryset = Appointment.objects.all()
     permission_classes = [IsAuthenticated, IsReceptionist]
 
+class ReceptionistCalendarBulkCreateAPIView(AdminCalendarBulkCreateAPIView):
+    permission_classes = [IsAuthenticated, IsReceptionist]
+
+    def get_registrar(self):
+        return self.request.user
+
+class ReceptionistFreeSlotsAPIView(AdminFreeSlotsAPIView):
+    permission_classes = [IsAuthenticated, IsReceptionist]
+
 
 """Doctor"""
 
@@ -899,13 +812,35 @@ class ReceptionistCalendarDeleteAPIView(generics.DestroyAPIView):
 class DoctorCalendarAPIView(generics.ListAPIView):
     serializer_class = DoctorCalendarSerializer
     permission_classes = [IsAuthenticated, IsDoctor]
+    pagination_class = CalendarCursorPagination
 
     def get_queryset(self):
+        start, end = calendar_window(self.request.query_params)
         return Appointment.objects.filter(
-            doctor__user=self.request.user
+            doctor__user=self.request.user,
+            start_time__gte=start,
+            start_time__lt=end,
         ).select_related(
             "patient", "doctor__user", "service", "department"
-        ).prefetch_related("payments")
+        )
+
+
+class DoctorCalendarSyncAPIView(AdminCalendarSyncAPIView):
+    permission_classes = [IsAuthenticated, IsDoctor]
+    serializer_class = DoctorCalendarSerializer
+
+    def get_doctor_id(self):
+        doctor = get_object_or_404(Doctor.objects.only("pk"), user=self.request.user)
+        return doctor.pk
+
+
+class DoctorEventStreamView(AdminEventStreamView):
+    """Записи своего врача и свои уведомления."""
+    role = "doctor"
+
+    def get_channels(self, user):
+        doctor = get_object_or_404(Doctor.objects.only("pk"), user=user)
+        return [push.doctor_channel(doctor.pk), push.user_channel(user.pk)]
 
 
 # ✅ ПРАВИЛЬНО
@@ -925,13 +860,14 @@ class DoctorProfileAPIView(generics.RetrieveUpdateAPIView):
     permission_classes = [IsAuthenticated, IsDoctor]
 
     def get_object(self):
-        return Doctor.objects.get(user=self.request.user)
+        return Doctor.objects.select_related("user").get(user=self.request.user)
 
 
 # ✅ ПРАВИЛЬНО
 class DoctorPatientAppointmentsAPIView(generics.ListAPIView):
     serializer_class = DoctorPatientAppointmentSerializer
     permission_classes = [IsAuthenticated, IsDoctor]
+    pagination_class = CreatedAtCursorPagination
 
     def get_queryset(self):
         return Appointment.objects.filter(
@@ -944,6 +880,7 @@ class DoctorPatientAppointmentsAPIView(generics.ListAPIView):
 class DoctorPatientPaymentsAPIView(generics.ListAPIView):
     serializer_class = DoctorPatientPaymentSerializer
     permission_classes = [IsAuthenticated, IsDoctor]
+    pagination_class = CreatedAtCursorPagination
 
     def get_queryset(self):
         return Payment.objects.filter(
@@ -966,17 +903,36 @@ class DoctorPatientDetailAPIView(generics.RetrieveAPIView):
 
 # ✅ ПРАВИЛЬНО
 class DoctorNotificationListAPIView(APIView):
+    """
+    По умолчанию — горячее окно (notifications.HOT_WINDOW и все
+    непрочитанные); ?since=YYYY-MM-DD — с этого дня.
+    """
     permission_classes = [IsAuthenticated, IsDoctor]
 
     def get(self, request):
+        unread = unread_count(request.user.pk)
+        since = request.query_params.get("since")
+        since = day_start(since) if since else window_start(request.user.pk, unread)
+
         qs = Notification.objects.filter(
-            recipient=request.user
+            recipient=request.user, created_at__gte=since
         ).select_related("appointment__patient", "appointment__department")
 
-        return Response({
-            "unread_count": qs.filter(is_read=False).count(),
-            "results": DoctorNotificationSerializer(qs, many=True).data
-        })
+        paginator = CreatedAtCursorPagination()
+        page = paginator.paginate_queryset(qs, request, view=self)
+
+        return paginator.get_paginated_response(
+            DoctorNotificationSerializer(page, many=True).data,
+            unread_count=unread,
+        )
+
+
+class DoctorNotificationUnreadCountAPIView(APIView):
+    """Только число непрочитанных — для опроса колокольчика."""
+    permission_classes = [IsAuthenticated, IsDoctor]
+
+    def get(self, request):
+        return Response({"unread_count": unread_count(request.user.pk)})
 
 
 # ✅ ИСПРАВЛЕНО: Добавлена обработка ошибок
@@ -984,18 +940,29 @@ class DoctorNotificationReadAPIView(APIView):
     permission_classes = [IsAuthenticated, IsDoctor]
 
     def post(self, request, pk):
-        try:
-            notification = Notification.objects.get(
-                pk=pk,
-                recipient=request.user
-            )
-            notification.is_read = True
-            notification.save(update_fields=["is_read"])
-
-            return Response({"status": "ok"})
-
-        except Notification.DoesNotExist:
+        updated = mark_read(request.user, ids=[pk])
+        if not updated and not Notification.objects.filter(
+            pk=pk, recipient=request.user
+        ).exists():
             return Response(
                 {"error": "Уведомление не найдено"},
                 status=status.HTTP_404_NOT_FOUND
-            )
\ No newline at end of file
+            )
+        return Response({"status": "ok"})
+
+
+class DoctorNotificationReadManyAPIView(APIView):
+    """
+    Отметить прочитанными одним UPDATE: {"ids": [...]} и/или
+    {"before": <время>} — всё, что пришло не позже.
+    """
+    permission_classes = [IsAuthenticated, IsDoctor]
+
+    def post(self, request):
+        serializer = NotificationMarkReadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        updated = mark_read(request.user, **serializer.validated_data)
+        return Response({
+            "updated": updated,
+            "unread_count": unread_count(request.user.pk),
+        })
\ No newline at end of file
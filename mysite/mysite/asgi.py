@@ -5,6 +5,9 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+Обслуживает SSE-потоки /<роль>/events/ (сервис events в docker-compose,
+gunicorn с воркером uvicorn); остальное API — через WSGI.
 """
 
 import os
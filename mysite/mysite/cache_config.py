@@ -0,0 +1,65 @@
+"""
+Именованные кэши CRM из переменных окружения.
+
+CACHE_BACKEND:
+    redis      — общий для всех воркеров gunicorn (прод), CACHE_LOCATION=redis://...
+    memcached  — то же через pymemcache, CACHE_LOCATION=host:port
+    locmem     — по умолчанию: только в пределах процесса (runserver, тесты)
+    file       — каталог CACHE_LOCATION, общий для процессов одного узла
+    db         — таблицы в основной БД (нужен ./manage.py createcachetable)
+
+Блокировка get_or_compute (cache_utils.py) держится на атомарном
+cache.add: так у redis, memcached, db и locmem. У file add — проверка
+и запись двумя шагами, два процесса могут взять блокировку оба:
+защита от лавины там не гарантирована (значения при этом верные).
+"""
+import os
+
+
+# алиас -> срок жизни записей по умолчанию (None — пока не сброшено)
+CACHE_TIMEOUTS = {
+    "default": 300,
+    "reports": int(os.getenv("REPORT_CACHE_TIMEOUT", 600)),
+    "auth": int(os.getenv("AUTH_USER_CACHE_TIMEOUT", 60)),
+    "price-list": None,
+}
+
+
+def build_caches(backend, location):
+    return {
+        alias: _cache(backend, location, alias, timeout)
+        for alias, timeout in CACHE_TIMEOUTS.items()
+    }
+
+
+def _cache(backend, location, alias, timeout):
+    config = {"TIMEOUT": timeout, "KEY_PREFIX": f"crm:{alias}"}
+
+    if backend == "redis":
+        config.update(
+            BACKEND="django.core.cache.backends.redis.RedisCache",
+            LOCATION=location,
+        )
+    elif backend == "memcached":
+        config.update(
+            BACKEND="django.core.cache.backends.memcached.PyMemcacheCache",
+            LOCATION=location,
+        )
+    elif backend == "file":
+        config.update(
+            BACKEND="django.core.cache.backends.filebased.FileBasedCache",
+            LOCATION=os.path.join(location, alias),
+        )
+    elif backend == "db":
+        config.update(
+            BACKEND="django.core.cache.backends.db.DatabaseCache",
+            LOCATION=f"crm_cache_{alias.replace('-', '_')}",
+        )
+    elif backend == "locmem":
+        config.update(
+            BACKEND="django.core.cache.backends.locmem.LocMemCache",
+            LOCATION=f"crm-{alias}",
+        )
+    else:
+        raise ValueError(f"CACHE_BACKEND: неизвестный бэкенд {backend!r}")
+    return config
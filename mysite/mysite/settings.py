@@ -83,6 +83,27 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Кэши default, reports, auth, price-list — см. mysite/cache_config.py
+
+from .cache_config import build_caches
+
+# по умолчанию locmem: один процесс (runserver). Несколько процессов
+# (gunicorn, воркеры) — redis, как в docker-compose.yml
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'locmem')
+CACHE_LOCATION = os.getenv('CACHE_LOCATION', os.path.join(BASE_DIR, 'cache'))
+
+CACHES = build_caches(CACHE_BACKEND, CACHE_LOCATION)
+
+
+# Push-события по SSE (crm_app/push.py): local — в пределах процесса,
+# redis — когда поток событий и издатели в разных процессах
+
+PUSH_BROKER = os.getenv('PUSH_BROKER', 'local')
+PUSH_LOCATION = os.getenv('PUSH_LOCATION', 'redis://localhost:6379/0')
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -125,6 +146,9 @@ STATIC_URL = '/static/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# выгрузки отчётов — не в MEDIA_ROOT (его nginx раздаёт без авторизации)
+REPORT_EXPORT_ROOT = os.getenv('REPORT_EXPORT_ROOT', os.path.join(BASE_DIR, 'exports'))
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -162,11 +186,15 @@ AUTH_USER_MODEL = 'crm_app.UserProfile'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-    'rest_framework_simplejwt.authentication.JWTAuthentication',
+    'crm_app.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend']
 }
 
+# Курсорная пагинация списков (crm_app/pagination.py)
+CRM_PAGE_SIZE = int(os.getenv('CRM_PAGE_SIZE', 50))
+CRM_MAX_PAGE_SIZE = int(os.getenv('CRM_MAX_PAGE_SIZE', 500))
+
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=300),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=7),